@@ -14,10 +14,20 @@ FastAPI plugins
 from __future__ import absolute_import
 
 from ._redis import *  # noqa F401 F403
+from ._redis_lease import *  # noqa F401 F403
+from ._redis_nearcache import *  # noqa F401 F403
+from ._redis_pipeline import *  # noqa F401 F403
+from ._redis_replica import *  # noqa F401 F403
+from ._redis_scan import *  # noqa F401 F403
+from .cache import *  # noqa F401 F403
+from .codec import *  # noqa F401 F403
 from .control import *  # noqa F401 F403
 from .logger import *  # noqa F401 F403
+from .memoize import *  # noqa F401 F403
+from .memory import *  # noqa F401 F403
 from .middleware import *  # noqa F401 F403
 from .plugin import *  # noqa F401 F403
+from .response import *  # noqa F401 F403
 from .scheduler import *  # noqa F401 F403
 from .settings import *  # noqa F401 F403
 from .version import VERSION
@@ -40,9 +50,6 @@ __author__ = 'madkote <madkote(at)bluewin.ch>'
 __version__ = '.'.join(str(x) for x in VERSION)
 __copyright__ = 'Copyright 2023, madkote'
 
-# TODO: provide a generic cache type (redis, memcached, in-memory)
-#       and share some settings. Module/Sub-Pack cache
-
 # TODO: databases
 
 # TODO: mq - activemq, rabbitmq, kafka
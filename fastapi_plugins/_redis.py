@@ -4,16 +4,27 @@
 
 from __future__ import absolute_import
 
+import asyncio
 import enum
+import functools
+import logging
 import typing
 
 import fastapi
 import pydantic_settings
 import redis.asyncio as aioredis
+import redis.asyncio.cluster as aioredis_cluster
 import redis.asyncio.sentinel as aioredis_sentinel
 import starlette.requests
 import tenacity
 
+from ._redis_nearcache import NearCacheRedis, RedisNearCache, RedisTrackingMode
+from ._redis_pipeline import AutoPipelineRedis
+from ._redis_pool import (
+    InstrumentedConnectionPool, _cluster_node_stats, _pool_class, _warm_up_cluster_node
+)
+from ._redis_replica import RedisReadPolicy, ReplicaRoutingRedis
+from .codec import Codec, CodecType, CompressionType
 from .control import ControlHealthMixin
 from .plugin import Plugin, PluginError, PluginSettings
 from .utils import Annotated
@@ -23,6 +34,8 @@ __all__ = [
     'redis_plugin', 'depends_redis', 'TRedisPlugin'
 ]
 
+logger = logging.getLogger(__name__)
+
 
 class RedisError(PluginError):
     pass
@@ -33,7 +46,7 @@ class RedisType(str, enum.Enum):
     redis = 'redis'
     sentinel = 'sentinel'
     fakeredis = 'fakeredis'
-    # cluster = 'cluster'
+    cluster = 'cluster'
 
 
 class RedisSettings(PluginSettings):
@@ -47,19 +60,44 @@ class RedisSettings(PluginSettings):
     redis_db: typing.Optional[int] = None
     # redis_connection_timeout: int = 2
     #
-    # redis_pool_minsize: int = 1
+    redis_pool_minsize: int = 1
     # redis_pool_maxsize: int = None
     redis_max_connections: typing.Optional[int] = None
     redis_decode_responses: bool = True
     #
     redis_ttl: int = 3600
     #
+    redis_codec: CodecType = CodecType.json
+    redis_compression: CompressionType = CompressionType.none
+    redis_compression_threshold: int = 1024
+    redis_compression_level: typing.Optional[int] = None
+    redis_decode_codecs: typing.Optional[str] = None
+    #
+    redis_nearcache: bool = False
+    redis_nearcache_maxsize: int = 10000
+    redis_nearcache_mode: RedisTrackingMode = RedisTrackingMode.default
+    redis_nearcache_prefixes: typing.Optional[str] = None
+    #
+    redis_autopipeline: bool = False
+    redis_autopipeline_window: float = 0
+    redis_autopipeline_max_size: int = 100
+    #
+    redis_read_policy: RedisReadPolicy = RedisReadPolicy.master
+    redis_replica_urls: typing.Optional[str] = None
+    redis_replica_read_after_write: float = 0
+    #
     # TODO: xxx the customer validator does not work
     # redis_sentinels: typing.List = None
     redis_sentinels: typing.Optional[str] = None
     redis_sentinel_master: str = 'mymaster'
+    redis_sentinel_failover_watch: bool = True
+    #
+    redis_cluster_nodes: typing.Optional[str] = None
+    redis_cluster_read_from_replicas: bool = False
+    redis_cluster_reinitialize_steps: int = 5
+    redis_cluster_refresh_interval: float = 0
     #
-    # TODO: xxx - should be shared across caches
+    # shared across caches by `CACHE_PRESTART_*` of the cache plugin
     redis_prestart_tries: int = 60 * 5  # 5 min
     redis_prestart_wait: int = 1        # 1 second
 
@@ -73,44 +111,161 @@ class RedisSettings(PluginSettings):
 
     # TODO: xxx the customer validator does not work
     def get_sentinels(self) -> typing.List:
-        if self.redis_sentinels:
-            try:
-                return [
-                    (
-                        _conn.split(':')[0].strip(),
-                        int(_conn.split(':')[1].strip())
-                    )
-                    for _conn in self.redis_sentinels.split(',')
-                    if _conn.strip()
-                ]
-            except Exception as e:
-                raise RuntimeError(f'bad sentinels string :: {type(e)} :: {str(e)} :: {self.redis_sentinels}')  # noqa
+        return _parse_addresses(self.redis_sentinels, 'sentinels')
+
+    def get_cluster_nodes(self) -> typing.List:
+        nodes = _parse_addresses(self.redis_cluster_nodes, 'cluster nodes')
+        return nodes or [(self.redis_host, self.redis_port)]
+
+    def get_replica_urls(self) -> typing.List[str]:
+        if self.redis_replica_urls:
+            return [
+                _url.strip()
+                for _url in self.redis_replica_urls.split(',')
+                if _url.strip()
+            ]
+        else:
+            return []
+
+    def get_nearcache_prefixes(self) -> typing.List[str]:
+        if self.redis_nearcache_prefixes:
+            return [
+                _prefix.strip()
+                for _prefix in self.redis_nearcache_prefixes.split(',')
+                if _prefix.strip()
+            ]
         else:
             return []
 
 
+def _parse_addresses(addresses: typing.Optional[str], name: str) -> typing.List:
+    if addresses:
+        try:
+            return [
+                (
+                    _conn.split(':')[0].strip(),
+                    int(_conn.split(':')[1].strip())
+                )
+                for _conn in addresses.split(',')
+                if _conn.strip()
+            ]
+        except Exception as e:
+            raise RuntimeError(f'bad {name} string :: {type(e)} :: {str(e)} :: {addresses}')  # noqa
+    else:
+        return []
+
+
+@functools.lru_cache()
+def _client_class(*bases: type) -> type:
+    return type('RedisClient', bases, dict(__module__=__name__))
+
+
 class RedisPlugin(Plugin, ControlHealthMixin):
     DEFAULT_CONFIG_CLASS = RedisSettings
 
     def _on_init(self) -> None:
-        self.redis: typing.Union[aioredis.Redis, aioredis_sentinel.Sentinel] = None
+        self.redis: typing.Union[
+            aioredis.Redis,
+            aioredis_sentinel.Sentinel,
+            aioredis_cluster.RedisCluster
+        ] = None
+        self._connection: typing.Union[
+            aioredis.Redis,
+            aioredis_cluster.RedisCluster
+        ] = None
+        self._tasks: typing.List[asyncio.Task] = []
+        self.nearcache: RedisNearCache = None
+        self.codec: Codec = None
 
     async def _on_call(self) -> typing.Any:
-        if self.redis is None:
+        if self._connection is None:
             raise RedisError('Redis is not initialized')
-        #
+        return self._connection
+
+    async def _create_connection(self) -> typing.Any:
         if self.config.redis_type == RedisType.sentinel:
-            conn = self.redis.master_for(self.config.redis_sentinel_master)
+            conn = self.redis.master_for(
+                self.config.redis_sentinel_master,
+                connection_pool_class=_pool_class(aioredis_sentinel.SentinelConnectionPool)  # noqa E501
+            )
         elif self.config.redis_type == RedisType.redis:
             conn = self.redis
         elif self.config.redis_type == RedisType.fakeredis:
             conn = self.redis
+        elif self.config.redis_type == RedisType.cluster:
+            if self.config.redis_nearcache or self.config.redis_autopipeline or self.config.redis_read_policy != RedisReadPolicy.master:  # noqa E501
+                raise RedisError(f'Redis type {self.config.redis_type} does not support near cache, auto pipelining and read policy')   # noqa E501
+            conn = self.redis
         else:
             raise NotImplementedError(f'Redis type {self.config.redis_type} is not implemented')    # noqa
         #
+        # extensions are cooperative clients sharing the connection pool
+        bases = []
+        opts = {}
+        if self.config.redis_nearcache:
+            if self.config.redis_read_policy != RedisReadPolicy.master:
+                raise RedisError('Redis near cache does not support read policy')
+            bases.append(NearCacheRedis)
+            opts.update(nearcache=await self._create_nearcache(conn))
+        if self.config.redis_read_policy != RedisReadPolicy.master:
+            bases.append(ReplicaRoutingRedis)
+            opts.update(
+                replicas=self._create_replicas(),
+                read_policy=self.config.redis_read_policy,
+                read_after_write=self.config.redis_replica_read_after_write
+            )
+        if self.config.redis_autopipeline:
+            bases.append(AutoPipelineRedis)
+            opts.update(self._autopipeline_options())
+        if bases:
+            conn = _client_class(*bases)(connection_pool=conn.connection_pool, **opts)
         conn.TTL = self.config.redis_ttl
         return conn
 
+    def _autopipeline_options(self) -> typing.Dict:
+        return dict(
+            autopipeline_window=self.config.redis_autopipeline_window,
+            autopipeline_max_size=self.config.redis_autopipeline_max_size
+        )
+
+    def _create_replicas(self) -> typing.List[aioredis.Redis]:
+        if self.config.redis_type == RedisType.sentinel:
+            # the sentinel pool rotates over all replicas
+            replicas = [
+                self.redis.slave_for(
+                    self.config.redis_sentinel_master,
+                    connection_pool_class=_pool_class(aioredis_sentinel.SentinelConnectionPool)  # noqa E501
+                )
+            ]
+        else:
+            replicas = [
+                self._create_redis(url, **self._get_options())
+                for url in self.config.get_replica_urls()
+            ]
+        if not replicas:
+            raise RedisError('Redis replicas are not configured')
+        if self.config.redis_autopipeline:
+            replicas = [
+                _client_class(AutoPipelineRedis)(
+                    connection_pool=replica.connection_pool,
+                    **self._autopipeline_options()
+                )
+                for replica in replicas
+            ]
+        return replicas
+
+    async def _create_nearcache(self, conn: aioredis.Redis) -> RedisNearCache:
+        if self.nearcache is None:
+            self.nearcache = RedisNearCache(
+                maxsize=self.config.redis_nearcache_maxsize,
+                mode=self.config.redis_nearcache_mode,
+                prefixes=self.config.get_nearcache_prefixes()
+            )
+        else:
+            await self.nearcache.close()
+        await self.nearcache.start(conn.connection_pool)
+        return self.nearcache
+
     async def init_app(
             self,
             app: fastapi.FastAPI,
@@ -123,11 +278,8 @@ class RedisPlugin(Plugin, ControlHealthMixin):
             raise RedisError('Redis configuration is not valid')
         app.state.REDIS = self
 
-    async def init(self):
-        if self.redis is not None:
-            raise RedisError('Redis is already initialized')
-        #
-        opts = dict(
+    def _get_options(self) -> typing.Dict:
+        return dict(
             db=self.config.redis_db,
             username=self.config.redis_user,
             password=self.config.redis_password,
@@ -136,22 +288,32 @@ class RedisPlugin(Plugin, ControlHealthMixin):
             max_connections=self.config.redis_max_connections,
             decode_responses=self.config.redis_decode_responses,
         )
+
+    async def init(self):
+        if self.redis is not None:
+            raise RedisError('Redis is already initialized')
+        #
+        self.codec = Codec.from_settings(self.config, 'redis')
+        opts = self._get_options()
         #
         if self.config.redis_type == RedisType.redis:
             address = self.config.get_redis_address()
-            method = aioredis.from_url
+            method = self._create_redis
             # opts.update(dict(timeout=self.config.redis_connection_timeout))
         elif self.config.redis_type == RedisType.fakeredis:
             try:
-                import fakeredis.aioredis
+                import fakeredis.aioredis  # noqa F401
             except ImportError:
                 raise RedisError(f'{self.config.redis_type} requires fakeredis to be installed')    # noqa E501
             else:
                 address = self.config.get_redis_address()
-                method = fakeredis.aioredis.FakeRedis.from_url
+                method = self._create_redis
         elif self.config.redis_type == RedisType.sentinel:
             address = self.config.get_sentinels()
             method = aioredis_sentinel.Sentinel
+        elif self.config.redis_type == RedisType.cluster:
+            address = self.config.get_cluster_nodes()
+            method = self._create_cluster
         else:
             raise NotImplementedError(f'Redis type {self.config.redis_type} is not implemented')    # noqa
         #
@@ -163,13 +325,141 @@ class RedisPlugin(Plugin, ControlHealthMixin):
             wait=tenacity.wait_fixed(self.config.redis_prestart_wait),
         )
         async def _inner():
-            return method(address, **opts)
+            client = method(address, **opts)
+            if self.config.redis_type == RedisType.cluster:
+                await client.initialize()
+            return client
 
         self.redis = await _inner()
+        self._connection = await self._create_connection()
         await self.ping()
+        await self.warm_up()
+        #
+        if self.config.redis_type == RedisType.cluster and self.config.redis_cluster_refresh_interval > 0:  # noqa E501
+            self._tasks.append(
+                asyncio.create_task(
+                    self._refresh_cluster_slots(
+                        self.config.redis_cluster_refresh_interval
+                    )
+                )
+            )
+        elif self.config.redis_type == RedisType.sentinel and self.config.redis_sentinel_failover_watch:  # noqa E501
+            self._tasks.append(asyncio.create_task(self._watch_sentinel()))
+
+    def _create_redis(self, address: str, **opts) -> aioredis.Redis:
+        if self.config.redis_type == RedisType.fakeredis:
+            import fakeredis.aioredis
+            opts.update(connection_class=fakeredis.aioredis.FakeAsyncRedisConnection)   # noqa E501
+        return aioredis.Redis(
+            connection_pool=_pool_class(aioredis.ConnectionPool).from_url(
+                address,
+                **opts
+            )
+        )
+
+    def _create_cluster(
+            self,
+            address: typing.List,
+            **opts
+    ) -> aioredis_cluster.RedisCluster:
+        # cluster mode has no databases and a pool per node
+        opts.pop('db', None)
+        if opts.get('max_connections') is None:
+            opts.pop('max_connections', None)
+        return aioredis_cluster.RedisCluster(
+            startup_nodes=[
+                aioredis_cluster.ClusterNode(host, port)
+                for host, port in address
+            ],
+            read_from_replicas=self.config.redis_cluster_read_from_replicas,
+            reinitialize_steps=self.config.redis_cluster_reinitialize_steps,
+            **opts
+        )
+
+    async def _refresh_cluster_slots(self, interval: float) -> None:
+        # keep the slot map warm, so that a resharding or a failover does not
+        # have to be discovered by MOVED/ASK redirects on the request path.
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.redis.nodes_manager.initialize()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # the next command or refresh will try again
+                logger.warning('Redis cluster slots refresh failed :: %r', e)
+
+    async def _watch_sentinel(self) -> None:
+        # a failover is announced by sentinels on the `+switch-master` channel
+        # as "<master name> <old ip> <old port> <new ip> <new port>".
+        index = 0
+        while True:
+            sentinels = self.redis.sentinels
+            pubsub = sentinels[index % len(sentinels)].pubsub()
+            try:
+                await pubsub.subscribe('+switch-master')
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        await self._on_sentinel_message(message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # try the next sentinel
+                index += 1
+                await asyncio.sleep(self.config.redis_prestart_wait)
+            finally:
+                await pubsub.reset()
+
+    async def _on_sentinel_message(self, data: typing.Union[str, bytes]) -> None:
+        if isinstance(data, bytes):
+            data = data.decode()
+        if data.split(' ', 1)[0] != self.config.redis_sentinel_master:
+            return
+        conn, self._connection = self._connection, await self._create_connection()
+        await conn.connection_pool.disconnect(inuse_connections=False)
+        try:
+            await self.warm_up()
+        except Exception as e:
+            # the new master may still be promoted, connect on demand
+            logger.warning('Redis warm up after failover failed :: %r', e)
+
+    async def warm_up(self) -> int:
+        '''
+        Open `redis_pool_minsize` connections to the master, to each replica
+        or to each cluster node.
+        '''
+        size = self.config.redis_pool_minsize
+        if self.config.redis_type == RedisType.cluster:
+            counts = await asyncio.gather(*[
+                _warm_up_cluster_node(node, size)
+                for node in self.redis.get_nodes()
+            ])
+            return sum(counts)
+        pools = [self._connection.connection_pool]
+        if isinstance(self._connection, ReplicaRoutingRedis):
+            pools.extend(replica.connection_pool for replica in self._connection.replicas)  # noqa E501
+        counts = await asyncio.gather(*[
+            pool.warm_up(size)
+            for pool in pools
+            if isinstance(pool, InstrumentedConnectionPool)
+        ])
+        return sum(counts)
 
     async def terminate(self):
         self.config = None
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._connection = None
+        if self.nearcache is not None:
+            await self.nearcache.close()
+            self.nearcache = None
+        if isinstance(self.redis, aioredis_cluster.RedisCluster):
+            await self.redis.close()
         if self.redis is not None:
             # del self.redis
             self.redis = None
@@ -178,11 +468,50 @@ class RedisPlugin(Plugin, ControlHealthMixin):
             # self.redis = None
 
     async def health(self) -> typing.Dict:
-        return dict(
+        if self.config.redis_type == RedisType.cluster:
+            nodes = await self.cluster_health()
+            return dict(
+                redis_type=self.config.redis_type,
+                redis_address=self.config.get_cluster_nodes(),
+                redis_pong=all(node['pong'] for node in nodes.values()),
+                redis_nodes=nodes
+            )
+        health = dict(
             redis_type=self.config.redis_type,
             redis_address=self.config.get_sentinels() if self.config.redis_type == RedisType.sentinel else self.config.get_redis_address(),  # noqa E501
             redis_pong=(await self.ping())
         )
+        if isinstance(self._connection.connection_pool, InstrumentedConnectionPool):   # noqa E501
+            health.update(redis_pool=self._connection.connection_pool.pool_stats())  # noqa E501
+        if self.nearcache is not None:
+            health.update(redis_nearcache=self.nearcache.stats())
+        if isinstance(self._connection, ReplicaRoutingRedis):
+            health.update(redis_replicas=self._connection.replica_stats())
+        if isinstance(self._connection, AutoPipelineRedis):
+            health.update(redis_autopipeline=self._connection.autopipeline_stats())
+        return health
+
+    async def cluster_health(self) -> typing.Dict:
+        async def _ping(node: aioredis_cluster.ClusterNode) -> typing.Dict:
+            try:
+                pong = await node.execute_command('PING')
+            except Exception as e:
+                return dict(
+                    server_type=node.server_type,
+                    pong=False,
+                    error=str(e),
+                    pool=_cluster_node_stats(node)
+                )
+            else:
+                return dict(
+                    server_type=node.server_type,
+                    pong=pong,
+                    pool=_cluster_node_stats(node)
+                )
+
+        nodes = self.redis.get_nodes()
+        results = await asyncio.gather(*[_ping(node) for node in nodes])
+        return {node.name: result for node, result in zip(nodes, results)}
 
     async def ping(self):
         if self.config.redis_type == RedisType.redis:
@@ -190,7 +519,9 @@ class RedisPlugin(Plugin, ControlHealthMixin):
         elif self.config.redis_type == RedisType.fakeredis:
             return await self.redis.ping()
         elif self.config.redis_type == RedisType.sentinel:
-            return await self.redis.master_for(self.config.redis_sentinel_master).ping()
+            return await self._connection.ping()
+        elif self.config.redis_type == RedisType.cluster:
+            return await self.redis.ping()
         else:
             raise NotImplementedError(f'Redis type {self.config.redis_type}.ping() is not implemented') # noqa
 
@@ -201,7 +532,11 @@ redis_plugin = RedisPlugin()
 async def depends_redis(
     conn: starlette.requests.HTTPConnection
 ) -> aioredis.Redis:
-    return await conn.app.state.REDIS()
+    # fast path: the connection is resolved once in `init()`
+    plugin = conn.app.state.REDIS
+    if plugin._connection is not None:
+        return plugin._connection
+    return await plugin()
 
 
 TRedisPlugin = Annotated[typing.Any, fastapi.Depends(depends_redis)]
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fastapi_plugins._redis_lease
+#
+# Lease (leader election) in Redis with a fencing token
+# "https://martin.kleppmann.com/2016/02/08/how-to-do-distributed-locking.html"
+#
+
+from __future__ import absolute_import
+
+import asyncio
+import contextvars
+import logging
+import os
+import socket
+import time
+import typing
+import uuid
+
+from ._redis import RedisPlugin, redis_plugin
+
+__all__ = ['RedisLease', 'current_fencing_token']
+
+logger = logging.getLogger(__name__)
+
+# take the free lease with a new fencing token, or extend the own lease
+_ACQUIRE_SCRIPT = """
+local owner = redis.call('get', KEYS[1])
+if owner == false then
+    local token = redis.call('incr', KEYS[2])
+    redis.call('set', KEYS[1], ARGV[1], 'px', ARGV[2])
+    return token
+elseif owner == ARGV[1] then
+    redis.call('pexpire', KEYS[1], ARGV[2])
+    return tonumber(redis.call('get', KEYS[2]))
+end
+return false
+"""
+
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# read the token on the primary, not from a replica or the near cache
+_CURRENT_SCRIPT = """
+return redis.call('get', KEYS[1])
+"""
+
+_fencing_token: contextvars.ContextVar[typing.Optional[int]] = contextvars.ContextVar('fencing_token', default=None)   # noqa E501
+
+
+def current_fencing_token() -> typing.Optional[int]:
+    '''
+    Fencing token of the lease, under which the current job runs.
+    '''
+    return _fencing_token.get()
+
+
+class RedisLease(object):
+    '''
+    Lease of `name`, which is held by one owner at a time for `ttl` seconds
+    and renewed every `renew` seconds (default `ttl / 3`). Other owners try
+    to take the lease as often, so that a new leader takes over at most
+    `ttl + renew` seconds after the leader died.
+
+    Every new holder gets a greater fencing token. A leader, which was paused
+    longer than the lease, may still believe to hold it, so writes should
+    be rejected if their token is not `is_current()`.
+    '''
+    def __init__(
+            self,
+            name: str,
+            plugin: RedisPlugin=None,
+            ttl: float=10.0,
+            renew: float=None,
+            owner: str=None,
+            prefix: str='lease'
+    ):
+        if ttl <= 0:
+            raise ValueError('Lease TTL must be greater than 0')
+        self.name = name
+        self.plugin = plugin or redis_plugin
+        self.ttl = ttl
+        self.renew_interval = renew or ttl / 3
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}'   # noqa E501
+        # the hash tag keeps the lease and its token in one cluster slot
+        self.key = f'{prefix}:{{{name}}}'
+        self.token_key = f'{prefix}:{{{name}}}:token'
+        self.token: typing.Optional[int] = None
+        self.acquired = 0
+        self.lost = 0
+        self.errors = 0
+        self._expires = 0.0
+        self._task: asyncio.Task = None
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.name!r}, owner={self.owner!r})'
+
+    @property
+    def is_leader(self) -> bool:
+        return self.token is not None and time.monotonic() < self._expires
+
+    @property
+    def _ttl_ms(self) -> int:
+        return max(1, int(self.ttl * 1000))
+
+    async def acquire(self) -> typing.Optional[int]:
+        '''
+        Take or extend the lease, returns the fencing token or `None` if
+        the lease is held by another owner.
+        '''
+        started = time.monotonic()
+        conn = await self.plugin()
+        token = await conn.eval(_ACQUIRE_SCRIPT, 2, self.key, self.token_key, self.owner, self._ttl_ms)   # noqa E501
+        if token is None:
+            self._step_down()
+            return None
+        token = int(token)
+        if token != self.token:
+            self.acquired += 1
+        self.token = token
+        # the lease started at the latest when the call started
+        self._expires = started + self.ttl
+        return token
+
+    async def renew(self) -> bool:
+        started = time.monotonic()
+        conn = await self.plugin()
+        if await conn.eval(_RENEW_SCRIPT, 1, self.key, self.owner, self._ttl_ms):   # noqa E501
+            self._expires = started + self.ttl
+            return True
+        self._step_down()
+        return False
+
+    async def release(self) -> None:
+        if self.token is not None:
+            self.token = None
+            conn = await self.plugin()
+            await conn.eval(_RELEASE_SCRIPT, 1, self.key, self.owner)
+
+    async def is_current(self, token: int) -> bool:
+        '''
+        Check that no newer lease was taken since `token`.
+        '''
+        conn = await self.plugin()
+        current = await conn.eval(_CURRENT_SCRIPT, 1, self.token_key)
+        return current is not None and int(current) == token
+
+    def _step_down(self) -> None:
+        if self.token is not None:
+            self.token = None
+            self.lost += 1
+
+    async def _maintain(self) -> None:
+        while True:
+            try:
+                if self.token is not None:
+                    await self.renew()
+                else:
+                    await self.acquire()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # the lease ends by itself, if Redis is not reachable
+                self.errors += 1
+                if self.token is not None and not self.is_leader:
+                    self._step_down()
+            await asyncio.sleep(self.renew_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._maintain())
+
+    async def stop(self) -> None:
+        '''
+        Stop renewing and release the lease, so that another owner takes it
+        over at once.
+        '''
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.release()
+        except Exception as e:
+            # the lease expires
+            logger.warning('Lease %s release failed :: %r', self.name, e)
+
+    def stats(self) -> typing.Dict:
+        return dict(
+            owner=self.owner,
+            leader=self.is_leader,
+            token=self.token,
+            acquired=self.acquired,
+            lost=self.lost,
+            errors=self.errors
+        )
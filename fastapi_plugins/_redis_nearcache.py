@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fastapi_plugins._redis_nearcache
+#
+# Near cache is based on the server assisted client side caching
+# "https://redis.io/docs/manual/client-side-caching/"
+#
+
+from __future__ import absolute_import
+
+import asyncio
+import collections
+import enum
+import typing
+import weakref
+
+import redis.asyncio as aioredis
+import redis.asyncio.connection as aioredis_connection
+
+__all__ = [
+    'RedisTrackingMode', 'RedisNearCache', 'NearCachePipeline', 'NearCacheRedis'
+]
+
+INVALIDATE_CHANNEL = '__redis__:invalidate'
+
+_MISSING = object()
+
+
+@enum.unique
+class RedisTrackingMode(str, enum.Enum):
+    default = 'default'
+    bcast = 'bcast'
+
+
+class RedisNearCache(object):
+    '''
+    Bounded in-process LRU of values read with `GET`. Entries are evicted
+    when Redis reports a change of the key over `CLIENT TRACKING`.
+
+    With RESP2 the invalidation messages are redirected to a dedicated
+    connection subscribed to `__redis__:invalidate`. In the `default` mode
+    every pooled connection enables tracking with a redirect to it, in the
+    `bcast` mode the dedicated connection tracks the configured prefixes.
+    '''
+    def __init__(
+            self,
+            maxsize: int=10000,
+            mode: RedisTrackingMode=RedisTrackingMode.default,
+            prefixes: typing.List[str]=None
+    ):
+        self.maxsize = maxsize
+        self.mode = RedisTrackingMode(mode)
+        self.prefixes = prefixes or []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._data: collections.OrderedDict = collections.OrderedDict()
+        # the reads in flight and the invalidations of their keys
+        self._reads: typing.Counter[bytes] = collections.Counter()
+        self._versions: typing.Dict[bytes, int] = {}
+        self._generation = 0
+        self._ready = False
+        self._client_id: int = None
+        self._pool: aioredis.ConnectionPool = None
+        # the connections in use, when tracking was redirected
+        self._stale: weakref.WeakSet = weakref.WeakSet()
+        self._listener: aioredis_connection.Connection = None
+        self._task: asyncio.Task = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: bytes) -> typing.Any:
+        if not self._ready:
+            return _MISSING
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return _MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def reserve(self, key: bytes) -> typing.Tuple[int, int]:
+        self._reads[key] += 1
+        return self._generation, self._versions.get(key, 0)
+
+    def release(self, key: bytes) -> None:
+        self._reads[key] -= 1
+        if self._reads[key] <= 0:
+            del self._reads[key]
+            self._versions.pop(key, None)
+
+    def set(self, key: bytes, value: typing.Any, token: typing.Tuple[int, int]) -> None:  # noqa E501
+        # an invalidation of the key received while the value was read makes
+        # it stale
+        current = (self._generation, self._versions.get(key, 0))
+        self.release(key)
+        if not self._ready or token != current:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, keys: typing.Optional[typing.Iterable[bytes]]=None) -> None:
+        if keys is None:
+            self._generation += 1
+            self.invalidations += len(self._data)
+            self._data.clear()
+            return
+        for key in keys:
+            if key in self._reads:
+                self._versions[key] = self._versions.get(key, 0) + 1
+            if self._data.pop(key, _MISSING) is not _MISSING:
+                self.invalidations += 1
+
+    def stats(self) -> typing.Dict:
+        return dict(
+            ready=self._ready,
+            mode=self.mode.value,
+            size=len(self._data),
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            invalidations=self.invalidations
+        )
+
+    async def start(self, pool: aioredis.ConnectionPool) -> None:
+        self._pool = pool
+        if self.mode == RedisTrackingMode.default:
+            self._pool.release = self._release
+        await self._subscribe()
+        await self._activate()
+        self._task = asyncio.create_task(self._listen())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._reset()
+        if self._pool is not None:
+            self._pool.__dict__.pop('release', None)
+        self._stale = weakref.WeakSet()
+        self._pool = None
+
+    def _set_connect_func(self, func: typing.Optional[typing.Callable]) -> None:
+        # tracking is enabled per connection, also for the pooled ones
+        self._pool.connection_kwargs['redis_connect_func'] = func
+        connections = list(self._pool._available_connections) + list(self._pool._in_use_connections)  # noqa E501
+        for connection in connections:
+            connection.redis_connect_func = func
+
+    async def _release(self, connection: aioredis_connection.Connection) -> None:
+        # a connection, which was in use when tracking was redirected,
+        # reconnects with the redirect on its next use
+        if connection in self._stale:
+            self._stale.discard(connection)
+            await connection.disconnect()
+        await type(self._pool).release(self._pool, connection)
+
+    async def _reset(self) -> None:
+        self._ready = False
+        self.invalidate()
+        if self._pool is not None and self.mode == RedisTrackingMode.default:
+            # new connections must not redirect to the lost listener, the
+            # commands do not use the near cache until it is subscribed again
+            self._set_connect_func(None)
+        self._client_id = None
+        if self._listener is not None:
+            await self._listener.disconnect()
+            self._listener = None
+
+    async def _activate(self) -> None:
+        if self.mode == RedisTrackingMode.default:
+            # the connections reconnect with the tracking redirected to the
+            # listener, the connections in use once they are released
+            self._set_connect_func(self._on_connect)
+            self._stale = weakref.WeakSet(self._pool._in_use_connections)
+            await self._pool.disconnect(inuse_connections=False)
+        # the reads in flight are not tracked, hence their values are dropped
+        self.invalidate()
+        self._ready = True
+
+    async def _subscribe(self) -> None:
+        kwargs = dict(self._pool.connection_kwargs)
+        kwargs.pop('redis_connect_func', None)
+        listener = self._pool.connection_class(**kwargs)
+        try:
+            await listener.connect()
+            await listener.send_command('CLIENT', 'ID')
+            client_id = await listener.read_response()
+            if self.mode == RedisTrackingMode.bcast:
+                args = ['CLIENT', 'TRACKING', 'ON', 'REDIRECT', client_id, 'BCAST']
+                for prefix in self.prefixes:
+                    args.extend(('PREFIX', prefix))
+                await listener.send_command(*args)
+                await listener.read_response()
+            await listener.send_command('SUBSCRIBE', INVALIDATE_CHANNEL)
+            await listener.read_response()
+        except BaseException:
+            await listener.disconnect()
+            raise
+        self._listener = listener
+        self._client_id = client_id
+
+    async def _on_connect(self, connection: aioredis_connection.Connection) -> None:
+        await connection.on_connect()
+        await connection.send_command(
+            'CLIENT', 'TRACKING', 'ON', 'REDIRECT', self._client_id
+        )
+        await connection.read_response()
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                if self._listener is None:
+                    await self._subscribe()
+                    await self._activate()
+                while True:
+                    message = await self._listener.read_response(
+                        disable_decoding=True
+                    )
+                    if isinstance(message, list) and len(message) == 3 and message[0] == b'message':  # noqa E501
+                        self.invalidate(message[2])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # invalidations may have been lost, hence stop serving and
+                # start over with an empty cache.
+                await self._reset()
+                await asyncio.sleep(1)
+
+
+# commands, which do not change the value of their key
+_READ_ONLY_COMMANDS = frozenset((
+    'EXISTS', 'TTL', 'PTTL', 'EXPIRETIME', 'PEXPIRETIME', 'TYPE', 'STRLEN',
+    'GETRANGE', 'SUBSTR', 'DUMP', 'OBJECT', 'MGET', 'TOUCH', 'EVAL_RO',
+    'EVALSHA_RO', 'FCALL_RO'
+))
+
+# commands, which write all their arguments or every other one as keys
+_MULTI_KEY_COMMANDS = {'DEL': 1, 'UNLINK': 1, 'MSET': 2, 'MSETNX': 2}
+
+# commands, which are followed by a script or a function and the keys count
+_SCRIPT_COMMANDS = frozenset(('EVAL', 'EVALSHA', 'FCALL'))
+
+
+def _written_keys(args: typing.Sequence) -> typing.Sequence:
+    if len(args) < 2 or args[0] in _READ_ONLY_COMMANDS:
+        return ()
+    elif args[0] in _SCRIPT_COMMANDS:
+        return args[3:3 + int(args[2])]
+    elif args[0] in _MULTI_KEY_COMMANDS:
+        return args[1::_MULTI_KEY_COMMANDS[args[0]]]
+    else:
+        return args[1:2]
+
+
+class NearCachePipeline(aioredis.client.Pipeline):
+    '''
+    Pipeline evicting the keys written by the buffered commands from the
+    near cache, when they are sent.
+    '''
+    def __init__(self, nearcache: RedisNearCache, *args, **kwargs):
+        super(NearCachePipeline, self).__init__(*args, **kwargs)
+        self.nearcache = nearcache
+        self._encode = self.connection_pool.get_encoder().encode
+
+    def _evict(self, args: typing.Sequence) -> None:
+        self.nearcache.invalidate([self._encode(key) for key in _written_keys(args)])  # noqa E501
+
+    async def immediate_execute_command(self, *args, **options) -> typing.Any:
+        self._evict(args)
+        return await super(NearCachePipeline, self).immediate_execute_command(*args, **options)  # noqa E501
+
+    async def execute(self, raise_on_error: bool=True) -> typing.List[typing.Any]:
+        for args, _ in self.command_stack:
+            self._evict(args)
+        return await super(NearCachePipeline, self).execute(raise_on_error)
+
+
+class NearCacheRedis(aioredis.Redis):
+    '''
+    Redis client serving `GET` from the near cache. A write of a cached key
+    evicts it locally, before the server reports the change.
+    '''
+    def __init__(self, nearcache: RedisNearCache, **kwargs):
+        super(NearCacheRedis, self).__init__(**kwargs)
+        self.nearcache = nearcache
+        self._encode = self.connection_pool.get_encoder().encode
+
+    async def execute_command(self, *args, **options) -> typing.Any:
+        if len(args) < 2:
+            return await super(NearCacheRedis, self).execute_command(*args, **options)  # noqa E501
+        if args[0] == 'GET' and not options:
+            key = self._encode(args[1])
+            value = self.nearcache.get(key)
+            if value is not _MISSING:
+                return value
+            token = self.nearcache.reserve(key)
+            try:
+                value = await super(NearCacheRedis, self).execute_command(*args, **options)  # noqa E501
+            except BaseException:
+                self.nearcache.release(key)
+                raise
+            self.nearcache.set(key, value, token)
+            return value
+        self.nearcache.invalidate([self._encode(key) for key in _written_keys(args)])  # noqa E501
+        return await super(NearCacheRedis, self).execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool=True, shard_hint: typing.Any=None) -> NearCachePipeline:  # noqa E501
+        return NearCachePipeline(
+            self.nearcache,
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint
+        )
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fastapi_plugins._redis_pipeline
+
+from __future__ import absolute_import
+
+import asyncio
+import typing
+
+import redis.asyncio as aioredis
+
+__all__ = ['AutoPipelineRedis']
+
+# commands which block or change the state of a connection
+UNPIPELINED_COMMANDS = frozenset((
+    'BLMOVE', 'BLMPOP', 'BLPOP', 'BRPOP', 'BRPOPLPUSH', 'BZMPOP', 'BZPOPMAX',
+    'BZPOPMIN', 'DISCARD', 'EXEC', 'MONITOR', 'MULTI', 'PSUBSCRIBE',
+    'SELECT', 'SUBSCRIBE', 'UNWATCH', 'WAIT', 'WAITAOF', 'WATCH', 'XREAD',
+    'XREADGROUP',
+))
+
+
+class AutoPipelineRedis(aioredis.Redis):
+    '''
+    Redis client collecting the commands issued by concurrent callers and
+    sending them as one non-transactional pipeline. The batch is flushed on
+    the next event loop iteration, after `autopipeline_window` seconds or as
+    soon as it holds `autopipeline_max_size` commands.
+    '''
+    def __init__(
+            self,
+            *,
+            autopipeline_window: float=0,
+            autopipeline_max_size: int=100,
+            **kwargs
+    ):
+        super(AutoPipelineRedis, self).__init__(**kwargs)
+        self.autopipeline_window = autopipeline_window
+        self.autopipeline_max_size = autopipeline_max_size
+        self.autopipeline_batches = 0
+        self.autopipeline_commands = 0
+        self._queue: typing.List[typing.Tuple] = []
+        self._handle: asyncio.Handle = None
+        self._flushing: typing.Set[asyncio.Task] = set()
+
+    async def execute_command(self, *args, **options) -> typing.Any:
+        if args[0] in UNPIPELINED_COMMANDS:
+            return await super(AutoPipelineRedis, self).execute_command(*args, **options)   # noqa E501
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((args, options, future))
+        if len(self._queue) >= self.autopipeline_max_size:
+            self._flush()
+        elif self._handle is None:
+            if self.autopipeline_window > 0:
+                self._handle = loop.call_later(self.autopipeline_window, self._flush)
+            else:
+                self._handle = loop.call_soon(self._flush)
+        return await future
+
+    def autopipeline_stats(self) -> typing.Dict:
+        return dict(
+            batches=self.autopipeline_batches,
+            commands=self.autopipeline_commands,
+            pending=len(self._queue),
+            window=self.autopipeline_window,
+            max_size=self.autopipeline_max_size
+        )
+
+    def _flush(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        queue, self._queue = self._queue, []
+        if queue:
+            task = asyncio.ensure_future(self._execute(queue))
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+
+    async def _execute(self, queue: typing.List[typing.Tuple]) -> None:
+        self.autopipeline_batches += 1
+        self.autopipeline_commands += len(queue)
+        try:
+            if len(queue) == 1:
+                args, options, _ = queue[0]
+                results = [
+                    await super(AutoPipelineRedis, self).execute_command(*args, **options)  # noqa E501
+                ]
+            else:
+                pipe = self.pipeline(transaction=False)
+                for args, options, _ in queue:
+                    pipe.execute_command(*args, **options)
+                results = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            results = [e] * len(queue)
+        except asyncio.CancelledError:
+            for _, _, future in queue:
+                future.cancel()
+            raise
+        for (_, _, future), result in zip(queue, results):
+            # the caller may have been cancelled meanwhile
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
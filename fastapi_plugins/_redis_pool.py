@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fastapi_plugins._redis_pool
+
+from __future__ import absolute_import
+
+import asyncio
+import collections
+import functools
+import time
+import typing
+
+import redis.asyncio.cluster as aioredis_cluster
+import redis.exceptions
+
+__all__ = ['InstrumentedConnectionPool']
+
+# connections created within the window make the creation rate
+CREATION_RATE_WINDOW = 60.0
+
+
+class InstrumentedConnectionPool(object):
+    '''
+    Connection pool mixin counting the connections in use, idle and created,
+    and the time to acquire a ready connection, which includes to connect
+    and to check the connection.
+    '''
+    def reset(self) -> None:
+        super(InstrumentedConnectionPool, self).reset()
+        self.acquired = 0
+        self.exhausted = 0
+        self.acquire_time = 0.0
+        self.acquire_time_max = 0.0
+        self._created_at: typing.Deque[float] = collections.deque(maxlen=10000)
+
+    def make_connection(self) -> typing.Any:
+        try:
+            connection = super(InstrumentedConnectionPool, self).make_connection()
+        except redis.exceptions.ConnectionError:
+            self.exhausted += 1
+            raise
+        self._created_at.append(time.monotonic())
+        return connection
+
+    async def get_connection(self, *args, **kwargs) -> typing.Any:
+        start = time.monotonic()
+        connection = await super(InstrumentedConnectionPool, self).get_connection(*args, **kwargs)  # noqa E501
+        acquire_time = time.monotonic() - start
+        self.acquired += 1
+        self.acquire_time += acquire_time
+        self.acquire_time_max = max(self.acquire_time_max, acquire_time)
+        return connection
+
+    async def warm_up(self, size: int) -> int:
+        '''
+        Open up to `size` connections, so that the first requests do not pay
+        for the connection setup.
+        '''
+        # idle connections are acquired as well, so that new are created
+        size = min(size, self.max_connections) - len(self._in_use_connections)
+        if size <= len(self._available_connections):
+            return 0
+        created = self._created_connections
+        results = await asyncio.gather(
+            *[self.get_connection('PING') for _ in range(size)],
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]   # noqa E501
+        for connection in results:
+            if not isinstance(connection, BaseException):
+                await self.release(connection)
+        if errors:
+            raise errors[0]
+        return self._created_connections - created
+
+    def pool_stats(self) -> typing.Dict:
+        now = time.monotonic()
+        while self._created_at and now - self._created_at[0] > CREATION_RATE_WINDOW:  # noqa E501
+            self._created_at.popleft()
+        return dict(
+            in_use=len(self._in_use_connections),
+            idle=len(self._available_connections),
+            max=self.max_connections,
+            created=self._created_connections,
+            creation_rate=len(self._created_at) / CREATION_RATE_WINDOW,
+            exhausted=self.exhausted,
+            acquired=self.acquired,
+            acquire_time_avg=self.acquire_time / self.acquired if self.acquired else 0.0,   # noqa E501
+            acquire_time_max=self.acquire_time_max
+        )
+
+
+@functools.lru_cache()
+def _pool_class(base: type) -> type:
+    return type(
+        f'Instrumented{base.__name__}',
+        (InstrumentedConnectionPool, base),
+        dict(__module__=__name__)
+    )
+
+
+async def _warm_up_cluster_node(
+        node: aioredis_cluster.ClusterNode,
+        size: int
+) -> int:
+    # cluster nodes keep their own list of connections instead of a pool,
+    # which is private to redis-py 4.x
+    if not hasattr(node, '_connections') or not hasattr(node, '_free'):
+        return 0
+    size = min(size, node.max_connections) - len(node._connections)
+    if size <= 0:
+        return 0
+    connections = [node.acquire_connection() for _ in range(size)]
+    try:
+        await asyncio.gather(*[
+            connection.connect() for connection in connections
+        ])
+    finally:
+        node._free.extend(connections)
+    return len(connections)
+
+
+def _cluster_node_stats(node: aioredis_cluster.ClusterNode) -> typing.Dict:
+    if not hasattr(node, '_connections') or not hasattr(node, '_free'):
+        return dict(in_use=None, idle=None, max=node.max_connections)
+    return dict(
+        in_use=len(node._connections) - len(node._free),
+        idle=len(node._free),
+        max=node.max_connections
+    )
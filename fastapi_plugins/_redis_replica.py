@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fastapi_plugins._redis_replica
+
+from __future__ import absolute_import
+
+import enum
+import itertools
+import time
+import typing
+
+import redis.asyncio as aioredis
+import redis.exceptions
+
+__all__ = ['RedisReadPolicy', 'ReplicaRoutingRedis']
+
+READ_COMMANDS = frozenset((
+    'BITCOUNT', 'BITPOS', 'DBSIZE', 'EXISTS', 'EXPIRETIME', 'GEODIST',
+    'GEOHASH', 'GEOPOS', 'GEOSEARCH', 'GET', 'GETBIT', 'GETRANGE', 'HEXISTS',
+    'HGET', 'HGETALL', 'HKEYS', 'HLEN', 'HMGET', 'HRANDFIELD', 'HSCAN',
+    'HSTRLEN', 'HVALS', 'KEYS', 'LINDEX', 'LLEN', 'LPOS', 'LRANGE', 'MGET',
+    'PEXPIRETIME', 'PFCOUNT', 'PTTL', 'RANDOMKEY', 'SCAN', 'SCARD', 'SDIFF',
+    'SINTER', 'SINTERCARD', 'SISMEMBER', 'SMEMBERS', 'SMISMEMBER',
+    'SRANDMEMBER', 'SSCAN', 'STRLEN', 'SUNION', 'TTL', 'TYPE', 'XLEN',
+    'XRANGE', 'XREVRANGE', 'ZCARD', 'ZCOUNT', 'ZDIFF', 'ZINTER', 'ZLEXCOUNT',
+    'ZMSCORE', 'ZRANDMEMBER', 'ZRANGE', 'ZRANGEBYLEX', 'ZRANGEBYSCORE',
+    'ZRANK', 'ZREVRANGE', 'ZREVRANGEBYLEX', 'ZREVRANGEBYSCORE', 'ZREVRANK',
+    'ZSCAN', 'ZSCORE', 'ZUNION',
+))
+
+
+@enum.unique
+class RedisReadPolicy(str, enum.Enum):
+    master = 'master'
+    replica = 'replica'
+    replica_preferred = 'replica_preferred'
+
+
+class ReplicaRoutingRedis(aioredis.Redis):
+    '''
+    Redis client sending read-only commands round robin to replicas and all
+    other commands to the master.
+
+    * `replica` - reads fail, if a replica is not reachable
+    * `replica_preferred` - reads fall back to the master
+
+    With `read_after_write` reads are sent to the master for the given
+    seconds after a write of this process, so that it reads its own writes.
+    '''
+    def __init__(
+            self,
+            *,
+            replicas: typing.List[aioredis.Redis],
+            read_policy: RedisReadPolicy=RedisReadPolicy.replica,
+            read_after_write: float=0,
+            **kwargs
+    ):
+        super(ReplicaRoutingRedis, self).__init__(**kwargs)
+        self.replicas = replicas
+        self.read_policy = RedisReadPolicy(read_policy)
+        self.read_after_write = read_after_write
+        self.replica_reads = 0
+        self.master_reads = 0
+        self.fallbacks = 0
+        self._replicas = itertools.cycle(replicas)
+        self._last_write = float('-inf')
+
+    async def execute_command(self, *args, **options) -> typing.Any:
+        if args[0] not in READ_COMMANDS:
+            if self.read_after_write > 0:
+                self._last_write = time.monotonic()
+            return await super(ReplicaRoutingRedis, self).execute_command(*args, **options)  # noqa E501
+        if self.read_after_write <= 0 or time.monotonic() - self._last_write >= self.read_after_write:  # noqa E501
+            try:
+                result = await next(self._replicas).execute_command(*args, **options)
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+                if self.read_policy != RedisReadPolicy.replica_preferred:
+                    raise
+                self.fallbacks += 1
+            else:
+                self.replica_reads += 1
+                return result
+        self.master_reads += 1
+        return await super(ReplicaRoutingRedis, self).execute_command(*args, **options)
+
+    def replica_stats(self) -> typing.Dict:
+        return dict(
+            replicas=len(self.replicas),
+            read_policy=self.read_policy.value,
+            replica_reads=self.replica_reads,
+            master_reads=self.master_reads,
+            fallbacks=self.fallbacks
+        )
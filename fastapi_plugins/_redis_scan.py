@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fastapi_plugins._redis_scan
+#
+# Incremental iteration of keys, hashes and sets without blocking Redis
+# "https://redis.io/commands/scan/"
+#
+
+from __future__ import absolute_import
+
+import asyncio
+import time
+import typing
+
+import redis.asyncio as aioredis
+import redis.asyncio.cluster as aioredis_cluster
+
+__all__ = [
+    'ScanProgress', 'scan_keys', 'hscan_items', 'sscan_members', 'unlink_keys'
+]
+
+KeyT = typing.Union[str, bytes]
+
+
+class ScanProgress(object):
+    '''
+    Progress of a scan, updated after every batch. A scan has no total,
+    `nodes_done` of `nodes` tells the progress over the nodes of a cluster.
+    '''
+    __slots__ = ('scanned', 'batches', 'unlinked', 'nodes', 'nodes_done', 'started')   # noqa E501
+
+    def __init__(self):
+        self.scanned = 0
+        self.batches = 0
+        self.unlinked = 0
+        self.nodes = 1
+        self.nodes_done = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self) -> float:
+        elapsed = self.elapsed
+        return self.scanned / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self) -> typing.Dict:
+        return dict(
+            scanned=self.scanned,
+            batches=self.batches,
+            unlinked=self.unlinked,
+            nodes=self.nodes,
+            nodes_done=self.nodes_done,
+            elapsed=self.elapsed,
+            rate=self.rate
+        )
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.to_dict()})'
+
+
+def _update(progress: typing.Optional[ScanProgress], count: int) -> None:
+    if progress is not None:
+        progress.scanned += count
+        progress.batches += 1
+
+
+async def scan_keys(
+        conn: typing.Union[aioredis.Redis, aioredis_cluster.RedisCluster],
+        match: typing.Optional[str]=None,
+        count: int=1000,
+        _type: typing.Optional[str]=None,
+        progress: typing.Optional[ScanProgress]=None
+) -> typing.AsyncIterator[typing.List[KeyT]]:
+    '''
+    Iterate the keys matching the pattern (and of the type `_type`) in
+    batches of about `count` keys with `SCAN`, on all primaries of a cluster
+    one after the other. Keys may be returned more than once.
+    '''
+    if isinstance(conn, aioredis_cluster.RedisCluster):
+        nodes = conn.get_primaries()
+        if progress is not None:
+            progress.nodes = len(nodes)
+        for node in nodes:
+            cursor = 0
+            while True:
+                cursors, keys = await conn.scan(
+                    cursor, match=match, count=count, _type=_type,
+                    target_nodes=node
+                )
+                cursor = cursors[node.name]
+                _update(progress, len(keys))
+                if keys:
+                    yield keys
+                if cursor == 0:
+                    break
+            if progress is not None:
+                progress.nodes_done += 1
+        return
+    cursor = 0
+    while True:
+        cursor, keys = await conn.scan(cursor, match=match, count=count, _type=_type)   # noqa E501
+        _update(progress, len(keys))
+        if keys:
+            yield keys
+        if cursor == 0:
+            break
+    if progress is not None:
+        progress.nodes_done = 1
+
+
+async def hscan_items(
+        conn: typing.Union[aioredis.Redis, aioredis_cluster.RedisCluster],
+        key: KeyT,
+        match: typing.Optional[str]=None,
+        count: int=1000,
+        progress: typing.Optional[ScanProgress]=None
+) -> typing.AsyncIterator[typing.Dict[KeyT, KeyT]]:
+    '''
+    Iterate the fields and values of a hash in batches with `HSCAN`.
+    '''
+    cursor = 0
+    while True:
+        cursor, items = await conn.hscan(key, cursor, match=match, count=count)   # noqa E501
+        _update(progress, len(items))
+        if items:
+            yield items
+        if cursor == 0:
+            break
+    if progress is not None:
+        progress.nodes_done = 1
+
+
+async def sscan_members(
+        conn: typing.Union[aioredis.Redis, aioredis_cluster.RedisCluster],
+        key: KeyT,
+        match: typing.Optional[str]=None,
+        count: int=1000,
+        progress: typing.Optional[ScanProgress]=None
+) -> typing.AsyncIterator[typing.List[KeyT]]:
+    '''
+    Iterate the members of a set in batches with `SSCAN`.
+    '''
+    cursor = 0
+    while True:
+        cursor, members = await conn.sscan(key, cursor, match=match, count=count)   # noqa E501
+        _update(progress, len(members))
+        if members:
+            yield members
+        if cursor == 0:
+            break
+    if progress is not None:
+        progress.nodes_done = 1
+
+
+async def unlink_keys(
+        conn: typing.Union[aioredis.Redis, aioredis_cluster.RedisCluster],
+        match: str,
+        count: int=1000,
+        pause: float=0.0
+) -> typing.AsyncIterator[ScanProgress]:
+    '''
+    Unlink the keys matching the pattern, yields the progress after every
+    batch. The `UNLINK` of a batch runs while the next batch is scanned,
+    `pause` seconds between the batches limit the load of Redis.
+    '''
+    progress = ScanProgress()
+    pending: asyncio.Task = None
+
+    async def _unlink(keys: typing.List[KeyT]) -> None:
+        progress.unlinked += await conn.unlink(*keys)
+
+    try:
+        async for keys in scan_keys(conn, match=match, count=count, progress=progress):   # noqa E501
+            if pending is not None:
+                await pending
+                yield progress
+                if pause:
+                    await asyncio.sleep(pause)
+            pending = asyncio.create_task(_unlink(keys))
+        if pending is not None:
+            await pending
+            pending = None
+            yield progress
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
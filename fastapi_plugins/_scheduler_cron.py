@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fastapi_plugins._scheduler_cron
+#
+# Cron expressions with five fields "minute hour day-of-month month
+# day-of-week", e.g. "*/5 * * * *" or "0 3 * * 1-5".
+#
+
+from __future__ import absolute_import
+
+import datetime
+import math
+import time
+import typing
+
+__all__ = ['CronExpression', 'IntervalTrigger']
+
+_MACROS = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+
+_MONTHS = {
+    name: i + 1
+    for i, name in enumerate((
+        'jan', 'feb', 'mar', 'apr', 'may', 'jun',
+        'jul', 'aug', 'sep', 'oct', 'nov', 'dec'
+    ))
+}
+_DAYS = {
+    name: i
+    for i, name in enumerate(('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'))   # noqa E501
+}
+
+
+def _parse_field(
+        field: str,
+        low: int,
+        high: int,
+        names: typing.Dict[str, int]=None
+) -> typing.FrozenSet[int]:
+    values = set()
+    for part in field.split(','):
+        value, _, step = part.partition('/')
+        step = int(step) if step else 1
+        if value == '*':
+            start, end = low, high
+        else:
+            start, _, end = value.partition('-')
+            start = names.get(start.lower(), None) if names and not start.isdigit() else int(start)   # noqa E501
+            end = (names.get(end.lower(), None) if names and not end.isdigit() else int(end)) if end else (high if step > 1 else start)   # noqa E501
+        if start is None or end is None or not low <= start <= end <= high or step < 1:   # noqa E501
+            raise ValueError(f'Invalid cron field "{field}"')
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronExpression(object):
+    '''
+    Times matching a cron expression. Like cron, a day matches the day of the
+    month or the day of the week if both are restricted.
+    '''
+    __slots__ = (
+        'expression', 'minutes', 'hours', 'days', 'months', 'weekdays',
+        'any_day', 'any_weekday', 'tz'
+    )
+    # the times are wall clock times
+    clock = staticmethod(time.time)
+
+    def __init__(self, expression: str, tz: datetime.tzinfo=None):
+        self.expression = expression
+        fields = _MACROS.get(expression.strip().lower(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f'Invalid cron expression "{expression}"')
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12, _MONTHS)
+        # 7 is Sunday as well
+        self.weekdays = frozenset(day % 7 for day in _parse_field(fields[4], 0, 7, _DAYS))   # noqa E501
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+        self.tz = tz or datetime.timezone.utc
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.expression!r})'
+
+    def _match_day(self, dt: datetime.datetime) -> bool:
+        day = dt.day in self.days
+        weekday = (dt.isoweekday() % 7) in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next(self, after: float) -> float:
+        '''
+        Next matching time (epoch seconds) strictly after `after`.
+        '''
+        # the times are stepped in epoch seconds, so that they increase over
+        # the changes of the UTC offset, and only matched in the time zone
+        dt = datetime.datetime.fromtimestamp(after, self.tz).replace(second=0, microsecond=0)   # noqa E501
+        ts = dt.timestamp() + 60
+        dt = datetime.datetime.fromtimestamp(ts, self.tz)
+        # a matching time exists within 4 years (29th of February)
+        limit = dt.year + 5
+        while dt.year < limit:
+            if dt.month not in self.months:
+                start = (dt.replace(day=1) + datetime.timedelta(days=32)).replace(day=1, hour=0, minute=0)   # noqa E501
+            elif not self._match_day(dt):
+                start = (dt + datetime.timedelta(days=1)).replace(hour=0, minute=0)   # noqa E501
+            elif dt.hour not in self.hours:
+                start = (dt + datetime.timedelta(hours=1)).replace(minute=0)
+            elif dt.minute not in self.minutes:
+                start = None
+            else:
+                return ts
+            # the start of a skipped hour may not exist or be repeated
+            ts = max(start.timestamp(), ts + 60) if start is not None else ts + 60   # noqa E501
+            dt = datetime.datetime.fromtimestamp(ts, self.tz)
+        raise ValueError(f'Cron expression "{self.expression}" does never match')   # noqa E501
+
+
+class IntervalTrigger(object):
+    '''
+    Times every `interval` seconds from `start`, which do not drift with the
+    duration of the runs. The times are on the monotonic clock, so that they
+    do not jump with the system time.
+    '''
+    __slots__ = ('interval', 'start')
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, interval: float, start: float):
+        if interval <= 0:
+            raise ValueError('Interval must be greater than 0')
+        self.interval = interval
+        self.start = start
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.interval!r})'
+
+    def next(self, after: float) -> float:
+        count = max(math.floor((after - self.start) / self.interval) + 1, 1)
+        # the division may round down to the time `after`
+        while self.start + count * self.interval <= after:
+            count += 1
+        return self.start + count * self.interval
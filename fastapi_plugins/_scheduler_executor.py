@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fastapi_plugins._scheduler_executor
+#
+# Thread and process pools for blocking and CPU bound functions, which would
+# block the event loop otherwise.
+#
+
+from __future__ import absolute_import
+
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import os
+import sys
+import typing
+
+__all__ = ['ExecutorPool']
+
+
+def _noop() -> None:
+    pass
+
+
+class ExecutorPool(object):
+    '''
+    Pool of `workers` threads (`kind='thread'`) or processes
+    (`kind='process'`). A process is replaced after `max_tasks_per_child`
+    calls, which limits the memory of leaking libraries.
+    '''
+    def __init__(
+            self,
+            kind: str,
+            workers: int=None,
+            max_tasks_per_child: int=None,
+            name: str='fastapi-plugins'
+    ):
+        self.kind = kind
+        if kind == 'thread':
+            # the default of ThreadPoolExecutor
+            self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix=name
+            )
+        elif kind == 'process':
+            options = {}
+            if max_tasks_per_child:
+                if sys.version_info < (3, 11):
+                    raise ValueError('max_tasks_per_child requires Python 3.11')   # noqa E501
+                options['max_tasks_per_child'] = max_tasks_per_child
+            self.workers = workers or os.cpu_count() or 1
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                **options
+            )
+        else:
+            raise ValueError(f'Unknown executor kind "{kind}"')
+        self.max_tasks_per_child = max_tasks_per_child
+        self.submitted = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self._futures: typing.Set[concurrent.futures.Future] = set()
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.kind!r}, workers={self.workers})'   # noqa E501
+
+    async def warm_up(self) -> None:
+        '''
+        Start all threads or processes, so that the first calls do not wait
+        for them (a process imports the application).
+        '''
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(self.executor, _noop)
+            for _ in range(self.workers)
+        ))
+
+    async def run(self, func: typing.Callable, *args, **kwargs) -> typing.Any:
+        loop = asyncio.get_running_loop()
+        if self.kind == 'thread':
+            # as `asyncio.to_thread()`, the function sees the context
+            call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)   # noqa E501
+        else:
+            call = functools.partial(func, *args, **kwargs)
+        self.submitted += 1
+        self.active += 1
+        try:
+            result = await asyncio.wrap_future(self._submit(call), loop=loop)
+        except Exception:
+            self.failed += 1
+            raise
+        else:
+            self.completed += 1
+            return result
+        finally:
+            self.active -= 1
+
+    def _submit(self, call: typing.Callable) -> concurrent.futures.Future:
+        future = self.executor.submit(call)
+        if sys.version_info < (3, 9):
+            # the calls, which did not start, are cancelled by `shutdown()`
+            self._futures.add(future)
+            future.add_done_callback(self._futures.discard)
+        return future
+
+    def shutdown(self) -> None:
+        '''
+        Cancel the calls, which did not start. The running calls finish in
+        the background.
+        '''
+        if sys.version_info >= (3, 9):
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            return
+        # `cancel_futures` requires Python 3.9
+        for future in list(self._futures):
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
+    def stats(self) -> typing.Dict:
+        return dict(
+            workers=self.workers,
+            max_tasks_per_child=self.max_tasks_per_child,
+            submitted=self.submitted,
+            active=self.active,
+            queued=max(0, self.active - self.workers),
+            completed=self.completed,
+            failed=self.failed
+        )
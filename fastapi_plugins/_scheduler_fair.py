@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fastapi_plugins._scheduler_fair
+#
+# Priority levels with weighted fair queuing of the tenants in every level
+# "https://en.wikipedia.org/wiki/Weighted_fair_queueing"
+#
+
+from __future__ import absolute_import
+
+import heapq
+import itertools
+import typing
+
+__all__ = ['FairQueue']
+
+
+class FairQueue(object):
+    '''
+    Queue of items with a level and a tenant. The items of the first level
+    are taken before the items of the next levels. In a level, the tenants
+    get turns in proportion to their `weights` (default `default_weight`),
+    and the items of a tenant keep their order.
+    '''
+    def __init__(
+            self,
+            levels: typing.Sequence[str],
+            weights: typing.Dict[str, float]=None,
+            default_weight: float=1.0
+    ):
+        self.levels = list(levels)
+        self.weights = dict(weights or {})
+        self.default_weight = default_weight
+        self._heaps: typing.Dict[str, typing.List] = {level: [] for level in self.levels}   # noqa E501
+        self._vtime: typing.Dict[str, float] = {level: 0.0 for level in self.levels}   # noqa E501
+        self._finish: typing.Dict[str, typing.Dict[typing.Optional[str], float]] = {level: {} for level in self.levels}   # noqa E501
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return sum(len(heap) for heap in self._heaps.values())
+
+    def depth(self, level: str) -> int:
+        return len(self._heaps[level])
+
+    def put(self, item: typing.Any, level: str, tenant: str=None) -> None:
+        weight = self.weights.get(tenant, self.default_weight)
+        if weight <= 0:
+            raise ValueError(f'Weight of tenant {tenant} must be greater than 0')   # noqa E501
+        finish = self._finish[level]
+        # the virtual finish time, a tenant does not save up turns while idle
+        tag = max(self._vtime[level], finish.get(tenant, 0.0)) + 1.0 / weight
+        finish[tenant] = tag
+        heapq.heappush(self._heaps[level], (tag, next(self._seq), item))
+
+    def get(self) -> typing.Any:
+        for level in self.levels:
+            heap = self._heaps[level]
+            if heap:
+                tag, _, item = heapq.heappop(heap)
+                self._vtime[level] = tag
+                if not heap:
+                    # the tenants of an idle level start equal
+                    self._finish[level].clear()
+                return item
+        raise IndexError('get from an empty queue')
+
+    def drain(self) -> typing.Iterator[typing.Any]:
+        while len(self):
+            yield self.get()
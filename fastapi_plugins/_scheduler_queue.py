@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fastapi_plugins._scheduler_queue
+#
+# Durable job queue in a Redis stream with consumer groups
+# "https://redis.io/docs/latest/develop/data-types/streams/"
+#
+
+from __future__ import absolute_import
+
+import asyncio
+import os
+import socket
+import typing
+import uuid
+
+import aiojobs
+import orjson
+import redis.exceptions
+
+from ._redis import RedisPlugin
+
+__all__ = ['RedisJobQueue']
+
+_START = '0-0'
+
+
+def _str(value: typing.Union[str, bytes]) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class RedisJobQueue(object):
+    '''
+    Jobs in the Redis stream `stream`, which are consumed by the workers of
+    the consumer group `group`. A job is a call of a registered task with
+    arguments, which are serialized as JSON.
+
+    A job is acknowledged, when the task succeeded. The job of a failed
+    task, or of a worker which died, is taken over by any worker after
+    `visibility_timeout` seconds (`XAUTOCLAIM`), so the tasks run at least
+    once. A job delivered more than `max_deliveries` times is moved to the
+    stream `<stream>:dead`.
+    '''
+    def __init__(
+            self,
+            plugin: RedisPlugin,
+            stream: str,
+            group: str='fastapi-plugins',
+            consumer: str=None,
+            visibility_timeout: float=30.0,
+            max_deliveries: int=5,
+            batch: int=10,
+            maxlen: int=None,
+            block: float=1.0
+    ):
+        self.plugin = plugin
+        self.stream = stream
+        self.dead_stream = f'{stream}:dead'
+        self.group = group
+        self.consumer = consumer or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'   # noqa E501
+        self.visibility_timeout = visibility_timeout
+        self.max_deliveries = max_deliveries
+        self.batch = batch
+        self.maxlen = maxlen
+        self.block = block
+        self.tasks: typing.Dict[str, typing.Callable[..., typing.Awaitable]] = {}   # noqa E501
+        #
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.reclaimed = 0
+        self.dead = 0
+        self.errors = 0
+        self.last_error: str = None
+        self._concurrency = 0
+        self._in_flight: typing.Set[str] = set()
+        self._free = asyncio.Event()
+        self._tasks: typing.List[asyncio.Task] = []
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.stream!r}, group={self.group!r})'   # noqa E501
+
+    @property
+    def _visibility_ms(self) -> int:
+        return max(1, int(self.visibility_timeout * 1000))
+
+    async def setup(self) -> None:
+        conn = await self.plugin()
+        try:
+            await conn.xgroup_create(self.stream, self.group, id=_START, mkstream=True)   # noqa E501
+        except redis.exceptions.ResponseError as e:
+            if not str(e).startswith('BUSYGROUP'):
+                raise
+
+    async def enqueue(
+            self,
+            task: str,
+            args: typing.Sequence=(),
+            kwargs: typing.Dict[str, typing.Any]=None
+    ) -> str:
+        '''
+        Add a job to the stream, returns the id of the job.
+        '''
+        conn = await self.plugin()
+        job_id = await conn.xadd(
+            self.stream,
+            {
+                'task': task,
+                'payload': orjson.dumps(dict(args=list(args), kwargs=kwargs or {}))   # noqa E501
+            },
+            maxlen=self.maxlen,
+            approximate=True
+        )
+        self.enqueued += 1
+        return _str(job_id)
+
+    def start(self, scheduler: aiojobs.Scheduler, concurrency: int) -> None:
+        '''
+        Consume the jobs with at most `concurrency` jobs at a time.
+        '''
+        if not self._tasks:
+            self._concurrency = concurrency
+            self._free.set()
+            self._tasks = [
+                asyncio.create_task(self._consume(scheduler)),
+                asyncio.create_task(self._reclaim(scheduler))
+            ]
+
+    async def stop(self) -> None:
+        '''
+        Stop consuming. The jobs in flight are taken over by other workers,
+        if they do not finish.
+        '''
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    def _available(self) -> int:
+        return max(0, self._concurrency - len(self._in_flight))
+
+    def _error(self, e: Exception) -> None:
+        self.errors += 1
+        self.last_error = repr(e)
+
+    async def _consume(self, scheduler: aiojobs.Scheduler) -> None:
+        while True:
+            if not self._available():
+                self._free.clear()
+                await self._free.wait()
+                continue
+            try:
+                conn = await self.plugin()
+                response = await conn.xreadgroup(
+                    self.group,
+                    self.consumer,
+                    {self.stream: '>'},
+                    count=min(self.batch, self._available()),
+                    block=max(1, int(self.block * 1000))
+                )
+                for _, messages in response or ():
+                    for job_id, fields in messages:
+                        await self._dispatch(scheduler, conn, _str(job_id), fields)   # noqa E501
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._error(e)
+                await asyncio.sleep(self.block)
+
+    async def _reclaim(self, scheduler: aiojobs.Scheduler) -> None:
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 3)
+            try:
+                conn = await self.plugin()
+                if self._in_flight:
+                    # the jobs in flight stay invisible to the other workers
+                    await conn.xclaim(
+                        self.stream, self.group, self.consumer,
+                        min_idle_time=0,
+                        message_ids=list(self._in_flight),
+                        justid=True
+                    )
+                start = _START
+                while self._available():
+                    start, messages, *_ = await conn.xautoclaim(
+                        self.stream, self.group, self.consumer,
+                        min_idle_time=self._visibility_ms,
+                        start_id=start,
+                        count=min(self.batch, self._available())
+                    )
+                    for job_id, fields in messages:
+                        job_id = _str(job_id)
+                        if job_id in self._in_flight:
+                            continue
+                        self.reclaimed += 1
+                        await self._dispatch(scheduler, conn, job_id, fields, reclaimed=True)   # noqa E501
+                    if _str(start) == _START:
+                        break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._error(e)
+
+    async def _dispatch(
+            self,
+            scheduler: aiojobs.Scheduler,
+            conn: typing.Any,
+            job_id: str,
+            fields: typing.Optional[typing.Dict],
+            reclaimed: bool=False
+    ) -> None:
+        if not fields:
+            # the job was trimmed from the stream
+            await conn.xack(self.stream, self.group, job_id)
+            return
+        fields = {_str(k): v for k, v in fields.items()}
+        name = _str(fields.get('task', ''))
+        if reclaimed and self.max_deliveries:
+            pending = await conn.xpending_range(self.stream, self.group, min=job_id, max=job_id, count=1)   # noqa E501
+            if pending and pending[0]['times_delivered'] > self.max_deliveries:   # noqa E501
+                await self._bury(conn, job_id, fields, 'Too many deliveries')
+                return
+        func = self.tasks.get(name)
+        if func is None:
+            await self._bury(conn, job_id, fields, f'Task {name} is not registered')   # noqa E501
+            return
+        self._in_flight.add(job_id)
+        try:
+            await scheduler.spawn(self._run(job_id, func, fields['payload']), name=f'{self.stream}:{job_id}')   # noqa E501
+        except Exception:
+            self._in_flight.discard(job_id)
+            raise
+
+    async def _bury(self, conn: typing.Any, job_id: str, fields: typing.Dict, reason: str) -> None:   # noqa E501
+        await conn.xadd(self.dead_stream, dict(fields, id=job_id, reason=reason))   # noqa E501
+        await conn.xack(self.stream, self.group, job_id)
+        self.dead += 1
+
+    async def _run(
+            self,
+            job_id: str,
+            func: typing.Callable[..., typing.Awaitable],
+            payload: typing.Union[str, bytes]
+    ) -> None:
+        try:
+            try:
+                data = orjson.loads(payload)
+                await func(*data['args'], **data['kwargs'])
+            except Exception as e:
+                # the job is delivered again after the visibility timeout
+                self.failed += 1
+                self.last_error = repr(e)
+                return
+            conn = await self.plugin()
+            await conn.xack(self.stream, self.group, job_id)
+            self.processed += 1
+        finally:
+            self._in_flight.discard(job_id)
+            self._free.set()
+
+    async def stats(self) -> typing.Dict:
+        stats = dict(
+            stream=self.stream,
+            group=self.group,
+            consumer=self.consumer,
+            consuming=bool(self._tasks),
+            in_flight=len(self._in_flight),
+            enqueued=self.enqueued,
+            processed=self.processed,
+            failed=self.failed,
+            reclaimed=self.reclaimed,
+            dead=self.dead,
+            errors=self.errors,
+            last_error=self.last_error,
+            length=None,
+            pending=None
+        )
+        try:
+            conn = await self.plugin()
+            stats['length'] = await conn.xlen(self.stream)
+            stats['pending'] = (await conn.xpending(self.stream, self.group))['pending']   # noqa E501
+        except Exception as e:
+            self._error(e)
+        return stats
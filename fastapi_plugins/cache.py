@@ -0,0 +1,934 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fastapi_plugins.cache
+
+from __future__ import absolute_import
+
+import abc
+import asyncio
+import collections
+import enum
+import math
+import random
+import time
+import typing
+import uuid
+
+import fastapi
+import orjson
+import pydantic_settings
+import redis.asyncio.cluster as aioredis_cluster
+import redis.client
+import redis.exceptions
+import starlette.requests
+
+from .codec import Codec, CodecError
+from .control import ControlHealthMixin
+from .memory import MemoryCachePlugin, MemoryCacheSettings
+from .plugin import Plugin, PluginError
+from .utils import Annotated
+
+__all__ = [
+    'CacheError', 'CacheBackend', 'RedisCacheBackend', 'MemcachedCacheBackend',
+    'MemoryCacheBackend', 'TieredCacheBackend', 'get_cache_backend', 'SingleFlight',
+    'get_or_compute', 'CacheType', 'CacheSettings', 'CachePlugin',
+    'cache_plugin', 'depends_cache', 'TCachePlugin'
+]
+
+_MISSING = object()
+
+# compare-and-delete, so that only the owner releases a lock
+_UNLOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# set the key and add it to the tag sets, which expire with their last key
+_SET_TAGGED_SCRIPT = """
+local ttl = tonumber(ARGV[2])
+redis.call('set', KEYS[1], ARGV[1], 'ex', ttl)
+for i = 2, #KEYS do
+    redis.call('sadd', KEYS[i], KEYS[1])
+    if redis.call('ttl', KEYS[i]) < ttl then
+        redis.call('expire', KEYS[i], ttl)
+    end
+end
+return #KEYS - 1
+"""
+
+# add the key to one tag set (Redis Cluster)
+_ADD_TAG_SCRIPT = """
+local ttl = tonumber(ARGV[2])
+redis.call('sadd', KEYS[1], ARGV[1])
+if redis.call('ttl', KEYS[1]) < ttl then
+    redis.call('expire', KEYS[1], ttl)
+end
+return 1
+"""
+
+
+class CacheError(PluginError):
+    pass
+
+
+class CacheBackend(object):
+    '''
+    Bytes in, bytes out view of a cache plugin, resolved on every call so that
+    it follows the plugin through `init()` and `terminate()`.
+    '''
+    def __init__(self, plugin: Plugin):
+        self.plugin = plugin
+
+    @property
+    @abc.abstractmethod
+    def ttl(self) -> int:
+        pass
+
+    @property
+    def codec(self) -> Codec:
+        if self.plugin.codec is None:
+            raise CacheError('Cache backend is not initialized')
+        return self.plugin.codec
+
+    async def get_value(self, key: str) -> typing.Any:
+        return self.codec.decode(await self.get(key))
+
+    async def set_value(self, key: str, value: typing.Any, ttl: int=None) -> None:
+        await self.set(key, self.codec.encode(value), ttl)
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> typing.Optional[bytes]:
+        pass
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: bytes, ttl: int=None) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def delete(self, key: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def get_many(self, keys: typing.List[str]) -> typing.Dict[str, bytes]:
+        pass
+
+    @abc.abstractmethod
+    async def set_many(
+            self,
+            values: typing.Mapping[str, bytes],
+            ttl: int=None
+    ) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def incr(self, key: str, delta: int=1, ttl: int=None) -> int:
+        pass
+
+    @abc.abstractmethod
+    async def expire(self, key: str, ttl: int) -> bool:
+        pass
+
+    @abc.abstractmethod
+    async def get_ttl(self, key: str) -> typing.Optional[int]:
+        pass
+
+    @abc.abstractmethod
+    async def lock(self, key: str, token: str, ttl: float) -> bool:
+        pass
+
+    async def set_tagged(
+            self,
+            key: str,
+            value: bytes,
+            ttl: int=None,
+            tags: typing.Iterable[str]=()
+    ) -> None:
+        raise CacheError(f'Tags are not supported by {type(self).__name__}')
+
+    async def invalidate_tag(self, tag: str, batch: int=500) -> int:
+        raise CacheError(f'Tags are not supported by {type(self).__name__}')
+
+    @abc.abstractmethod
+    async def unlock(self, key: str, token: str) -> None:
+        pass
+
+
+class RedisCacheBackend(CacheBackend):
+    @property
+    def ttl(self) -> int:
+        return self.plugin.config.redis_ttl
+
+    async def get(self, key: str) -> typing.Optional[bytes]:
+        conn = await self.plugin()
+        # values are binary, regardless of `redis_decode_responses`
+        return await conn.execute_command('GET', key, **{redis.client.NEVER_DECODE: []})   # noqa E501
+
+    async def set(self, key: str, value: bytes, ttl: int=None) -> None:
+        conn = await self.plugin()
+        await conn.set(key, value, ex=ttl or self.ttl)
+
+    async def delete(self, key: str) -> None:
+        conn = await self.plugin()
+        await conn.delete(key)
+
+    async def get_many(self, keys: typing.List[str]) -> typing.Dict[str, bytes]:
+        conn = await self.plugin()
+        if isinstance(conn, aioredis_cluster.RedisCluster):
+            # keys of several slots can not be read by one MGET
+            values = await asyncio.gather(*[self.get(key) for key in keys])
+        else:
+            values = await conn.execute_command('MGET', *keys, **{redis.client.NEVER_DECODE: []})   # noqa E501
+        return {key: value for key, value in zip(keys, values) if value is not None}   # noqa E501
+
+    async def set_many(
+            self,
+            values: typing.Mapping[str, bytes],
+            ttl: int=None
+    ) -> None:
+        conn = await self.plugin()
+        pipe = conn.pipeline(transaction=False)
+        for key, value in values.items():
+            pipe.set(key, value, ex=ttl or self.ttl)
+        await pipe.execute()
+
+    async def incr(self, key: str, delta: int=1, ttl: int=None) -> int:
+        conn = await self.plugin()
+        pipe = conn.pipeline(transaction=False)
+        pipe.incrby(key, delta)
+        pipe.ttl(key)
+        value, _ttl = await pipe.execute()
+        if _ttl == -1:
+            # a new counter
+            await conn.expire(key, ttl or self.ttl)
+        return value
+
+    async def expire(self, key: str, ttl: int) -> bool:
+        conn = await self.plugin()
+        return bool(await conn.expire(key, ttl))
+
+    async def get_ttl(self, key: str) -> typing.Optional[int]:
+        conn = await self.plugin()
+        ttl = await conn.ttl(key)
+        return ttl if ttl >= 0 else None
+
+    async def lock(self, key: str, token: str, ttl: float) -> bool:
+        conn = await self.plugin()
+        return bool(await conn.set(key, token, nx=True, px=max(1, int(ttl * 1000))))
+
+    async def unlock(self, key: str, token: str) -> None:
+        conn = await self.plugin()
+        await conn.eval(_UNLOCK_SCRIPT, 1, key, token)
+
+    @staticmethod
+    def tag_key(tag: str) -> str:
+        # the hash tag keeps the set and its renamed copy in one cluster slot
+        return f'tag:{{{tag}}}'
+
+    async def set_tagged(
+            self,
+            key: str,
+            value: bytes,
+            ttl: int=None,
+            tags: typing.Iterable[str]=()
+    ) -> None:
+        conn = await self.plugin()
+        ttl = ttl or self.ttl
+        tag_keys = [self.tag_key(tag) for tag in tags]
+        if not isinstance(conn, aioredis_cluster.RedisCluster):
+            await conn.eval(_SET_TAGGED_SCRIPT, 1 + len(tag_keys), key, *tag_keys, value, ttl)   # noqa E501
+            return
+        # the key and the tag sets are in different slots, hence the tag sets
+        # are updated after the key, in one round trip.
+        pipe = conn.pipeline()
+        pipe.set(key, value, ex=ttl)
+        for tag_key in tag_keys:
+            pipe.eval(_ADD_TAG_SCRIPT, 1, tag_key, key, ttl)
+        await pipe.execute()
+
+    async def invalidate_tag(self, tag: str, batch: int=500) -> int:
+        '''
+        Unlink the keys of the tag in batches of `batch` keys, returns the
+        number of unlinked keys. Keys tagged meanwhile are kept for the next
+        invalidation.
+        '''
+        conn = await self.plugin()
+        tag_key = self.tag_key(tag)
+        invalidated_key = f'{tag_key}:{uuid.uuid4().hex}'
+        try:
+            await conn.rename(tag_key, invalidated_key)
+        except redis.exceptions.ResponseError:
+            # no keys with this tag
+            return 0
+        count = 0
+        try:
+            while True:
+                keys = await conn.spop(invalidated_key, batch)
+                if not keys:
+                    break
+                count += await conn.unlink(*keys)
+                await self._unlinked(keys)
+        finally:
+            await conn.unlink(invalidated_key)
+        return count
+
+    async def _unlinked(self, keys: typing.List[typing.Union[str, bytes]]) -> None:   # noqa E501
+        pass
+
+
+class MemcachedCacheBackend(CacheBackend):
+    @property
+    def ttl(self) -> int:
+        return self.plugin.config.memcached_ttl
+
+    async def get(self, key: str) -> typing.Optional[bytes]:
+        conn = await self.plugin()
+        return await conn.get(key.encode())
+
+    async def set(self, key: str, value: bytes, ttl: int=None) -> None:
+        conn = await self.plugin()
+        await conn.set(key.encode(), value, exptime=ttl or self.ttl)
+
+    async def delete(self, key: str) -> None:
+        conn = await self.plugin()
+        await conn.delete(key.encode())
+
+    async def get_many(self, keys: typing.List[str]) -> typing.Dict[str, bytes]:
+        conn = await self.plugin()
+        values = await conn.get_many([key.encode() for key in keys])
+        return {key.decode(): value for key, value in values.items()}
+
+    async def set_many(
+            self,
+            values: typing.Mapping[str, bytes],
+            ttl: int=None
+    ) -> None:
+        conn = await self.plugin()
+        await conn.set_many(
+            {key.encode(): value for key, value in values.items()},
+            exptime=ttl or self.ttl
+        )
+
+    async def incr(self, key: str, delta: int=1, ttl: int=None) -> int:
+        conn = await self.plugin()
+        while True:
+            if delta >= 0:
+                value = await conn.incr(key.encode(), delta)
+            else:
+                value = await conn.decr(key.encode(), -delta)
+            if value is not None:
+                return value
+            # a new counter, unless another client was faster
+            value = max(delta, 0)
+            if await conn.add(key.encode(), str(value).encode(), exptime=ttl or self.ttl):   # noqa E501
+                return value
+
+    async def expire(self, key: str, ttl: int) -> bool:
+        conn = await self.plugin()
+        return await conn.touch(key.encode(), ttl)
+
+    async def get_ttl(self, key: str) -> typing.Optional[int]:
+        conn = await self.plugin()
+        ttl = (await conn.meta_get(key.encode(), 't')).ttl
+        return ttl if ttl is not None and ttl >= 0 else None
+
+    async def lock(self, key: str, token: str, ttl: float) -> bool:
+        conn = await self.plugin()
+        return await conn.add(key.encode(), token.encode(), exptime=max(1, math.ceil(ttl)))   # noqa E501
+
+    async def unlock(self, key: str, token: str) -> None:
+        conn = await self.plugin()
+        # the lock is not deleted, if it expired and was taken by another
+        # worker since it was read
+        result = await conn.meta_get(key.encode(), 'v', 'c')
+        if result.value == token.encode():
+            await conn.meta_delete(key.encode(), f'C{result.cas}')
+
+
+class MemoryCacheBackend(CacheBackend):
+    @property
+    def ttl(self) -> int:
+        return self.plugin.config.memory_ttl
+
+    async def get(self, key: str) -> typing.Optional[bytes]:
+        return (await self.plugin()).get(key)
+
+    async def set(self, key: str, value: bytes, ttl: int=None) -> None:
+        (await self.plugin()).set(key, value, ttl or self.ttl)
+
+    async def delete(self, key: str) -> None:
+        (await self.plugin()).delete(key)
+
+    async def get_many(self, keys: typing.List[str]) -> typing.Dict[str, bytes]:
+        memory = await self.plugin()
+        values = {key: memory.get(key) for key in keys}
+        return {key: value for key, value in values.items() if value is not None}   # noqa E501
+
+    async def set_many(
+            self,
+            values: typing.Mapping[str, bytes],
+            ttl: int=None
+    ) -> None:
+        memory = await self.plugin()
+        for key, value in values.items():
+            memory.set(key, value, ttl or self.ttl)
+
+    async def incr(self, key: str, delta: int=1, ttl: int=None) -> int:
+        return (await self.plugin()).incr(key, delta, ttl or self.ttl)
+
+    async def expire(self, key: str, ttl: int) -> bool:
+        return (await self.plugin()).expire(key, ttl)
+
+    async def get_ttl(self, key: str) -> typing.Optional[int]:
+        ttl = (await self.plugin()).ttl(key)
+        return None if ttl is None else math.ceil(ttl)
+
+    async def lock(self, key: str, token: str, ttl: float) -> bool:
+        return (await self.plugin()).add(key, token.encode(), ttl)
+
+    async def unlock(self, key: str, token: str) -> None:
+        memory = await self.plugin()
+        if memory.get(key) == token.encode():
+            memory.delete(key)
+
+
+class TieredCacheBackend(RedisCacheBackend):
+    '''
+    Redis (L2) with an in-process memory cache (L1) in front of it. Writes of
+    a worker publish the keys on a channel, all other workers evict them
+    from their L1. The L1 is bypassed while the channel is not subscribed,
+    and it is emptied after a reconnect, since messages may have been lost.
+    '''
+    def __init__(self, plugin: Plugin, l1: MemoryCachePlugin, channel: str):
+        super(TieredCacheBackend, self).__init__(plugin)
+        self.l1 = l1
+        self.channel = channel
+        self.invalidations = 0
+        self._id = uuid.uuid4().hex
+        self._version = 0
+        self._reads: typing.Counter[str] = collections.Counter()
+        self._ready = False
+        self._pubsub = None
+        self._task: asyncio.Task = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    @property
+    def l1_ttl(self) -> int:
+        return self.l1.config.memory_ttl
+
+    async def start(self) -> None:
+        await self.l1.init()
+        await self._subscribe()
+        self._task = asyncio.create_task(self._listen())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._reset()
+        await self.l1.terminate()
+
+    async def _subscribe(self) -> None:
+        conn = await self.plugin()
+        if isinstance(conn, aioredis_cluster.RedisCluster):
+            raise CacheError('Tiered cache does not support Redis Cluster')
+        pubsub = conn.pubsub()
+        try:
+            await pubsub.subscribe(self.channel)
+        except BaseException:
+            await pubsub.close()
+            raise
+        self._pubsub = pubsub
+        self._ready = True
+
+    async def _reset(self) -> None:
+        self._ready = False
+        self._evict(None)
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                if self._pubsub is None:
+                    await self._subscribe()
+                async for message in self._pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    data = orjson.loads(message['data'])
+                    if data['id'] != self._id:
+                        self._evict(data['keys'])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await self._reset()
+                await asyncio.sleep(1)
+
+    def _evict(self, keys: typing.Optional[typing.Iterable[str]]) -> None:
+        if keys is None:
+            self._version += 1
+            self.l1.memory.clear()
+            return
+        for key in keys:
+            if key in self._reads:
+                self._version += 1
+            if self.l1.memory.delete(key):
+                self.invalidations += 1
+
+    async def _read(
+            self,
+            keys: typing.List[str],
+            read: typing.Callable[[], typing.Awaitable]
+    ) -> typing.Tuple[typing.Any, int]:
+        # values read during an invalidation of one of the keys may be
+        # stale already, they are not put into the L1.
+        version = self._version
+        self._reads.update(keys)
+        try:
+            return await read(), version
+        finally:
+            self._reads.subtract(keys)
+            for key in keys:
+                if self._reads[key] <= 0:
+                    del self._reads[key]
+
+    async def _publish(self, keys: typing.List[str]) -> None:
+        self._evict(keys)
+        conn = await self.plugin()
+        await conn.publish(self.channel, orjson.dumps(dict(id=self._id, keys=keys)))   # noqa E501
+
+    def _l1_set(self, key: str, value: bytes, ttl: int, version: int) -> None:
+        if self._ready and version == self._version:
+            self.l1.memory.set(key, value, min(ttl or self.ttl, self.l1_ttl))
+
+    async def get(self, key: str) -> typing.Optional[bytes]:
+        if self._ready:
+            value = self.l1.memory.get(key)
+            if value is not None:
+                return value
+        value, version = await self._read(
+            [key],
+            lambda: super(TieredCacheBackend, self).get(key)
+        )
+        if value is not None:
+            self._l1_set(key, value, None, version)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: int=None) -> None:
+        await super(TieredCacheBackend, self).set(key, value, ttl)
+        await self._publish([key])
+        self._l1_set(key, value, ttl, self._version)
+
+    async def delete(self, key: str) -> None:
+        await super(TieredCacheBackend, self).delete(key)
+        await self._publish([key])
+
+    async def get_many(self, keys: typing.List[str]) -> typing.Dict[str, bytes]:
+        values = {}
+        if self._ready:
+            values = {key: self.l1.memory.get(key) for key in keys}
+            values = {key: value for key, value in values.items() if value is not None}   # noqa E501
+        missing = [key for key in keys if key not in values]
+        if missing:
+            found, version = await self._read(
+                missing,
+                lambda: super(TieredCacheBackend, self).get_many(missing)
+            )
+            for key, value in found.items():
+                self._l1_set(key, value, None, version)
+            values.update(found)
+        return values
+
+    async def set_many(
+            self,
+            values: typing.Mapping[str, bytes],
+            ttl: int=None
+    ) -> None:
+        await super(TieredCacheBackend, self).set_many(values, ttl)
+        await self._publish(list(values))
+        version = self._version
+        for key, value in values.items():
+            self._l1_set(key, value, ttl, version)
+
+    async def set_tagged(
+            self,
+            key: str,
+            value: bytes,
+            ttl: int=None,
+            tags: typing.Iterable[str]=()
+    ) -> None:
+        await super(TieredCacheBackend, self).set_tagged(key, value, ttl, tags)   # noqa E501
+        await self._publish([key])
+        self._l1_set(key, value, ttl, self._version)
+
+    async def _unlinked(self, keys: typing.List[typing.Union[str, bytes]]) -> None:   # noqa E501
+        await self._publish([
+            key.decode() if isinstance(key, bytes) else key
+            for key in keys
+        ])
+
+    async def incr(self, key: str, delta: int=1, ttl: int=None) -> int:
+        value = await super(TieredCacheBackend, self).incr(key, delta, ttl)
+        await self._publish([key])
+        return value
+
+    async def expire(self, key: str, ttl: int) -> bool:
+        result = await super(TieredCacheBackend, self).expire(key, ttl)
+        await self._publish([key])
+        return result
+
+    def stats(self) -> typing.Dict:
+        return dict(
+            ready=self._ready,
+            invalidations=self.invalidations,
+            **self.l1.memory.stats()
+        )
+
+
+_BACKENDS = dict(
+    redis=('REDIS', RedisCacheBackend),
+    memcached=('MEMCACHED', MemcachedCacheBackend),
+    memory=('MEMORY', MemoryCacheBackend),
+)
+
+
+def get_cache_backend(app: fastapi.FastAPI, backend: str) -> CacheBackend:
+    try:
+        state, klass = _BACKENDS[backend]
+    except KeyError:
+        raise CacheError(f'Unknown cache backend "{backend}"')
+    plugin = getattr(app.state, state, None)
+    if plugin is None:
+        raise CacheError(f'Cache backend "{backend}" is not initialized')
+    return klass(plugin)
+
+
+class SingleFlight(object):
+    '''
+    Run a single call per key at a time, concurrent callers of the same key
+    share its result.
+    '''
+    def __init__(self):
+        self._calls: typing.Dict[typing.Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        return key in self._calls
+
+    async def do(
+            self,
+            key: typing.Hashable,
+            func: typing.Callable[[], typing.Awaitable]
+    ) -> typing.Any:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._forget(key, future))
+        # a cancelled caller does not cancel the call of the others
+        return await asyncio.shield(future)
+
+    def _forget(self, key: typing.Hashable, future: asyncio.Future) -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+
+
+_single_flight = SingleFlight()
+
+
+def _dumps_entry(
+        codec: Codec,
+        value: typing.Any,
+        delta: float,
+        ttl: int
+) -> bytes:
+    return orjson.dumps([time.time() + ttl, delta]) + b'\n' + codec.encode(value)   # noqa E501
+
+
+def _loads_entry(
+        codec: Codec,
+        data: bytes
+) -> typing.Tuple[float, float, typing.Any]:
+    meta, value = data.split(b'\n', 1)
+    expiry, delta = orjson.loads(meta)
+    return expiry, delta, codec.decode(value)
+
+
+async def get_or_compute(
+        backend: CacheBackend,
+        key: str,
+        compute: typing.Callable[[], typing.Awaitable],
+        ttl: int=None,
+        beta: float=1.0,
+        lock_timeout: float=10.0,
+        lock_poll: float=0.05
+) -> typing.Any:
+    '''
+    Get the value of the key or compute, store and return it.
+
+    * only one coroutine per process computes a key (single flight)
+    * only one process computes a key, the others wait for its value
+      (distributed lock `lock:<key>` for at most `lock_timeout` seconds)
+    * the value is refreshed before it expires with a probability growing
+      towards the expiry and with the compute time ("XFetch"), while the
+      other callers are served the current value. `beta > 1` favors earlier
+      refreshes, `beta=0` disables them.
+    '''
+    ttl = ttl or backend.ttl
+    codec = backend.codec
+    flight = (id(backend.plugin), key)
+    data = await backend.get(key)
+    if data is not None:
+        expiry, delta, value = _loads_entry(codec, data)
+        early = delta * beta * math.log(1.0 - random.random())    # nosec B311
+        if time.time() - early < expiry or flight in _single_flight:
+            return value
+    else:
+        value = _MISSING
+
+    async def _compute() -> typing.Any:
+        token = uuid.uuid4().hex
+        lock_key = f'lock:{key}'
+        locked = await backend.lock(lock_key, token, lock_timeout)
+        if not locked:
+            if value is not _MISSING:
+                # another process refreshes the value
+                return value
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(lock_poll)
+                data = await backend.get(key)
+                if data is not None:
+                    return _loads_entry(codec, data)[2]
+        try:
+            start = time.monotonic()
+            result = await compute()
+            await backend.set(
+                key,
+                _dumps_entry(codec, result, time.monotonic() - start, ttl),
+                ttl
+            )
+            return result
+        finally:
+            if locked:
+                await backend.unlock(lock_key, token)
+
+    return await _single_flight.do(flight, _compute)
+
+
+@enum.unique
+class CacheType(str, enum.Enum):
+    memory = 'memory'
+    redis = 'redis'
+    memcached = 'memcached'
+    tiered = 'tiered'
+
+
+class CacheSettings(MemoryCacheSettings):
+    cache_type: CacheType = CacheType.memory
+    cache_ttl: int = 3600
+    cache_namespace: typing.Optional[str] = None
+    #
+    cache_l1_ttl: int = 60
+    cache_channel: str = 'fastapi_plugins:cache:invalidate'
+    #
+    cache_prestart_tries: int = 60 * 5  # 5 min
+    cache_prestart_wait: int = 1        # 1 second
+
+
+class CachePlugin(Plugin, ControlHealthMixin):
+    '''
+    One API for the values of all caches. The backend is a plugin of its own
+    (`CACHE_TYPE`), configured by the same settings as the plugin, while
+    the TTL and the prestart settings are shared by all backends.
+    '''
+    DEFAULT_CONFIG_CLASS = CacheSettings
+
+    def _on_init(self) -> None:
+        self.plugin: Plugin = None
+        self.backend: CacheBackend = None
+
+    async def _on_call(self) -> 'CachePlugin':
+        if self.backend is None:
+            raise CacheError('Cache is not initialized')
+        return self
+
+    async def init_app(
+            self,
+            app: fastapi.FastAPI,
+            config: pydantic_settings.BaseSettings=None
+    ) -> None:
+        self.config = config or self.DEFAULT_CONFIG_CLASS()
+        if self.config is None:
+            raise CacheError('Cache configuration is not initialized')
+        elif not isinstance(self.config, self.DEFAULT_CONFIG_CLASS):
+            raise CacheError('Cache configuration is not valid')
+        app.state.CACHE = self
+
+    def _create_plugin(
+            self,
+            plugin_class: typing.Type[Plugin],
+            prefix: str,
+            ttl: int
+    ) -> Plugin:
+        settings_class = plugin_class.DEFAULT_CONFIG_CLASS
+        if not isinstance(self.config, settings_class):
+            raise CacheError(f'Cache type {self.config.cache_type} requires {settings_class.__name__}')    # noqa E501
+        shared = {
+            f'{prefix}_ttl': ttl,
+            f'{prefix}_prestart_tries': self.config.cache_prestart_tries,
+            f'{prefix}_prestart_wait': self.config.cache_prestart_wait,
+        }
+        plugin = plugin_class()
+        plugin.config = self.config.model_copy(update={
+            name: value
+            for name, value in shared.items()
+            if name in settings_class.model_fields
+        })
+        return plugin
+
+    async def init(self):
+        if self.backend is not None:
+            raise CacheError('Cache is already initialized')
+        cache_type = self.config.cache_type
+        ttl = self.config.cache_ttl
+        if cache_type == CacheType.memory:
+            plugin = self._create_plugin(MemoryCachePlugin, 'memory', ttl)
+        elif cache_type in (CacheType.redis, CacheType.tiered):
+            from ._redis import RedisPlugin
+            plugin = self._create_plugin(RedisPlugin, 'redis', ttl)
+        elif cache_type == CacheType.memcached:
+            from .memcached import MemcachedPlugin
+            plugin = self._create_plugin(MemcachedPlugin, 'memcached', ttl)
+        else:
+            raise NotImplementedError(f'Cache type {cache_type} is not implemented')    # noqa E501
+        await plugin.init()
+        self.plugin = plugin
+        if cache_type == CacheType.tiered:
+            backend = TieredCacheBackend(
+                plugin,
+                self._create_plugin(MemoryCachePlugin, 'memory', self.config.cache_l1_ttl),   # noqa E501
+                self.config.cache_channel
+            )
+            await backend.start()
+            self.backend = backend
+        else:
+            self.backend = _BACKENDS[cache_type][1](plugin)
+
+    async def terminate(self):
+        self.config = None
+        if isinstance(self.backend, TieredCacheBackend):
+            await self.backend.close()
+        self.backend = None
+        if self.plugin is not None:
+            await self.plugin.terminate()
+            self.plugin = None
+
+    async def health(self) -> typing.Dict:
+        health = dict(
+            cache_type=self.config.cache_type,
+            cache_backend=await self.plugin.health()
+        )
+        if isinstance(self.backend, TieredCacheBackend):
+            health.update(cache_l1=self.backend.stats())
+        return health
+
+    def _key(self, key: str) -> str:
+        if self.config.cache_namespace:
+            return f'{self.config.cache_namespace}:{key}'
+        return key
+
+    def _decode(self, data: bytes) -> typing.Any:
+        try:
+            return self.backend.codec.decode(data)
+        except CodecError:
+            # counters of `incr()` are plain integers
+            try:
+                return int(data)
+            except ValueError:
+                raise CacheError('Value is not encoded by a codec')
+
+    async def get(self, key: str, default: typing.Any=None) -> typing.Any:
+        data = await self.backend.get(self._key(key))
+        return default if data is None else self._decode(data)
+
+    async def set(
+            self,
+            key: str,
+            value: typing.Any,
+            ttl: int=None,
+            tags: typing.Iterable[str]=None
+    ) -> None:
+        '''
+        Set the value, `tags` (Redis only) allow to invalidate groups of keys
+        with `invalidate_tag()`.
+        '''
+        data = self.backend.codec.encode(value)
+        if tags:
+            await self.backend.set_tagged(self._key(key), data, ttl, [self._key(tag) for tag in tags])   # noqa E501
+        else:
+            await self.backend.set(self._key(key), data, ttl)
+
+    async def invalidate_tag(self, tag: str) -> int:
+        '''
+        Delete all keys of the tag, returns the number of deleted keys.
+        '''
+        return await self.backend.invalidate_tag(self._key(tag))
+
+    async def get_many(self, keys: typing.Iterable[str]) -> typing.Dict[str, typing.Any]:   # noqa E501
+        keys = {self._key(key): key for key in keys}
+        values = await self.backend.get_many(list(keys))
+        return {keys[key]: self._decode(data) for key, data in values.items()}
+
+    async def set_many(
+            self,
+            values: typing.Mapping[str, typing.Any],
+            ttl: int=None
+    ) -> None:
+        await self.backend.set_many(
+            {
+                self._key(key): self.backend.codec.encode(value)
+                for key, value in values.items()
+            },
+            ttl
+        )
+
+    async def delete(self, *keys: str) -> None:
+        await asyncio.gather(*[self.backend.delete(self._key(key)) for key in keys])   # noqa E501
+
+    async def incr(self, key: str, delta: int=1, ttl: int=None) -> int:
+        '''
+        Increment the counter by `delta`, a new counter starts at `0` and
+        expires after `ttl` seconds.
+        '''
+        return await self.backend.incr(self._key(key), delta, ttl)
+
+    async def expire(self, key: str, ttl: int) -> bool:
+        return await self.backend.expire(self._key(key), ttl)
+
+    async def ttl(self, key: str) -> typing.Optional[int]:
+        '''
+        Remaining time-to-live of the key in seconds, `None` if the key does
+        not exist or does not expire.
+        '''
+        return await self.backend.get_ttl(self._key(key))
+
+
+cache_plugin = CachePlugin()
+
+
+async def depends_cache(
+    conn: starlette.requests.HTTPConnection
+) -> CachePlugin:
+    return await conn.app.state.CACHE()
+
+
+TCachePlugin = Annotated[CachePlugin, fastapi.Depends(depends_cache)]
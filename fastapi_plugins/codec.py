@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fastapi_plugins.codec
+
+from __future__ import absolute_import
+
+import enum
+import pickle  # nosec B403
+import typing
+import zlib
+
+import orjson
+
+from .plugin import PluginError
+
+__all__ = ['CodecError', 'CodecType', 'CompressionType', 'Codec']
+
+# a stored value is "<magic><codec><compression><payload>", so that it is
+# decoded by the codec it was written with, if that codec is allowed.
+MAGIC = 0xFC
+
+
+class CodecError(PluginError):
+    pass
+
+
+@enum.unique
+class CodecType(str, enum.Enum):
+    raw = 'raw'
+    json = 'json'
+    msgpack = 'msgpack'
+    pickle = 'pickle'
+
+
+@enum.unique
+class CompressionType(str, enum.Enum):
+    none = 'none'
+    zlib = 'zlib'
+    zstd = 'zstd'
+    lz4 = 'lz4'
+
+
+def _raw_dumps(value: typing.Any) -> bytes:
+    if isinstance(value, str):
+        return value.encode()
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    raise CodecError(f'Codec {CodecType.raw} requires bytes, not {type(value)}')  # noqa E501
+
+
+def _raw_loads(data: bytes) -> bytes:
+    return data
+
+
+def _json_dumps(value: typing.Any) -> bytes:
+    return orjson.dumps(value)
+
+
+def _pickle_dumps(value: typing.Any) -> bytes:
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _pickle_loads(data: bytes) -> typing.Any:
+    # only for values written by the application itself
+    return pickle.loads(data)   # nosec B301
+
+
+def _msgpack() -> typing.Tuple[typing.Callable, typing.Callable]:
+    try:
+        import msgpack
+    except ImportError:
+        raise CodecError(f'Codec {CodecType.msgpack} requires msgpack to be installed')  # noqa E501
+    return (
+        lambda value: msgpack.packb(value, use_bin_type=True),
+        lambda data: msgpack.unpackb(data, raw=False)
+    )
+
+
+def _zlib(level: int=None) -> typing.Tuple[typing.Callable, typing.Callable]:
+    level = -1 if level is None else level
+    return lambda data: zlib.compress(data, level), zlib.decompress
+
+
+def _zstd(level: int=None) -> typing.Tuple[typing.Callable, typing.Callable]:
+    try:
+        import zstandard
+    except ImportError:
+        raise CodecError(f'Compression {CompressionType.zstd} requires zstandard to be installed')  # noqa E501
+    compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+    decompressor = zstandard.ZstdDecompressor()
+    return compressor.compress, decompressor.decompress
+
+
+def _lz4(level: int=None) -> typing.Tuple[typing.Callable, typing.Callable]:
+    try:
+        import lz4.frame
+    except ImportError:
+        raise CodecError(f'Compression {CompressionType.lz4} requires lz4 to be installed')  # noqa E501
+    return (
+        lambda data: lz4.frame.compress(data, compression_level=level or 0),
+        lz4.frame.decompress
+    )
+
+
+_CODECS = {
+    CodecType.raw: (0, lambda: (_raw_dumps, _raw_loads)),
+    CodecType.json: (1, lambda: (_json_dumps, orjson.loads)),
+    CodecType.msgpack: (2, _msgpack),
+    CodecType.pickle: (3, lambda: (_pickle_dumps, _pickle_loads)),
+}
+
+_COMPRESSIONS = {
+    CompressionType.none: (0, lambda level: (None, None)),
+    CompressionType.zlib: (1, _zlib),
+    CompressionType.zstd: (2, _zstd),
+    CompressionType.lz4: (3, _lz4),
+}
+
+_CODEC_IDS = {_id: codec for codec, (_id, _) in _CODECS.items()}
+
+# codecs, which do not run code of the data they decode
+SAFE_CODECS = frozenset((CodecType.raw, CodecType.json, CodecType.msgpack))
+_COMPRESSION_IDS = {_id: compression for compression, (_id, _) in _COMPRESSIONS.items()}   # noqa E501
+
+
+class Codec(object):
+    '''
+    Serialize values to tagged bytes. The payload is compressed, if it is at
+    least `compression_threshold` bytes long and the compression makes it
+    shorter.
+
+    Decoding follows the tag of the value, so that the codec and the
+    compression can be changed while older values are still cached. Values
+    are decoded by the configured codec and the `decode_codecs` (default
+    the codecs, which do not run code) only, `pickle` must be configured or
+    allowed explicitly.
+    '''
+    def __init__(
+            self,
+            codec: CodecType=CodecType.json,
+            compression: CompressionType=CompressionType.none,
+            compression_threshold: int=1024,
+            compression_level: int=None,
+            decode_codecs: typing.Optional[typing.Iterable[CodecType]]=None
+    ):
+        self.codec = CodecType(codec)
+        if decode_codecs is None:
+            decode_codecs = SAFE_CODECS
+        self.decode_codecs = frozenset(CodecType(c) for c in decode_codecs) | {self.codec}   # noqa E501
+        self.compression = CompressionType(compression)
+        self.compression_threshold = compression_threshold
+        self.compression_level = compression_level
+        self._header = bytes((MAGIC, _CODECS[self.codec][0], 0))
+        self._compressed_header = bytes((
+            MAGIC,
+            _CODECS[self.codec][0],
+            _COMPRESSIONS[self.compression][0]
+        ))
+        self._dumps, _ = _CODECS[self.codec][1]()
+        self._compress, _ = _COMPRESSIONS[self.compression][1](compression_level)   # noqa E501
+        # decoders are resolved on the first value tagged with them
+        self._loads: typing.Dict[int, typing.Callable] = {}
+        self._decompress: typing.Dict[int, typing.Callable] = {}
+        self._derived: typing.Dict[CodecType, 'Codec'] = {}
+
+    @classmethod
+    def from_settings(cls, config: typing.Any, prefix: str) -> 'Codec':
+        decode_codecs = getattr(config, f'{prefix}_decode_codecs', None)
+        if decode_codecs is not None:
+            decode_codecs = [c.strip() for c in decode_codecs.split(',') if c.strip()]   # noqa E501
+        return cls(
+            codec=getattr(config, f'{prefix}_codec'),
+            compression=getattr(config, f'{prefix}_compression'),
+            compression_threshold=getattr(config, f'{prefix}_compression_threshold'),   # noqa E501
+            compression_level=getattr(config, f'{prefix}_compression_level'),
+            decode_codecs=decode_codecs
+        )
+
+    def derive(self, codec: CodecType) -> 'Codec':
+        '''
+        Codec with the same compression, e.g. `raw` for the already
+        serialized values.
+        '''
+        codec = CodecType(codec)
+        if codec == self.codec:
+            return self
+        if codec not in self._derived:
+            self._derived[codec] = type(self)(
+                codec=codec,
+                compression=self.compression,
+                compression_threshold=self.compression_threshold,
+                compression_level=self.compression_level,
+                decode_codecs=self.decode_codecs
+            )
+        return self._derived[codec]
+
+    def encode(self, value: typing.Any) -> bytes:
+        payload = self._dumps(value)
+        if self._compress is not None and len(payload) >= self.compression_threshold:   # noqa E501
+            compressed = self._compress(payload)
+            if len(compressed) < len(payload):
+                return self._compressed_header + compressed
+        return self._header + payload
+
+    def decode(self, data: typing.Optional[bytes]) -> typing.Any:
+        if data is None:
+            return None
+        if isinstance(data, str):
+            raise CodecError('Encoded value is decoded to str, use a binary read')   # noqa E501
+        if len(data) < 3 or data[0] != MAGIC:
+            raise CodecError('Value is not encoded by a codec')
+        payload = data[3:]
+        if data[2]:
+            payload = self._get_decompress(data[2])(payload)
+        return self._get_loads(data[1])(payload)
+
+    def _get_loads(self, codec_id: int) -> typing.Callable:
+        loads = self._loads.get(codec_id)
+        if loads is None:
+            try:
+                codec = _CODEC_IDS[codec_id]
+            except KeyError:
+                raise CodecError(f'Unknown codec {codec_id}')
+            if codec not in self.decode_codecs:
+                # e.g. a pickle payload written into the cache by others
+                raise CodecError(f'Codec {codec} is not allowed for decoding')   # noqa E501
+            loads = self._loads[codec_id] = _CODECS[codec][1]()[1]
+        return loads
+
+    def _get_decompress(self, compression_id: int) -> typing.Callable:
+        decompress = self._decompress.get(compression_id)
+        if decompress is None:
+            try:
+                compression = _COMPRESSION_IDS[compression_id]
+            except KeyError:
+                raise CodecError(f'Unknown compression {compression_id}')
+            decompress = _COMPRESSIONS[compression][1](None)[1]
+            self._decompress[compression_id] = decompress
+        return decompress
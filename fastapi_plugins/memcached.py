@@ -4,10 +4,19 @@
 
 from __future__ import absolute_import
 
+import asyncio
+import bisect
+import functools
+import hashlib
+import sys
+import time
 import typing
 
 try:
     import aiomcache
+    import aiomcache.client
+    import aiomcache.constants
+    import aiomcache.exceptions
 except ImportError:
     raise RuntimeError('aiomcache is not installed')
 
@@ -16,16 +25,24 @@ import pydantic_settings
 import starlette.requests
 import tenacity
 
+from .codec import Codec, CodecType, CompressionType
 from .control import ControlHealthMixin
 from .plugin import Plugin, PluginError, PluginSettings
 from .utils import Annotated
 
 __all__ = [
     'MemcachedError', 'MemcachedSettings', 'MemcachedClient',
-    'MemcachedPlugin', 'memcached_plugin', 'depends_memcached',
-    'TMemcachedPlugin'
+    'MetaResult', 'KetamaRing', 'MemcachedRingClient', 'MemcachedPlugin',
+    'memcached_plugin', 'depends_memcached', 'TMemcachedPlugin',
+    'meta_get_or_compute'
 ]
 
+# the hash of the ketama points, `usedforsecurity` requires Python 3.9
+if sys.version_info >= (3, 9):
+    _md5 = functools.partial(hashlib.md5, usedforsecurity=False)
+else:
+    _md5 = hashlib.md5
+
 
 class MemcachedError(PluginError):
     pass
@@ -34,26 +51,556 @@ class MemcachedError(PluginError):
 class MemcachedSettings(PluginSettings):
     memcached_host: str = 'localhost'
     memcached_port: int = 11211
+    memcached_servers: typing.Optional[str] = None
     memcached_pool_size: int = 10
     memcached_pool_minsize: int = 1
+    memcached_chunk_size: int = 100
+    memcached_coalesce: bool = False
+    memcached_ttl: int = 3600
+    #
+    memcached_codec: CodecType = CodecType.json
+    memcached_compression: CompressionType = CompressionType.none
+    memcached_compression_threshold: int = 1024
+    memcached_compression_level: typing.Optional[int] = None
+    memcached_decode_codecs: typing.Optional[str] = None
+    #
+    memcached_flush_on_terminate: bool = False
+    memcached_terminate_timeout: float = 10
     #
-    # TODO: xxx - should be shared across caches
+    # shared across caches by `CACHE_PRESTART_*` of the cache plugin
     memcached_prestart_tries: int = 60 * 5  # 5 min
     memcached_prestart_wait: int = 1        # 1 second
 
+    def get_servers(self) -> typing.List[typing.Tuple[str, int]]:
+        if self.memcached_servers:
+            try:
+                return [
+                    (
+                        _server.split(':')[0].strip(),
+                        int(_server.split(':')[1].strip())
+                    )
+                    for _server in self.memcached_servers.split(',')
+                    if _server.strip()
+                ]
+            except Exception as e:
+                raise RuntimeError(f'bad servers string :: {type(e)} :: {str(e)} :: {self.memcached_servers}')  # noqa
+        else:
+            return [(self.memcached_host, self.memcached_port)]
+
+
+def _chunks(items: typing.List, size: int) -> typing.Iterator[typing.List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class MetaResult(object):
+    '''
+    Response of a meta command: the status code (`VA`, `HD`, `EN`, `NS`,
+    `EX`, `NF`), the value and the returned flags by name.
+    '''
+    __slots__ = ('status', 'value', 'flags')
+
+    def __init__(
+            self,
+            status: str,
+            value: typing.Optional[bytes]=None,
+            flags: typing.Dict[str, str]=None
+    ):
+        self.status = status
+        self.value = value
+        self.flags = flags or {}
+
+    def __repr__(self) -> str:
+        return f'MetaResult({self.status!r}, {self.value!r}, {self.flags!r})'
+
+    @property
+    def hit(self) -> bool:
+        return self.status in ('VA', 'HD')
+
+    @property
+    def won(self) -> bool:
+        # the client has to recompute the value
+        return 'W' in self.flags
+
+    @property
+    def stale(self) -> bool:
+        return 'X' in self.flags
+
+    @property
+    def win_sent(self) -> bool:
+        # another client recomputes the value
+        return 'Z' in self.flags
+
+    @property
+    def ttl(self) -> typing.Optional[int]:
+        return int(self.flags['t']) if 't' in self.flags else None
+
+    @property
+    def cas(self) -> typing.Optional[int]:
+        return int(self.flags['c']) if 'c' in self.flags else None
+
+    @property
+    def opaque(self) -> typing.Optional[str]:
+        return self.flags.get('O')
+
 
 class MemcachedClient(aiomcache.Client):
+    '''
+    With `coalesce` the `get` calls issued in the same event loop iteration
+    are sent as one multi-key `get`.
+    '''
+    def __init__(
+            self,
+            *args,
+            chunk_size: int=100,
+            coalesce: bool=False,
+            **kwargs
+    ):
+        super(MemcachedClient, self).__init__(*args, **kwargs)
+        self.chunk_size = chunk_size
+        self.coalesce = coalesce
+        self._pending: typing.Dict[bytes, typing.List[asyncio.Future]] = {}
+        self._handle: asyncio.Handle = None
+        self._fetching: typing.Set[asyncio.Task] = set()
+
     async def ping(self) -> bytes:
         return await self.version()
 
+    def in_flight(self) -> int:
+        return len(self._pool._in_use) + len(self._pending) + len(self._fetching)  # noqa E501
+
+    async def drain(self, timeout: float) -> bool:
+        '''
+        Wait for at most `timeout` seconds for the operations in flight.
+        '''
+        deadline = time.monotonic() + timeout
+        while self.in_flight():
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+    async def close(self) -> None:
+        await super(MemcachedClient, self).close()
+        # the calls still in flight after `drain()` are aborted
+        for task in self._fetching:
+            task.cancel()
+        for conn in list(self._pool._in_use):
+            self._pool._do_close(conn)
+
+    async def get(self, key: bytes, default: typing.Any=None) -> typing.Any:
+        if not self.coalesce:
+            return await super(MemcachedClient, self).get(key, default)
+        self._validate_key(key)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(key, []).append(future)
+        if self._handle is None:
+            self._handle = loop.call_soon(self._flush)
+        value = await future
+        return default if value is None else value
+
+    async def _incr_decr(
+            self,
+            conn: typing.Any,
+            command: bytes,
+            key: bytes,
+            delta: int
+    ) -> typing.Optional[int]:
+        # a missing counter is `None`, as documented by `aiomcache`
+        cmd = b' '.join([command, key, str(delta).encode()]) + b'\r\n'
+        resp = await self._execute_simple_command(conn, cmd)
+        if resp == aiomcache.constants.NOT_FOUND:
+            return None
+        if not resp.isdigit():
+            raise aiomcache.exceptions.ClientException(f'Memcached {command} command failed', resp)   # noqa E501
+        return int(resp)
+
+    def _flush(self) -> None:
+        self._handle = None
+        pending, self._pending = self._pending, {}
+        if pending:
+            task = asyncio.ensure_future(self._fetch(pending))
+            self._fetching.add(task)
+            task.add_done_callback(self._fetching.discard)
+
+    async def _fetch(
+            self,
+            pending: typing.Dict[bytes, typing.List[asyncio.Future]]
+    ) -> None:
+        try:
+            values = await self.get_many(pending)
+        except Exception as e:
+            values = e
+        except asyncio.CancelledError:
+            for futures in pending.values():
+                for future in futures:
+                    future.cancel()
+            raise
+        for key, futures in pending.items():
+            for future in futures:
+                # the caller may have been cancelled meanwhile
+                if future.done():
+                    continue
+                if isinstance(values, Exception):
+                    future.set_exception(values)
+                else:
+                    future.set_result(values.get(key))
+
+    async def get_many(
+            self,
+            keys: typing.Iterable[bytes]
+    ) -> typing.Dict[bytes, bytes]:
+        '''
+        Get the values of the keys in chunks of `chunk_size` keys, the
+        missing keys are omitted.
+        '''
+        keys = list(dict.fromkeys(keys))
+        chunks = list(_chunks(keys, self.chunk_size))
+        results = await asyncio.gather(*[
+            self.multi_get(*chunk) for chunk in chunks
+        ])
+        return {
+            key: value
+            for chunk, values in zip(chunks, results)
+            for key, value in zip(chunk, values)
+            if value is not None
+        }
+
+    async def set_many(
+            self,
+            values: typing.Mapping[bytes, bytes],
+            exptime: int=0
+    ) -> typing.List[bytes]:
+        '''
+        Set the values in chunks of `chunk_size` keys, every chunk is sent
+        as one pipeline. Return the keys which were not stored.
+        '''
+        items = list(values.items())
+        results = await asyncio.gather(*[
+            self._set_many(chunk, exptime)
+            for chunk in _chunks(items, self.chunk_size)
+        ])
+        return [key for failed in results for key in failed]
+
+    @aiomcache.client.acquire
+    async def _set_many(
+            self,
+            conn: typing.Any,
+            items: typing.List[typing.Tuple[bytes, bytes]],
+            exptime: int
+    ) -> typing.List[bytes]:
+        commands = []
+        for key, value in items:
+            self._validate_key(key)
+            commands.append(b'set %b 0 %d %d\r\n%b\r\n' % (key, exptime, len(value), value))   # noqa E501
+        conn.writer.write(b''.join(commands))
+        failed = []
+        for key, _ in items:
+            response = await conn.reader.readline()
+            if response == b'STORED\r\n':
+                continue
+            elif response.startswith((b'ERROR', b'CLIENT_ERROR')):
+                # the connection is out of sync and is dropped
+                raise aiomcache.exceptions.ClientException('set_many failed', response)   # noqa E501
+            failed.append(key)
+        return failed
+
+    @staticmethod
+    def _meta_flags(flags: typing.Iterable[str]) -> bytes:
+        return b''.join(b' ' + flag.encode() for flag in flags)
+
+    @staticmethod
+    def _validate_meta_flags(flags: typing.Iterable[str]) -> None:
+        # quiet mode suppresses responses, it is used by pipelines only
+        if 'q' in flags:
+            raise aiomcache.exceptions.ValidationException('quiet mode is not supported', flags)   # noqa E501
+
+    @staticmethod
+    async def _read_meta(conn: typing.Any) -> MetaResult:
+        line = await conn.reader.readline()
+        terms = line.split()
+        if not terms:
+            raise aiomcache.exceptions.ClientException('meta command failed', line)   # noqa E501
+        status = terms[0].decode()
+        if status == 'VA':
+            value = (await conn.reader.readexactly(int(terms[1]) + 2))[:-2]
+            terms = terms[2:]
+        elif status in ('HD', 'EN', 'NS', 'EX', 'NF', 'MN'):
+            value = None
+            terms = terms[1:]
+        else:
+            raise aiomcache.exceptions.ClientException('meta command failed', line)   # noqa E501
+        return MetaResult(
+            status,
+            value,
+            {term[:1].decode(): term[1:].decode() for term in terms}
+        )
+
+    @aiomcache.client.acquire
+    async def _meta_command(
+            self,
+            conn: typing.Any,
+            command: bytes
+    ) -> MetaResult:
+        conn.writer.write(command)
+        return await self._read_meta(conn)
+
+    async def meta_get(self, key: bytes, *flags: str) -> MetaResult:
+        '''
+        Meta get (`mg`), e.g. `meta_get(key, 'v', 't', 'N30', 'R10')` returns
+        the value and the remaining TTL in one round trip, creates the item
+        on a miss and hands out the right to recompute it (`won`) to exactly
+        one client, while the others see `win_sent` and the (`stale`) value.
+        '''
+        self._validate_key(key)
+        self._validate_meta_flags(flags)
+        return await self._meta_command(
+            b'mg %b%b\r\n' % (key, self._meta_flags(flags))
+        )
+
+    async def meta_set(self, key: bytes, value: bytes, *flags: str) -> MetaResult:  # noqa E501
+        '''
+        Meta set (`ms`), e.g. `meta_set(key, value, 'T60')`.
+        '''
+        self._validate_key(key)
+        self._validate_meta_flags(flags)
+        return await self._meta_command(
+            b'ms %b %d%b\r\n%b\r\n' % (key, len(value), self._meta_flags(flags), value)   # noqa E501
+        )
+
+    async def meta_delete(self, key: bytes, *flags: str) -> MetaResult:
+        '''
+        Meta delete (`md`), e.g. `meta_delete(key, 'I', 'T30')` marks the
+        item as stale instead of deleting it.
+        '''
+        self._validate_key(key)
+        self._validate_meta_flags(flags)
+        return await self._meta_command(
+            b'md %b%b\r\n' % (key, self._meta_flags(flags))
+        )
+
+    async def meta_get_many(
+            self,
+            keys: typing.Iterable[bytes],
+            *flags: str
+    ) -> typing.Dict[bytes, MetaResult]:
+        '''
+        Pipelined meta get of the keys in chunks of `chunk_size` keys, the
+        responses are matched by opaque tokens and misses are omitted.
+        '''
+        keys = list(dict.fromkeys(keys))
+        results = await asyncio.gather(*[
+            self._meta_get_many(chunk, flags)
+            for chunk in _chunks(keys, self.chunk_size)
+        ])
+        return {key: result for _results in results for key, result in _results.items()}   # noqa E501
+
+    @aiomcache.client.acquire
+    async def _meta_get_many(
+            self,
+            conn: typing.Any,
+            keys: typing.List[bytes],
+            flags: typing.Iterable[str]
+    ) -> typing.Dict[bytes, MetaResult]:
+        _flags = self._meta_flags(flags)
+        commands = []
+        for i, key in enumerate(keys):
+            self._validate_key(key)
+            commands.append(b'mg %b%b O%d q\r\n' % (key, _flags, i))
+        # the no-op marks the end of the responses
+        conn.writer.write(b''.join(commands) + b'mn\r\n')
+        results = {}
+        while True:
+            result = await self._read_meta(conn)
+            if result.status == 'MN':
+                return results
+            results[keys[int(result.opaque)]] = result
+
+
+class KetamaRing(object):
+    '''
+    Consistent hashing of keys to nodes (ketama). Every node owns `points`
+    points of the ring, a key belongs to the next point clockwise, so that
+    adding or removing a node moves only the keys of that node.
+    '''
+    def __init__(self, nodes: typing.Iterable[str]=(), points: int=160):
+        self.points = points
+        self.nodes: typing.List[str] = []
+        self._hashes: typing.List[int] = []
+        self._owners: typing.List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _digest(data: bytes) -> bytes:
+        return _md5(data).digest()
+
+    def add(self, node: str) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        points = []
+        for i in range(self.points // 4):
+            digest = self._digest(f'{node}-{i}'.encode())
+            points.extend(
+                (int.from_bytes(digest[j * 4:j * 4 + 4], 'little'), node)
+                for j in range(4)
+            )
+        self._build(sorted(list(zip(self._hashes, self._owners)) + points))
+
+    def remove(self, node: str) -> None:
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        self._build([
+            (_hash, owner)
+            for _hash, owner in zip(self._hashes, self._owners)
+            if owner != node
+        ])
+
+    def _build(self, points: typing.List[typing.Tuple[int, str]]) -> None:
+        self._hashes = [_hash for _hash, _ in points]
+        self._owners = [owner for _, owner in points]
+
+    def get_node(self, key: bytes) -> str:
+        if not self._hashes:
+            raise MemcachedError('Memcached ring is empty')
+        _hash = int.from_bytes(self._digest(key)[:4], 'little')
+        index = bisect.bisect(self._hashes, _hash)
+        return self._owners[index % len(self._owners)]
+
+
+def _keyed(name: str) -> typing.Callable:
+    async def command(self, key: bytes, *args, **kwargs) -> typing.Any:
+        return await getattr(self.get_client(key), name)(key, *args, **kwargs)
+    command.__name__ = name
+    return command
+
+
+class MemcachedRingClient(object):
+    '''
+    Client of several Memcached servers, every server has its own pool and
+    keys are distributed by consistent hashing.
+    '''
+    def __init__(
+            self,
+            servers: typing.List[typing.Tuple[str, int]],
+            **kwargs
+    ):
+        self.clients: typing.Dict[str, MemcachedClient] = {
+            f'{host}:{port}': MemcachedClient(host=host, port=port, **kwargs)
+            for host, port in servers
+        }
+        self.ring = KetamaRing(self.clients)
+
+    def get_client(self, key: bytes) -> MemcachedClient:
+        return self.clients[self.ring.get_node(key)]
+
+    get = _keyed('get')
+    gets = _keyed('gets')
+    set = _keyed('set')
+    cas = _keyed('cas')
+    add = _keyed('add')
+    replace = _keyed('replace')
+    append = _keyed('append')
+    prepend = _keyed('prepend')
+    incr = _keyed('incr')
+    decr = _keyed('decr')
+    touch = _keyed('touch')
+    delete = _keyed('delete')
+    meta_get = _keyed('meta_get')
+    meta_set = _keyed('meta_set')
+    meta_delete = _keyed('meta_delete')
+
+    async def meta_get_many(
+            self,
+            keys: typing.Iterable[bytes],
+            *flags: str
+    ) -> typing.Dict[bytes, MetaResult]:
+        results = await asyncio.gather(*[
+            self.clients[node].meta_get_many(_keys, *flags)
+            for node, _keys in self._group(keys).items()
+        ])
+        return {key: result for _results in results for key, result in _results.items()}   # noqa E501
+
+    def _group(self, keys: typing.Iterable[bytes]) -> typing.Dict[str, typing.List[bytes]]:  # noqa E501
+        nodes: typing.Dict[str, typing.List[bytes]] = {}
+        for key in keys:
+            nodes.setdefault(self.ring.get_node(key), []).append(key)
+        return nodes
+
+    async def get_many(
+            self,
+            keys: typing.Iterable[bytes]
+    ) -> typing.Dict[bytes, bytes]:
+        results = await asyncio.gather(*[
+            self.clients[node].get_many(_keys)
+            for node, _keys in self._group(keys).items()
+        ])
+        return {key: value for values in results for key, value in values.items()}   # noqa E501
+
+    async def set_many(
+            self,
+            values: typing.Mapping[bytes, bytes],
+            exptime: int=0
+    ) -> typing.List[bytes]:
+        results = await asyncio.gather(*[
+            self.clients[node].set_many(
+                {key: values[key] for key in _keys},
+                exptime
+            )
+            for node, _keys in self._group(values).items()
+        ])
+        return [key for failed in results for key in failed]
+
+    async def multi_get(self, *keys: bytes) -> typing.Tuple:
+        nodes = self._group(keys)
+        results = await asyncio.gather(*[
+            self.clients[node].multi_get(*_keys)
+            for node, _keys in nodes.items()
+        ])
+        values = {}
+        for _keys, _values in zip(nodes.values(), results):
+            values.update(zip(_keys, _values))
+        return tuple(values[key] for key in keys)
+
+    async def _each(self, name: str, *args) -> typing.Dict[str, typing.Any]:
+        results = await asyncio.gather(*[
+            getattr(client, name)(*args) for client in self.clients.values()
+        ])
+        return dict(zip(self.clients, results))
+
+    async def stats(self, args: bytes=None) -> typing.Dict[str, typing.Dict]:
+        return await self._each('stats', args)
+
+    async def version(self) -> typing.Dict[str, bytes]:
+        return await self._each('version')
+
+    async def ping(self) -> typing.Dict[str, bytes]:
+        return await self._each('ping')
+
+    async def flush_all(self) -> None:
+        await self._each('flush_all')
+
+    async def close(self) -> None:
+        await self._each('close')
+
+    def in_flight(self) -> int:
+        return sum(client.in_flight() for client in self.clients.values())
+
+    async def drain(self, timeout: float) -> bool:
+        return all((await self._each('drain', timeout)).values())
+
 
 class MemcachedPlugin(Plugin, ControlHealthMixin):
     DEFAULT_CONFIG_CLASS = MemcachedSettings
 
     def _on_init(self) -> None:
-        self.memcached: MemcachedClient = None
+        self.memcached: typing.Union[MemcachedClient, MemcachedRingClient] = None
+        self.codec: Codec = None
 
-    async def _on_call(self) -> MemcachedClient:
+    async def _on_call(self) -> typing.Union[MemcachedClient, MemcachedRingClient]:
         if self.memcached is None:
             raise MemcachedError('Memcached is not initialized')
         return self.memcached
@@ -73,12 +620,19 @@ class MemcachedPlugin(Plugin, ControlHealthMixin):
     async def init(self):
         if self.memcached is not None:
             raise MemcachedError('Memcached is already initialized')
-        self.memcached = MemcachedClient(
-            host=self.config.memcached_host,
-            port=self.config.memcached_port,
-            pool_size=2,
-            pool_minsize=None
+        self.codec = Codec.from_settings(self.config, 'memcached')
+        servers = self.config.get_servers()
+        opts = dict(
+            pool_size=self.config.memcached_pool_size,
+            pool_minsize=self.config.memcached_pool_minsize,
+            chunk_size=self.config.memcached_chunk_size,
+            coalesce=self.config.memcached_coalesce
         )
+        if len(servers) > 1:
+            self.memcached = MemcachedRingClient(servers, **opts)
+        else:
+            host, port = servers[0]
+            self.memcached = MemcachedClient(host=host, port=port, **opts)
 
         @tenacity.retry(
             stop=tenacity.stop_after_attempt(
@@ -97,16 +651,27 @@ class MemcachedPlugin(Plugin, ControlHealthMixin):
             raise MemcachedError(f'Memcached initialization failed :: {type(e)} :: {str(e)}')   # noqa
 
     async def terminate(self):
-        self.config = None
+        config, self.config = self.config, None
         if self.memcached is not None:
-            await self.memcached.flush_all()
-            await self.memcached.close()
-            self.memcached = None
+            # new calls fail, the calls in flight are completed
+            memcached, self.memcached = self.memcached, None
+            await memcached.drain(config.memcached_terminate_timeout)
+            if config.memcached_flush_on_terminate:
+                await memcached.flush_all()
+            await memcached.close()
 
     async def health(self) -> typing.Dict:
+        if isinstance(self.memcached, MemcachedRingClient):
+            return dict(
+                servers={
+                    node: version.decode()
+                    for node, version in (await self.memcached.ping()).items()
+                }
+            )
+        host, port = self.config.get_servers()[0]
         return dict(
-            host=self.config.memcached_host,
-            port=self.config.memcached_port,
+            host=host,
+            port=port,
             version=(await self.memcached.ping()).decode()
         )
 
@@ -116,8 +681,51 @@ memcached_plugin = MemcachedPlugin()
 
 async def depends_memcached(
     conn: starlette.requests.HTTPConnection
-) -> MemcachedClient:
+) -> typing.Union[MemcachedClient, MemcachedRingClient]:
     return await conn.app.state.MEMCACHED()
 
 
-TMemcachedPlugin = Annotated[MemcachedClient, fastapi.Depends(depends_memcached)]
+TMemcachedPlugin = Annotated[
+    typing.Union[MemcachedClient, MemcachedRingClient],
+    fastapi.Depends(depends_memcached)
+]
+
+
+async def meta_get_or_compute(
+        client: typing.Union[MemcachedClient, MemcachedRingClient],
+        key: bytes,
+        compute: typing.Callable[[], typing.Awaitable[bytes]],
+        ttl: int,
+        lease_ttl: int=30,
+        recache: int=0,
+        poll: float=0.05
+) -> bytes:
+    '''
+    Get the value of the key or compute and store it, with the meta protocol:
+
+    * on a miss exactly one client wins the lease to compute the value, the
+      others wait for at most `lease_ttl` seconds
+    * a stale value (`meta_delete(key, 'I')`) or a value expiring within
+      `recache` seconds is served, while exactly one client recomputes it
+
+    Empty values are leases and must not be stored.
+    '''
+    flags = ['v', 'c', f'N{lease_ttl}'] + ([f'R{recache}'] if recache else [])
+    deadline = time.monotonic() + lease_ttl
+    while True:
+        result = await client.meta_get(key, *flags)
+        if result.won:
+            try:
+                value = await compute()
+            except BaseException:
+                if not result.stale:
+                    # release the lease, so that another client computes it
+                    await client.meta_delete(key, f'C{result.cas}')
+                raise
+            await client.meta_set(key, value, f'T{ttl}')
+            return value
+        if result.value or result.stale or not result.win_sent:
+            return result.value
+        if time.monotonic() > deadline:
+            raise MemcachedError(f'Memcached lease of {key!r} is not released')
+        await asyncio.sleep(poll)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fastapi_plugins.memoize
+
+from __future__ import absolute_import
+
+import functools
+import hashlib
+import inspect
+import logging
+import typing
+
+import orjson
+
+from ._redis import RedisPlugin, redis_plugin
+from .cache import (
+    CacheBackend, CacheError, CachePlugin, MemcachedCacheBackend, MemoryCacheBackend,
+    RedisCacheBackend, SingleFlight, cache_plugin
+)
+from .memory import MemoryCachePlugin, memory_cache_plugin
+from .plugin import Plugin
+
+__all__ = ['cached', 'make_key']
+
+logger = logging.getLogger(__name__)
+
+_VALUE, _NONE, _EXCEPTION = 0, 1, 2
+
+_single_flight = SingleFlight()
+
+
+def _default(obj: typing.Any) -> typing.Any:
+    if hasattr(obj, 'model_dump'):
+        return obj.model_dump(mode='json')
+    elif isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=repr)
+    elif isinstance(obj, (bytes, bytearray)):
+        return obj.hex()
+    raise TypeError(f'Type {type(obj).__name__} is not supported')
+
+
+def make_key(prefix: str, arguments: typing.Dict[str, typing.Any]) -> str:
+    '''
+    Stable key of the arguments of a call, independent of the process and
+    of the order of the keyword arguments.
+    '''
+    try:
+        data = orjson.dumps(
+            arguments,
+            default=_default,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+        )
+    except TypeError as e:
+        raise CacheError(f'Key of {prefix} can not be built, pass `key=` :: {e}')   # noqa E501
+    return f'{prefix}:{hashlib.blake2b(data, digest_size=16).hexdigest()}'
+
+
+def _resolve_backend(
+        backend: typing.Union[str, Plugin, CacheBackend]
+) -> typing.Union[CachePlugin, CacheBackend]:
+    if isinstance(backend, str):
+        if backend == 'cache':
+            return cache_plugin
+        elif backend == 'memory':
+            return MemoryCacheBackend(memory_cache_plugin)
+        elif backend == 'redis':
+            return RedisCacheBackend(redis_plugin)
+        elif backend == 'memcached':
+            from .memcached import memcached_plugin
+            return MemcachedCacheBackend(memcached_plugin)
+        raise CacheError(f'Unknown cache backend "{backend}"')
+    elif isinstance(backend, (CachePlugin, CacheBackend)):
+        return backend
+    elif isinstance(backend, MemoryCachePlugin):
+        return MemoryCacheBackend(backend)
+    elif isinstance(backend, RedisPlugin):
+        return RedisCacheBackend(backend)
+    elif _is_memcached_plugin(backend):
+        return MemcachedCacheBackend(backend)
+    raise CacheError(f'Cache backend {backend!r} is not supported')
+
+
+def _is_memcached_plugin(backend: typing.Any) -> bool:
+    try:
+        from .memcached import MemcachedPlugin
+    except RuntimeError:
+        # aiomcache is not installed
+        return False
+    return isinstance(backend, MemcachedPlugin)
+
+
+class Cached(object):
+    '''
+    Cached async function, see `cached()`.
+    '''
+    def __init__(
+            self,
+            func: typing.Callable[..., typing.Awaitable],
+            ttl: int=None,
+            key: typing.Optional[typing.Callable[..., str]]=None,
+            backend: typing.Union[str, Plugin, CacheBackend]='cache',
+            prefix: str=None,
+            negative_ttl: int=None,
+            exceptions: typing.Tuple[typing.Type[Exception], ...]=(),
+            ignore: typing.Iterable[str]=('self', 'cls')
+    ):
+        if not inspect.iscoroutinefunction(func):
+            raise CacheError(f'{func.__qualname__} is not an async function')
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.ttl = ttl
+        self.key_builder = key
+        self.backend = _resolve_backend(backend)
+        self.prefix = prefix or f'cached:{func.__module__}.{func.__qualname__}'
+        self.negative_ttl = negative_ttl
+        self.exceptions = tuple(exceptions)
+        self.ignore = frozenset(ignore)
+        self._signature = inspect.signature(func)
+
+    def __get__(self, instance: typing.Any, owner: typing.Type) -> typing.Callable:   # noqa E501
+        # decorated methods are bound like functions
+        if instance is None:
+            return self
+        return _BoundCached(self, instance)
+
+    def key(self, *args, **kwargs) -> str:
+        if self.key_builder is not None:
+            return f'{self.prefix}:{self.key_builder(*args, **kwargs)}'
+        bound = self._signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = {}
+        for name, value in bound.arguments.items():
+            if name not in self.ignore:
+                arguments[name] = value
+            elif not isinstance(value, type) and hasattr(value, '__cache_key__'):   # noqa E501
+                # an instance with a stable identity has its own entries
+                arguments[name] = value.__cache_key__()
+        return make_key(self.prefix, arguments)
+
+    async def _backend(self) -> typing.Tuple[CacheBackend, typing.Callable[[str], str]]:   # noqa E501
+        if isinstance(self.backend, CachePlugin):
+            plugin = await self.backend()
+            return plugin.backend, plugin._key
+        return self.backend, str
+
+    def _dumps(self, backend: CacheBackend, result: typing.Any, error: Exception=None) -> bytes:   # noqa E501
+        if error is not None:
+            cls = type(error)
+            entry = [_EXCEPTION, f'{cls.__module__}.{cls.__qualname__}', list(error.args)]   # noqa E501
+        elif result is None:
+            entry = [_NONE]
+        else:
+            entry = [_VALUE, result]
+        return backend.codec.encode(entry)
+
+    def _loads(self, backend: CacheBackend, data: bytes) -> typing.Tuple[int, typing.Any]:   # noqa E501
+        entry = backend.codec.decode(data)
+        if entry[0] == _EXCEPTION:
+            cls = _find_class(self.exceptions, entry[1])
+            if cls is None:
+                raise CacheError(f'Exception {entry[1]} is not cached')
+            return _EXCEPTION, cls(*entry[2])
+        return entry[0], entry[1] if entry[0] == _VALUE else None
+
+    async def _compute(self, backend: CacheBackend, key: str, args, kwargs) -> typing.Any:   # noqa E501
+        try:
+            result = await self.func(*args, **kwargs)
+        except self.exceptions as e:
+            if self.negative_ttl is not None:
+                await self._store(backend, key, self.negative_ttl, None, e)
+            raise
+        if result is not None:
+            await self._store(backend, key, self.ttl, result)
+        elif self.negative_ttl is not None:
+            await self._store(backend, key, self.negative_ttl, None)
+        return result
+
+    async def _store(
+            self,
+            backend: CacheBackend,
+            key: str,
+            ttl: int,
+            result: typing.Any,
+            error: Exception=None
+    ) -> None:
+        try:
+            await backend.set(key, self._dumps(backend, result, error), ttl)
+        except Exception as e:
+            # the result is returned even if it can not be cached
+            logger.warning('Cached result of %s can not be stored :: %r', self.__qualname__, e)   # noqa E501
+
+    async def __call__(self, *args, **kwargs) -> typing.Any:
+        try:
+            backend, namespace = await self._backend()
+        except CacheError:
+            # the cache plugin is not initialized
+            return await self.func(*args, **kwargs)
+        key = namespace(self.key(*args, **kwargs))
+        try:
+            data = await backend.get(key)
+            kind, value = (None, None) if data is None else self._loads(backend, data)   # noqa E501
+        except Exception:
+            # the function is called without the cache
+            kind = None
+        if kind == _EXCEPTION:
+            raise value
+        elif kind is not None:
+            return value
+        return await _single_flight.do(
+            key,
+            lambda: self._compute(backend, key, args, kwargs)
+        )
+
+    async def refresh(self, *args, **kwargs) -> typing.Any:
+        '''
+        Call the function and cache the result, without reading the cache.
+        '''
+        backend, namespace = await self._backend()
+        key = namespace(self.key(*args, **kwargs))
+        return await self._compute(backend, key, args, kwargs)
+
+    async def bypass(self, *args, **kwargs) -> typing.Any:
+        '''
+        Call the function without reading or writing the cache.
+        '''
+        return await self.func(*args, **kwargs)
+
+    async def invalidate(self, *args, **kwargs) -> None:
+        backend, namespace = await self._backend()
+        await backend.delete(namespace(self.key(*args, **kwargs)))
+
+
+class _BoundCached(object):
+    __slots__ = ('cached', 'instance')
+
+    def __init__(self, cached: Cached, instance: typing.Any):
+        self.cached = cached
+        self.instance = instance
+
+    def __call__(self, *args, **kwargs) -> typing.Awaitable:
+        return self.cached(self.instance, *args, **kwargs)
+
+    def __getattr__(self, name: str) -> typing.Any:
+        attr = getattr(self.cached, name)
+        if name in ('key', 'refresh', 'bypass', 'invalidate'):
+            return functools.partial(attr, self.instance)
+        return attr
+
+
+def _find_class(
+        classes: typing.Tuple[typing.Type[Exception], ...],
+        name: str
+) -> typing.Optional[typing.Type[Exception]]:
+    stack = list(classes)
+    while stack:
+        cls = stack.pop()
+        if f'{cls.__module__}.{cls.__qualname__}' == name:
+            return cls
+        stack.extend(cls.__subclasses__())
+    return None
+
+
+def cached(
+        ttl: int=None,
+        key: typing.Optional[typing.Callable[..., str]]=None,
+        backend: typing.Union[str, Plugin, CacheBackend]='cache',
+        prefix: str=None,
+        negative_ttl: int=None,
+        exceptions: typing.Tuple[typing.Type[Exception], ...]=(),
+        ignore: typing.Iterable[str]=('self', 'cls')
+) -> typing.Callable[[typing.Callable], Cached]:
+    '''
+    Cache the results of an async function.
+
+    The key is built from the prefix (default is the module and the name of
+    the function) and a hash of the arguments, or by `key` called with the
+    arguments. `None` results and the `exceptions` are cached for
+    `negative_ttl` seconds, if set.
+
+    The `ignore` arguments (default `self` and `cls`) are not part of the
+    key, so all instances of a class share the entries of a method. An
+    instance with a `__cache_key__()` method has its own entries.
+    '''
+    def wrap(func):
+        return Cached(
+            func,
+            ttl=ttl,
+            key=key,
+            backend=backend,
+            prefix=prefix,
+            negative_ttl=negative_ttl,
+            exceptions=exceptions,
+            ignore=ignore
+        )
+    return wrap
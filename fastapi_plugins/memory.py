@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fastapi_plugins.memory
+
+from __future__ import absolute_import
+
+import asyncio
+import collections
+import sys
+import time
+import typing
+
+import fastapi
+import pydantic_settings
+import starlette.requests
+
+from .codec import Codec, CodecType, CompressionType
+from .control import ControlHealthMixin
+from .plugin import Plugin, PluginError, PluginSettings
+from .utils import Annotated
+
+__all__ = [
+    'MemoryCacheError', 'MemoryCacheSettings', 'FrequencySketch', 'MemoryCache',
+    'MemoryCachePlugin', 'memory_cache_plugin', 'depends_memory_cache',
+    'TMemoryCachePlugin'
+]
+
+
+class MemoryCacheError(PluginError):
+    pass
+
+
+class MemoryCacheSettings(PluginSettings):
+    memory_maxbytes: int = 64 * 1024 * 1024
+    memory_window: float = 0.01
+    memory_protected: float = 0.8
+    memory_ttl: int = 3600
+    memory_expire_interval: float = 60
+    #
+    memory_codec: CodecType = CodecType.json
+    memory_compression: CompressionType = CompressionType.none
+    memory_compression_threshold: int = 1024
+    memory_compression_level: typing.Optional[int] = None
+    memory_decode_codecs: typing.Optional[str] = None
+
+
+_WINDOW, _PROBATION, _PROTECTED = 0, 1, 2
+
+
+class _Entry(object):
+    __slots__ = ('value', 'size', 'expires', 'segment')
+
+    def __init__(self, value: bytes, size: int, expires: float, segment: int):
+        self.value = value
+        self.size = size
+        self.expires = expires
+        self.segment = segment
+
+
+# the size of an entry is the size of its key, its value and this overhead
+# of the entry itself and of its slots in the dictionaries.
+_ENTRY_OVERHEAD = sys.getsizeof(_Entry(b'', 0, 0.0, 0)) + 2 * 8 * 3
+
+
+class FrequencySketch(object):
+    '''
+    Count-min sketch of the access frequency of keys (4 rows of counters up
+    to 15). The first access of a key is only recorded in a "doorkeeper"
+    bloom filter, so that keys used once do not fill up the counters. All
+    counters are halved and the doorkeeper is cleared after `10 * width`
+    increments, so that the frequencies follow the recent popularity.
+    '''
+    __slots__ = ('width', 'table', 'doorkeeper', 'additions', 'sample_size')
+
+    _SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0x27D4EB2F165667C5)   # noqa E501
+
+    def __init__(self, width: int=1024):
+        self.width = 1 << max(4, (width - 1).bit_length())
+        self.table = bytearray(4 * self.width)
+        self.doorkeeper = bytearray(self.width)
+        self.additions = 0
+        self.sample_size = 10 * self.width
+
+    def _indexes(self, h: int) -> typing.Iterator[int]:
+        mask = self.width - 1
+        for row, seed in enumerate(self._SEEDS):
+            yield row * self.width + ((((h ^ seed) * seed) >> 32) & mask)
+
+    def _doorkeeper(self, h: int) -> typing.Tuple[typing.Tuple[int, int], ...]:   # noqa E501
+        mask = 8 * self.width - 1
+        return tuple(
+            divmod((((h ^ seed) * seed) >> 40) & mask, 8)
+            for seed in self._SEEDS[:2]
+        )
+
+    def frequency(self, key: str) -> int:
+        h = hash(key)
+        doorkeeper = self.doorkeeper
+        table = self.table
+        frequency = min(table[i] for i in self._indexes(h))
+        if all(doorkeeper[i] & (1 << bit) for i, bit in self._doorkeeper(h)):
+            frequency += 1
+        return frequency
+
+    def increment(self, key: str) -> None:
+        h = hash(key)
+        doorkeeper = self.doorkeeper
+        added = False
+        for i, bit in self._doorkeeper(h):
+            if not doorkeeper[i] & (1 << bit):
+                doorkeeper[i] |= 1 << bit
+                added = True
+        if not added:
+            table = self.table
+            for i in self._indexes(h):
+                if table[i] < 15:
+                    table[i] += 1
+                    added = True
+        if added:
+            self.additions += 1
+            if self.additions >= self.sample_size:
+                self.reset()
+
+    def reset(self) -> None:
+        self.table = self.table.translate(_HALVE)
+        self.doorkeeper = bytearray(self.width)
+        self.additions //= 2
+
+
+_HALVE = bytes(i >> 1 for i in range(256))
+
+
+class MemoryCache(object):
+    '''
+    In-process store of bytes with a time-to-live per key and a bound of the
+    used memory in bytes.
+
+    Eviction is W-TinyLFU: new keys enter a small LRU window, keys leaving
+    the window are admitted to the main segmented LRU (probation and
+    protected) only if they are more frequent than the key they would evict.
+    A scan of keys used once does not flush the hot keys.
+
+    Expired keys are removed on access and by `expire_purge()`, which visits
+    only the keys expiring since its last call (timer wheel of `resolution`
+    seconds).
+    '''
+    def __init__(
+            self,
+            maxbytes: int=64 * 1024 * 1024,
+            window: float=0.01,
+            protected: float=0.8,
+            resolution: float=1.0
+    ):
+        if maxbytes <= 0:
+            raise MemoryCacheError('Memory cache size must be greater than 0')
+        if not 0 <= window <= 1 or not 0 <= protected <= 1:
+            raise MemoryCacheError('Memory cache window and protected must be between 0 and 1')   # noqa E501
+        self.maxbytes = maxbytes
+        self.window_maxbytes = int(maxbytes * window)
+        self.protected_maxbytes = int((maxbytes - self.window_maxbytes) * protected)   # noqa E501
+        self.resolution = resolution
+        self.sketch = FrequencySketch(min(max(maxbytes // 1024, 1024), 1 << 22))   # noqa E501
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data: typing.Dict[str, _Entry] = {}
+        self._segments = (
+            collections.OrderedDict(),
+            collections.OrderedDict(),
+            collections.OrderedDict()
+        )
+        self._nbytes = [0, 0, 0]
+        self._wheel: typing.Dict[int, typing.Set[str]] = {}
+        self._purged = int(time.monotonic() // resolution)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: str) -> bool:
+        return self._get(key) is not None
+
+    @property
+    def nbytes(self) -> int:
+        return sum(self._nbytes)
+
+    def _expires(self, ttl: typing.Optional[float]) -> float:
+        return time.monotonic() + ttl if ttl else 0
+
+    def _schedule(self, key: str, entry: _Entry, expires: float) -> None:
+        if entry.expires:
+            bucket = self._wheel.get(int(entry.expires // self.resolution))
+            if bucket is not None:
+                bucket.discard(key)
+        entry.expires = expires
+        if expires:
+            self._wheel.setdefault(int(expires // self.resolution), set()).add(key)   # noqa E501
+
+    def _get(self, key: str) -> typing.Optional[_Entry]:
+        entry = self._data.get(key)
+        if entry is not None and entry.expires and entry.expires <= time.monotonic():   # noqa E501
+            self._remove(key, entry)
+            self.expirations += 1
+            return None
+        return entry
+
+    def _link(self, key: str, entry: _Entry, segment: int) -> None:
+        entry.segment = segment
+        self._segments[segment][key] = entry
+        self._nbytes[segment] += entry.size
+
+    def _unlink(self, key: str, entry: _Entry) -> None:
+        del self._segments[entry.segment][key]
+        self._nbytes[entry.segment] -= entry.size
+
+    def _remove(self, key: str, entry: _Entry) -> None:
+        self._unlink(key, entry)
+        self._schedule(key, entry, 0)
+        del self._data[key]
+
+    def _touch(self, key: str, entry: _Entry) -> None:
+        if entry.segment == _PROBATION:
+            self._unlink(key, entry)
+            self._link(key, entry, _PROTECTED)
+            protected = self._segments[_PROTECTED]
+            while self._nbytes[_PROTECTED] > self.protected_maxbytes and len(protected) > 1:   # noqa E501
+                demoted_key, demoted = protected.popitem(last=False)
+                self._nbytes[_PROTECTED] -= demoted.size
+                self._link(demoted_key, demoted, _PROBATION)
+        else:
+            self._segments[entry.segment].move_to_end(key)
+
+    def _evict(self) -> None:
+        window, probation, protected = self._segments
+        # keys leaving the window are candidates of the main segments
+        while self._nbytes[_WINDOW] > self.window_maxbytes:
+            key, entry = window.popitem(last=False)
+            self._nbytes[_WINDOW] -= entry.size
+            self._link(key, entry, _PROBATION)
+            self._admit(key, entry)
+        while self.nbytes > self.maxbytes:
+            for segment in (probation, protected, window):
+                if segment:
+                    key, entry = next(iter(segment.items()))
+                    self._remove(key, entry)
+                    self.evictions += 1
+                    break
+
+    def _admit(self, candidate_key: str, candidate: _Entry) -> None:
+        probation, protected = self._segments[_PROBATION], self._segments[_PROTECTED]   # noqa E501
+        main_maxbytes = self.maxbytes - self.window_maxbytes
+        frequency = None
+        while self._nbytes[_PROBATION] + self._nbytes[_PROTECTED] > main_maxbytes:   # noqa E501
+            victim_key = next(iter(probation)) if probation else next(iter(protected))   # noqa E501
+            if victim_key == candidate_key:
+                victim_key = next(iter(protected), candidate_key)
+            if victim_key != candidate_key and frequency is None:
+                frequency = self.sketch.frequency(candidate_key)
+                if frequency <= self.sketch.frequency(victim_key):
+                    victim_key = candidate_key
+            self._remove(victim_key, self._data[victim_key])
+            self.evictions += 1
+            if victim_key == candidate_key:
+                break
+
+    def get(self, key: str) -> typing.Optional[bytes]:
+        self.sketch.increment(key)
+        entry = self._get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touch(key, entry)
+        return entry.value
+
+    def set(self, key: str, value: bytes, ttl: float=None) -> None:
+        self._set(key, value, self._expires(ttl))
+
+    def _set(self, key: str, value: bytes, expires: float) -> None:
+        size = sys.getsizeof(key) + sys.getsizeof(value) + _ENTRY_OVERHEAD
+        entry = self._data.get(key)
+        if size > self.maxbytes:
+            if entry is not None:
+                self._remove(key, entry)
+            return
+        self.sketch.increment(key)
+        if entry is None:
+            entry = self._data[key] = _Entry(value, size, 0, _WINDOW)
+            self._link(key, entry, _WINDOW)
+        else:
+            self._nbytes[entry.segment] += size - entry.size
+            entry.value = value
+            entry.size = size
+            self._touch(key, entry)
+        self._schedule(key, entry, expires)
+        self._evict()
+
+    def add(self, key: str, value: bytes, ttl: float=None) -> bool:
+        if self._get(key) is not None:
+            return False
+        self.set(key, value, ttl)
+        return True
+
+    def delete(self, key: str) -> bool:
+        entry = self._data.get(key)
+        if entry is None:
+            return False
+        self._remove(key, entry)
+        return True
+
+    def incr(self, key: str, delta: int=1, ttl: float=None) -> int:
+        entry = self._get(key)
+        if entry is None:
+            value = delta
+            self.set(key, str(value).encode(), ttl)
+        else:
+            try:
+                value = int(entry.value) + delta
+            except ValueError:
+                raise MemoryCacheError(f'Value of {key} is not an integer')
+            self._set(key, str(value).encode(), entry.expires)
+        return value
+
+    def expire(self, key: str, ttl: float) -> bool:
+        entry = self._get(key)
+        if entry is None:
+            return False
+        self._schedule(key, entry, self._expires(ttl))
+        return True
+
+    def ttl(self, key: str) -> typing.Optional[float]:
+        entry = self._get(key)
+        if entry is None or not entry.expires:
+            return None
+        return entry.expires - time.monotonic()
+
+    def expire_purge(self) -> int:
+        '''
+        Remove the expired keys, returns the number of removed keys.
+        '''
+        now = time.monotonic()
+        current = int(now // self.resolution)
+        if current - self._purged > len(self._wheel):
+            buckets = sorted(b for b in self._wheel if b <= current)
+        else:
+            buckets = range(self._purged, current + 1)
+        count = 0
+        for b in buckets:
+            keys = self._wheel.get(b)
+            if not keys:
+                self._wheel.pop(b, None)
+                continue
+            for key in list(keys):
+                entry = self._data[key]
+                if entry.expires <= now:
+                    self._remove(key, entry)
+                    count += 1
+            if not keys:
+                self._wheel.pop(b, None)
+        self._purged = current
+        self.expirations += count
+        return count
+
+    def clear(self) -> None:
+        self._data.clear()
+        for segment in self._segments:
+            segment.clear()
+        self._nbytes = [0, 0, 0]
+        self._wheel.clear()
+
+    def stats(self) -> typing.Dict:
+        return dict(
+            size=len(self._data),
+            nbytes=self.nbytes,
+            maxbytes=self.maxbytes,
+            window=self._nbytes[_WINDOW],
+            probation=self._nbytes[_PROBATION],
+            protected=self._nbytes[_PROTECTED],
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            expirations=self.expirations
+        )
+
+
+class MemoryCachePlugin(Plugin, ControlHealthMixin):
+    DEFAULT_CONFIG_CLASS = MemoryCacheSettings
+
+    def _on_init(self) -> None:
+        self.memory: MemoryCache = None
+        self.codec: Codec = None
+        self._task: asyncio.Task = None
+
+    async def _on_call(self) -> MemoryCache:
+        if self.memory is None:
+            raise MemoryCacheError('Memory cache is not initialized')
+        return self.memory
+
+    async def init_app(
+            self,
+            app: fastapi.FastAPI,
+            config: pydantic_settings.BaseSettings=None
+    ) -> None:
+        self.config = config or self.DEFAULT_CONFIG_CLASS()
+        if self.config is None:
+            raise MemoryCacheError('Memory cache configuration is not initialized')  # noqa E501
+        elif not isinstance(self.config, self.DEFAULT_CONFIG_CLASS):
+            raise MemoryCacheError('Memory cache configuration is not valid')
+        app.state.MEMORY = self
+
+    async def init(self):
+        if self.memory is not None:
+            raise MemoryCacheError('Memory cache is already initialized')
+        self.codec = Codec.from_settings(self.config, 'memory')
+        self.memory = MemoryCache(
+            maxbytes=self.config.memory_maxbytes,
+            window=self.config.memory_window,
+            protected=self.config.memory_protected
+        )
+        if self.config.memory_expire_interval:
+            self._task = asyncio.create_task(
+                self._expire(self.config.memory_expire_interval)
+            )
+
+    async def _expire(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.memory.expire_purge()
+
+    async def terminate(self):
+        self.config = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.memory is not None:
+            self.memory.clear()
+            self.memory = None
+
+    async def health(self) -> typing.Dict:
+        return self.memory.stats()
+
+
+memory_cache_plugin = MemoryCachePlugin()
+
+
+async def depends_memory_cache(
+    conn: starlette.requests.HTTPConnection
+) -> MemoryCache:
+    return await conn.app.state.MEMORY()
+
+
+TMemoryCachePlugin = Annotated[MemoryCache, fastapi.Depends(depends_memory_cache)]   # noqa E501
@@ -4,10 +4,14 @@
 
 from __future__ import absolute_import
 
+import asyncio
 import typing
 
 import fastapi
 import starlette.middleware.cors
+import starlette.types
+
+__all__ = ['register_middleware', 'CoalescingMiddleware']
 
 
 def register_middleware(
@@ -29,3 +33,92 @@ def register_middleware(
     for mw_klass, options in middleware:
         app.add_middleware(mw_klass, **options)
     return app
+
+
+class CoalescingMiddleware(object):
+    '''
+    Run identical concurrent requests of a worker once, the other requests
+    wait for the response of the first one and receive a copy of it.
+
+    Requests are identical, if they have the same method, path, query string
+    and values of the `headers`, which must cover the authentication of the
+    request. Responses with `Set-Cookie`, larger than `max_size` bytes, with
+    a server error (5xx) or of a failed request are not shared, the waiting
+    requests run on their own.
+    '''
+    def __init__(
+            self,
+            app: starlette.types.ASGIApp,
+            methods: typing.Iterable[str]=('GET', 'HEAD'),
+            headers: typing.Iterable[str]=('authorization', 'cookie'),
+            max_size: int=1024 * 1024,
+            key: typing.Optional[typing.Callable[[starlette.types.Scope], typing.Optional[typing.Hashable]]]=None   # noqa E501
+    ):
+        self.app = app
+        self.methods = frozenset(methods)
+        self.headers = tuple(header.lower().encode('latin-1') for header in headers)   # noqa E501
+        self.max_size = max_size
+        self.key = key or self.get_key
+        self.coalesced = 0
+        self._flights: typing.Dict[typing.Hashable, asyncio.Future] = {}
+
+    def get_key(self, scope: starlette.types.Scope) -> typing.Optional[typing.Hashable]:   # noqa E501
+        if scope['method'] not in self.methods:
+            return None
+        headers = dict(scope['headers'])
+        return (
+            scope['method'],
+            scope['path'],
+            scope['query_string'],
+            tuple(headers.get(header) for header in self.headers)
+        )
+
+    async def __call__(
+            self,
+            scope: starlette.types.Scope,
+            receive: starlette.types.Receive,
+            send: starlette.types.Send
+    ) -> None:
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        key = self.key(scope)
+        if key is None:
+            return await self.app(scope, receive, send)
+        flight = self._flights.get(key)
+        if flight is not None:
+            # a waiting request must not cancel the shared response
+            messages = await asyncio.shield(flight)
+            if messages is not None:
+                self.coalesced += 1
+                for message in messages:
+                    await send(message)
+                return
+            return await self.app(scope, receive, send)
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()   # noqa E501
+        messages = []
+        size = 0
+
+        async def _send(message: starlette.types.Message) -> None:
+            nonlocal messages, size
+            if messages is not None:
+                if message['type'] == 'http.response.start' and message['status'] >= 500:   # noqa E501
+                    # a server error is not shared, the others may succeed
+                    messages = None
+                elif message['type'] == 'http.response.start' and any(name.lower() == b'set-cookie' for name, _ in message.get('headers', [])):   # noqa E501
+                    messages = None
+                elif message['type'] == 'http.response.body':
+                    size += len(message.get('body', b''))
+                    if size > self.max_size:
+                        messages = None
+                if messages is not None:
+                    messages.append(message)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        except BaseException:
+            messages = None
+            raise
+        finally:
+            del self._flights[key]
+            flight.set_result(messages)
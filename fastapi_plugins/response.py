@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fastapi_plugins.response
+
+from __future__ import absolute_import
+
+import hashlib
+import logging
+import typing
+
+import fastapi
+import fastapi.routing
+import orjson
+import starlette.requests
+import starlette.responses
+
+from .cache import CacheBackend, get_cache_backend
+from .codec import CodecType
+
+__all__ = ['ResponseCache', 'cache_response', 'CachedRoute']
+
+logger = logging.getLogger(__name__)
+
+CACHEABLE_METHODS = frozenset(('GET', 'HEAD'))
+
+# headers which are computed for every response
+UNCACHED_HEADERS = frozenset(('content-length', 'date', 'etag', 'set-cookie'))
+
+
+class ResponseCache(object):
+    '''
+    Cache of the serialized responses of an endpoint. The key is built from
+    the method, the path, the query parameters (all or only the selected
+    ones) and the selected request headers, by default the credentials.
+    '''
+    def __init__(
+            self,
+            ttl: int=None,
+            backend: str='redis',
+            query_params: typing.Optional[typing.List[str]]=None,
+            headers: typing.Iterable[str]=('authorization', 'cookie'),
+            prefix: str='response'
+    ):
+        self.ttl = ttl
+        self.backend = backend
+        self.query_params = query_params
+        self.headers = [header.lower() for header in headers]
+        self.prefix = prefix
+        self._app: fastapi.FastAPI = None
+        self._backend: CacheBackend = None
+
+    def get_key(self, request: starlette.requests.Request) -> str:
+        if self.query_params is None:
+            params = sorted(request.query_params.multi_items())
+        else:
+            params = [
+                (name, value)
+                for name in sorted(self.query_params)
+                for value in request.query_params.getlist(name)
+            ]
+        digest = hashlib.blake2b(
+            orjson.dumps([
+                request.method,
+                request.url.path,
+                params,
+                [request.headers.get(header) for header in self.headers]
+            ]),
+            digest_size=16
+        )
+        return f'{self.prefix}:{digest.hexdigest()}'
+
+    def get_backend(self, app: fastapi.FastAPI) -> CacheBackend:
+        if self._app is not app:
+            self._backend = get_cache_backend(app, self.backend)
+            self._app = app
+        return self._backend
+
+    async def __call__(
+            self,
+            request: starlette.requests.Request,
+            handler: typing.Callable
+    ) -> starlette.responses.Response:
+        if request.method not in CACHEABLE_METHODS:
+            return await handler(request)
+        backend = self.get_backend(request.app)
+        key = self.get_key(request)
+        try:
+            # responses are stored as they are, but compressed by the plugin
+            codec = backend.codec.derive(CodecType.raw)
+            data = codec.decode(await backend.get(key))
+        except Exception:
+            # the endpoint is served without the cache
+            codec = data = None
+        if data is None:
+            response = await handler(request)
+            if response.status_code != 200 or not hasattr(response, 'body') or 'set-cookie' in response.headers:   # noqa E501
+                return response
+            headers = [
+                (name.decode('latin-1'), value.decode('latin-1'))
+                for name, value in response.raw_headers
+                if name.decode('latin-1') not in UNCACHED_HEADERS
+            ]
+            etag = '"%s"' % hashlib.blake2b(response.body, digest_size=16).hexdigest()
+            if codec is not None:
+                try:
+                    await backend.set(
+                        key,
+                        codec.encode(self.dumps(response.status_code, headers, etag, response.body)),   # noqa E501
+                        self.ttl
+                    )
+                except Exception as e:
+                    # the response is served, but not cached
+                    logger.warning('Response cache set failed :: %r', e)
+            response.headers['etag'] = etag
+        else:
+            status_code, headers, etag, body = self.loads(data)
+            response = starlette.responses.Response(
+                content=body,
+                status_code=status_code
+            )
+            response.raw_headers.extend(
+                (name.encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers + [('etag', etag)]
+            )
+        etags = _parse_etags(request.headers.get('if-none-match'))
+        if '*' in etags or etag in etags:
+            return starlette.responses.Response(
+                status_code=304,
+                headers=dict(etag=etag)
+            )
+        return response
+
+    @staticmethod
+    def dumps(status_code: int, headers: typing.List, etag: str, body: bytes) -> bytes:
+        return orjson.dumps([status_code, headers, etag]) + b'\n' + body
+
+    @staticmethod
+    def loads(data: bytes) -> typing.Tuple[int, typing.List, str, bytes]:
+        meta, body = data.split(b'\n', 1)
+        status_code, headers, etag = orjson.loads(meta)
+        return status_code, [tuple(header) for header in headers], etag, body
+
+
+def _parse_etags(value: typing.Optional[str]) -> typing.List[str]:
+    if not value:
+        return []
+    return [etag.strip().replace('W/', '', 1) for etag in value.split(',')]
+
+
+def cache_response(
+        ttl: int=None,
+        backend: str='redis',
+        query_params: typing.Optional[typing.List[str]]=None,
+        headers: typing.Iterable[str]=('authorization', 'cookie'),
+        prefix: str='response'
+) -> typing.Callable:
+    '''
+    Cache the response of the endpoint. Requires the route to be a
+    `CachedRoute`, e.g. `fastapi.APIRouter(route_class=CachedRoute)`.
+    '''
+    def wrap(func):
+        func.__response_cache__ = ResponseCache(
+            ttl=ttl,
+            backend=backend,
+            query_params=query_params,
+            headers=headers,
+            prefix=prefix
+        )
+        return func
+    return wrap
+
+
+class CachedRoute(fastapi.routing.APIRoute):
+    '''
+    Route serving the endpoints decorated with `cache_response` from the
+    cache, without running dependencies, the endpoint and the serialization.
+    '''
+    def get_route_handler(self) -> typing.Callable:
+        handler = super(CachedRoute, self).get_route_handler()
+        cache = getattr(self.endpoint, '__response_cache__', None)
+        if cache is None:
+            return handler
+
+        async def cached_route_handler(
+                request: starlette.requests.Request
+        ) -> starlette.responses.Response:
+            return await cache(request, handler)
+
+        return cached_route_handler
@@ -4,6 +4,12 @@
 
 from __future__ import absolute_import
 
+import asyncio
+import datetime
+import enum
+import inspect
+import random
+import time
 import typing
 
 import aiojobs
@@ -11,13 +17,20 @@ import fastapi
 import pydantic_settings
 import starlette.requests
 
+from ._redis import RedisPlugin, redis_plugin
+from ._redis_lease import RedisLease, _fencing_token
+from ._scheduler_cron import CronExpression, IntervalTrigger
+from ._scheduler_executor import ExecutorPool
+from ._scheduler_fair import FairQueue
+from ._scheduler_queue import RedisJobQueue
 from .control import ControlHealthMixin
 from .plugin import Plugin, PluginError, PluginSettings
 from .utils import Annotated
 from .version import VERSION
 
 __all__ = [
-    'SchedulerError', 'SchedulerSettings', 'SchedulerPlugin',
+    'SchedulerError', 'OverlapPolicy', 'MisfirePolicy', 'Priority', 'PeriodicJob',   # noqa E501
+    'SchedulerSettings', 'SchedulerPlugin',
     'scheduler_plugin', 'depends_scheduler', 'TSchedulerPlugin'
     # 'MadnessScheduler'
 ]
@@ -30,6 +43,215 @@ class SchedulerError(PluginError):
     pass
 
 
+@enum.unique
+class OverlapPolicy(str, enum.Enum):
+    # a run is skipped while the previous run is still running
+    skip = 'skip'
+    # a run waits for the previous run
+    queue = 'queue'
+    # runs are not limited
+    concurrent = 'concurrent'
+
+
+@enum.unique
+class MisfirePolicy(str, enum.Enum):
+    # the missed runs are skipped
+    skip = 'skip'
+    # the missed runs are done as one run
+    once = 'once'
+    # every missed run is done
+    all = 'all'
+
+
+@enum.unique
+class Priority(str, enum.Enum):
+    # the jobs of a higher priority run first
+    high = 'high'
+    normal = 'normal'
+    low = 'low'
+
+
+class PeriodicJob(object):
+    '''
+    Job run every `interval` seconds or at the times of a `cron` expression.
+
+    The times do not drift with the duration of the runs. Every run is
+    delayed by a random time up to `jitter` seconds. A run is missed, if it
+    starts later than `misfire_grace` seconds, e.g. after the event loop
+    was blocked. A `singleton` job runs only while its lease is held, i.e.
+    once in the cluster.
+    '''
+    # an outage of a year does not result in a year of runs
+    MAX_MISSED = 1000
+
+    def __init__(
+            self,
+            func: typing.Callable[..., typing.Awaitable],
+            interval: float=None,
+            cron: str=None,
+            name: str=None,
+            overlap: OverlapPolicy=OverlapPolicy.skip,
+            jitter: float=0.0,
+            misfire: MisfirePolicy=MisfirePolicy.once,
+            misfire_grace: float=1.0,
+            tz: datetime.tzinfo=None,
+            args: typing.Sequence=(),
+            kwargs: typing.Dict[str, typing.Any]=None,
+            singleton: bool=False,
+            lease_ttl: float=None
+    ):
+        if not inspect.iscoroutinefunction(func):
+            raise SchedulerError(f'{func.__qualname__} is not an async function')   # noqa E501
+        if (interval is None) == (cron is None):
+            raise SchedulerError('Either interval or cron is required')
+        try:
+            if cron is not None:
+                self.trigger = CronExpression(cron, tz=tz)
+            else:
+                self.trigger = IntervalTrigger(interval, time.monotonic())
+        except ValueError as e:
+            raise SchedulerError(str(e))
+        self.func = func
+        self.name = name or f'{func.__module__}.{func.__qualname__}'
+        self.overlap = OverlapPolicy(overlap)
+        self.jitter = jitter
+        self.misfire = MisfirePolicy(misfire)
+        self.misfire_grace = misfire_grace
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+        self.singleton = singleton
+        self.lease_ttl = lease_ttl
+        self.lease: RedisLease = None
+        #
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.missed = 0
+        self.running = 0
+        self.queued = 0
+        self.last_run: float = None
+        self.last_duration: float = None
+        self.last_error: str = None
+        self.next_run: float = None
+        self._task: asyncio.Task = None
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.name!r}, {self.trigger!r})'
+
+    @property
+    def started(self) -> bool:
+        return self._task is not None
+
+    def start(self, scheduler: aiojobs.Scheduler) -> None:
+        if self._task is None:
+            if self.lease is not None:
+                self.lease.start()
+            self._task = asyncio.create_task(self._loop(scheduler))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self.next_run = None
+            self.queued = 0
+        if self.lease is not None:
+            await self.lease.stop()
+
+    async def _loop(self, scheduler: aiojobs.Scheduler) -> None:
+        clock = self.trigger.clock
+        due = self.trigger.next(clock())
+        while True:
+            delay = due - clock()
+            # the next run is reported in wall clock time
+            self.next_run = time.time() + delay
+            if self.jitter:
+                delay += random.uniform(0, self.jitter)  # nosec B311
+            if delay > 0:
+                await asyncio.sleep(delay)
+            now = clock()
+            # the last time due and the number of times missed before
+            missed = 0
+            following = self.trigger.next(due)
+            while following <= now and missed < self.MAX_MISSED:
+                due, following = following, self.trigger.next(following)
+                missed += 1
+            runs = 1
+            if self.misfire == MisfirePolicy.all:
+                runs += missed
+            else:
+                self.missed += missed
+                if self.misfire == MisfirePolicy.skip and now - due > self.misfire_grace + self.jitter:   # noqa E501
+                    self.missed += 1
+                    runs = 0
+            for _ in range(runs):
+                await self._fire(scheduler)
+            due = following
+
+    async def _fire(self, scheduler: aiojobs.Scheduler) -> None:
+        if self.lease is not None and not self.lease.is_leader:
+            # the job runs in another worker
+            return
+        elif self.running and self.overlap == OverlapPolicy.skip:
+            self.skipped += 1
+        elif self.running and self.overlap == OverlapPolicy.queue:
+            self.queued += 1
+        else:
+            self.running += 1
+            coro = self._run()
+            try:
+                await scheduler.spawn(coro, name=self.name)
+            except Exception as e:
+                # e.g. the scheduler is closed, the job is fired when due again
+                coro.close()
+                self.running -= 1
+                self.last_error = repr(e)
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                started = time.monotonic()
+                self.runs += 1
+                self.last_run = time.time()
+                if self.lease is not None:
+                    _fencing_token.set(self.lease.token)
+                try:
+                    await self.func(*self.args, **self.kwargs)
+                except Exception as e:
+                    self.failures += 1
+                    self.last_error = repr(e)
+                finally:
+                    self.last_duration = time.monotonic() - started
+                if not self.queued or not self._leader():
+                    break
+                self.queued -= 1
+        finally:
+            self.running -= 1
+
+    def _leader(self) -> bool:
+        return self.lease is None or self.lease.is_leader
+
+    def stats(self) -> typing.Dict:
+        return dict(
+            trigger=repr(self.trigger),
+            overlap=self.overlap.value,
+            runs=self.runs,
+            failures=self.failures,
+            skipped=self.skipped,
+            missed=self.missed,
+            running=self.running,
+            queued=self.queued,
+            last_run=self.last_run,
+            last_duration=self.last_duration,
+            last_error=self.last_error,
+            next_run=self.next_run,
+            lease=None if self.lease is None else self.lease.stats()
+        )
+
+
 # class MadnessScheduler(aiojobs.Scheduler):
 #     def __init__(self, *args, **kwargs):
 #         super(MadnessScheduler, self).__init__(*args, **kwargs)
@@ -79,6 +301,20 @@ class SchedulerSettings(PluginSettings):
     aiojobs_close_timeout: float = 0.1
     aiojobs_limit: int = 100
     aiojobs_pending_limit: int = 10000
+    aiojobs_lease_ttl: float = 10.0
+    aiojobs_lease_prefix: str = 'fastapi-plugins:lease'
+    aiojobs_queue_stream: typing.Optional[str] = None
+    aiojobs_queue_group: str = 'fastapi-plugins'
+    aiojobs_queue_consume: bool = True
+    aiojobs_queue_visibility_timeout: float = 30.0
+    aiojobs_queue_max_deliveries: int = 5
+    aiojobs_queue_batch: int = 10
+    aiojobs_queue_maxlen: typing.Optional[int] = None
+    aiojobs_thread_workers: typing.Optional[int] = None
+    aiojobs_process_workers: int = 0
+    aiojobs_max_tasks_per_child: typing.Optional[int] = None
+    aiojobs_executor_warmup: bool = True
+    aiojobs_tenant_weights: typing.Dict[str, float] = {}
     # aiojobs_enable_cancel: bool = False
 
 
@@ -87,6 +323,14 @@ class SchedulerPlugin(Plugin, ControlHealthMixin):
 
     def _on_init(self) -> None:
         self.scheduler: aiojobs.Scheduler = None
+        self.periodic: typing.Dict[str, PeriodicJob] = {}
+        self.redis: RedisPlugin = None
+        self.tasks: typing.Dict[str, typing.Callable[..., typing.Awaitable]] = {}   # noqa E501
+        self.queue: RedisJobQueue = None
+        self.threads: ExecutorPool = None
+        self.processes: ExecutorPool = None
+        self.fair: FairQueue = None
+        self.fair_running = 0
 
     async def _on_call(self) -> aiojobs.Scheduler:
         if self.scheduler is None:
@@ -96,13 +340,16 @@ class SchedulerPlugin(Plugin, ControlHealthMixin):
     async def init_app(
             self,
             app: fastapi.FastAPI,
-            config: pydantic_settings.BaseSettings=None
+            config: pydantic_settings.BaseSettings=None,
+            redis: RedisPlugin=None
     ) -> None:
         self.config = config or self.DEFAULT_CONFIG_CLASS()
         if self.config is None:
             raise SchedulerError('Scheduler configuration is not initialized')
         elif not isinstance(self.config, self.DEFAULT_CONFIG_CLASS):
             raise SchedulerError('Scheduler configuration is not valid')
+        # the leases of singleton jobs and the queue are in this Redis
+        self.redis = redis or redis_plugin
         app.state.AIOJOBS_SCHEDULER = self
 
     async def init(self):
@@ -113,12 +360,262 @@ class SchedulerPlugin(Plugin, ControlHealthMixin):
             limit=self.config.aiojobs_limit,
             pending_limit=self.config.aiojobs_pending_limit
         )
+        self.fair = FairQueue(
+            [priority.value for priority in Priority],
+            weights=self.config.aiojobs_tenant_weights
+        )
+        await self._create_executors()
+        for job in self.periodic.values():
+            self._start_job(job)
+        if self.config.aiojobs_queue_stream:
+            self.queue = RedisJobQueue(
+                self.redis,
+                self.config.aiojobs_queue_stream,
+                group=self.config.aiojobs_queue_group,
+                visibility_timeout=self.config.aiojobs_queue_visibility_timeout,   # noqa E501
+                max_deliveries=self.config.aiojobs_queue_max_deliveries,
+                batch=self.config.aiojobs_queue_batch,
+                maxlen=self.config.aiojobs_queue_maxlen
+            )
+            self.queue.tasks = self.tasks
+            await self.queue.setup()
+            if self.config.aiojobs_queue_consume:
+                self.queue.start(self.scheduler, self.config.aiojobs_limit)
 
     async def terminate(self):
         self.config = None
+        if self.queue is not None:
+            await self.queue.stop()
+            self.queue = None
+        for job in self.periodic.values():
+            await job.stop()
+            if job.singleton:
+                job.lease = None
+        if self.fair is not None:
+            for coro, future, _ in self.fair.drain():
+                coro.close()
+                future.cancel()
+            self.fair = None
         if self.scheduler is not None:
             await self.scheduler.close()
             self.scheduler = None
+        for pool in (self.threads, self.processes):
+            if pool is not None:
+                pool.shutdown()
+        self.threads = None
+        self.processes = None
+
+    async def spawn(
+            self,
+            coro: typing.Coroutine,
+            name: str=None,
+            priority: Priority=Priority.normal,
+            tenant: str=None
+    ) -> asyncio.Future:
+        '''
+        Spawn a job with a priority for a tenant, returns a future of the
+        result of the job. While `AIOJOBS_LIMIT` of these jobs run, the job
+        waits until the waiting jobs of higher priorities ran, and in its
+        priority the tenants take turns by their weights
+        (`AIOJOBS_TENANT_WEIGHTS`). At most `AIOJOBS_PENDING_LIMIT` jobs wait.
+        '''
+        if self.scheduler is None:
+            coro.close()
+            raise SchedulerError('Scheduler is not initialized')
+        try:
+            priority = Priority(priority)
+        except ValueError as e:
+            coro.close()
+            raise SchedulerError(str(e))
+        future = asyncio.get_running_loop().create_future()
+        if self.fair_running < self.scheduler.limit:
+            await self._start_fair(coro, future, name)
+        elif len(self.fair) >= self.scheduler.pending_limit:
+            coro.close()
+            raise SchedulerError('Scheduler pending limit is reached')
+        else:
+            try:
+                self.fair.put((coro, future, name), priority.value, tenant)
+            except ValueError as e:
+                coro.close()
+                raise SchedulerError(str(e))
+        return future
+
+    async def _start_fair(self, coro: typing.Coroutine, future: asyncio.Future, name: str=None) -> None:   # noqa E501
+        self.fair_running += 1
+        try:
+            await self.scheduler.spawn(self._run_fair(coro, future), name=name)   # noqa E501
+        except BaseException:
+            self.fair_running -= 1
+            raise
+
+    async def _run_fair(self, coro: typing.Coroutine, future: asyncio.Future) -> typing.Any:   # noqa E501
+        try:
+            result = await coro
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+                # the error is reported by the scheduler as well
+                future.exception()
+            raise
+        else:
+            if not future.done():
+                future.set_result(result)
+            return result
+        finally:
+            self.fair_running -= 1
+            await self._dispatch_fair()
+
+    async def _dispatch_fair(self) -> None:
+        while self.fair and not self.scheduler.closed and self.fair_running < self.scheduler.limit:   # noqa E501
+            coro, future, name = self.fair.get()
+            if future.cancelled():
+                coro.close()
+                continue
+            await self._start_fair(coro, future, name)
+
+    async def _create_executors(self) -> None:
+        try:
+            self.threads = ExecutorPool(
+                'thread',
+                workers=self.config.aiojobs_thread_workers,
+                name='fastapi-plugins-scheduler'
+            )
+            if self.config.aiojobs_process_workers:
+                self.processes = ExecutorPool(
+                    'process',
+                    workers=self.config.aiojobs_process_workers,
+                    max_tasks_per_child=self.config.aiojobs_max_tasks_per_child   # noqa E501
+                )
+        except ValueError as e:
+            raise SchedulerError(f'Scheduler executors are not valid :: {e}')   # noqa E501
+        if self.config.aiojobs_executor_warmup:
+            for pool in (self.threads, self.processes):
+                if pool is not None:
+                    await pool.warm_up()
+
+    async def run_blocking(self, func: typing.Callable, *args, **kwargs) -> typing.Any:   # noqa E501
+        '''
+        Call a blocking function (I/O, C extensions releasing the GIL) in the
+        thread pool.
+        '''
+        if self.threads is None:
+            raise SchedulerError('Scheduler is not initialized')
+        return await self.threads.run(func, *args, **kwargs)
+
+    async def run_cpu(self, func: typing.Callable, *args, **kwargs) -> typing.Any:   # noqa E501
+        '''
+        Call a CPU bound function in the process pool. The function, the
+        arguments and the result must be picklable.
+        '''
+        if self.processes is None:
+            raise SchedulerError('Scheduler process pool is not initialized')
+        return await self.processes.run(func, *args, **kwargs)
+
+    def add_job(
+            self,
+            func: typing.Callable[..., typing.Awaitable],
+            interval: float=None,
+            cron: str=None,
+            name: str=None,
+            overlap: OverlapPolicy=OverlapPolicy.skip,
+            jitter: float=0.0,
+            misfire: MisfirePolicy=MisfirePolicy.once,
+            misfire_grace: float=1.0,
+            tz: datetime.tzinfo=None,
+            args: typing.Sequence=(),
+            kwargs: typing.Dict[str, typing.Any]=None,
+            singleton: bool=False,
+            lease_ttl: float=None
+    ) -> PeriodicJob:
+        '''
+        Register a periodic job, which is started by `init()` (or at once,
+        if the scheduler is initialized) and stopped by `terminate()`.
+
+        A `singleton` job runs once in the cluster, in the worker holding
+        the lease of the job in Redis for `lease_ttl` seconds (default is
+        `AIOJOBS_LEASE_TTL`).
+        '''
+        job = PeriodicJob(
+            func,
+            interval=interval,
+            cron=cron,
+            name=name,
+            overlap=overlap,
+            jitter=jitter,
+            misfire=misfire,
+            misfire_grace=misfire_grace,
+            tz=tz,
+            args=args,
+            kwargs=kwargs,
+            singleton=singleton,
+            lease_ttl=lease_ttl
+        )
+        if job.name in self.periodic:
+            raise SchedulerError(f'Periodic job {job.name} is already registered')   # noqa E501
+        self.periodic[job.name] = job
+        if self.scheduler is not None:
+            self._start_job(job)
+        return job
+
+    def _start_job(self, job: PeriodicJob) -> None:
+        # the lease is created with the settings
+        if job.singleton and job.lease is None:
+            job.lease = RedisLease(
+                job.name,
+                plugin=self.redis,
+                ttl=job.lease_ttl or self.config.aiojobs_lease_ttl,
+                prefix=self.config.aiojobs_lease_prefix
+            )
+        job.start(self.scheduler)
+
+    def periodic_job(self, **kwargs) -> typing.Callable:
+        '''
+        Decorator of `add_job()`.
+        '''
+        def wrap(func):
+            self.add_job(func, **kwargs)
+            return func
+        return wrap
+
+    async def remove_job(self, name: str) -> None:
+        job = self.periodic.pop(name, None)
+        if job is None:
+            raise SchedulerError(f'Periodic job {name} is not registered')
+        await job.stop()
+
+    def task(self, name: str=None) -> typing.Callable:
+        '''
+        Register an async function as a task of the queue, by `name`
+        (default is the module and the name of the function).
+        '''
+        def wrap(func):
+            if not inspect.iscoroutinefunction(func):
+                raise SchedulerError(f'{func.__qualname__} is not an async function')   # noqa E501
+            task_name = name or _task_name(func)
+            if self.tasks.get(task_name, func) is not func:
+                raise SchedulerError(f'Task {task_name} is already registered')   # noqa E501
+            self.tasks[task_name] = func
+            return func
+        return wrap
+
+    async def enqueue(
+            self,
+            task: typing.Union[str, typing.Callable[..., typing.Awaitable]],
+            *args,
+            **kwargs
+    ) -> str:
+        '''
+        Add a job to the queue, which is run by any worker (at least once),
+        returns the id of the job. The arguments must be JSON serializable.
+        '''
+        if self.queue is None:
+            raise SchedulerError('Scheduler queue is not initialized')
+        name = task if isinstance(task, str) else _task_name(task)
+        return await self.queue.enqueue(name, args, kwargs)
 
     async def health(self) -> typing.Dict:
         return dict(
@@ -126,10 +623,30 @@ class SchedulerPlugin(Plugin, ControlHealthMixin):
             active=self.scheduler.active_count,
             pending=self.scheduler.pending_count,
             limit=self.scheduler.limit,
-            closed=self.scheduler.closed
+            closed=self.scheduler.closed,
+            periodic={
+                name: job.stats()
+                for name, job in self.periodic.items()
+            },
+            queue=None if self.queue is None else await self.queue.stats(),
+            fair=dict(
+                running=self.fair_running,
+                queued={
+                    priority.value: self.fair.depth(priority.value)
+                    for priority in Priority
+                }
+            ),
+            executors={
+                kind: None if pool is None else pool.stats()
+                for kind, pool in (('thread', self.threads), ('process', self.processes))   # noqa E501
+            }
         )
 
 
+def _task_name(func: typing.Callable) -> str:
+    return f'{func.__module__}.{func.__qualname__}'
+
+
 scheduler_plugin = SchedulerPlugin()
 
 
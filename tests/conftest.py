@@ -16,8 +16,14 @@ def pytest_configure(config):
     config.addinivalue_line("markers", "redis: tests for Redis")
     config.addinivalue_line("markers", "fakeredis: tests for Fake Redis")
     config.addinivalue_line("markers", "sentinel: tests for Redis Sentinel")
+    config.addinivalue_line("markers", "cluster: tests for Redis Cluster")
     config.addinivalue_line("markers", "settings: tests for Settings and Configuration")    # noqa E501
     config.addinivalue_line("markers", "logger: tests for Logger")
+    config.addinivalue_line("markers", "cache: tests for Cache")
+    config.addinivalue_line("markers", "response: tests for Response cache")
+    config.addinivalue_line("markers", "codec: tests for Codecs")
+    config.addinivalue_line("markers", "memory: tests for Memory cache")
+    config.addinivalue_line("markers", "middleware: tests for Middleware")
 
 
 @pytest.fixture(scope='session')
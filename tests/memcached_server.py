@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# tests.memcached_server
+
+from __future__ import absolute_import
+
+import asyncio
+import itertools
+import time
+import typing
+
+
+class Item(object):
+    __slots__ = ('value', 'flags', 'exptime', 'cas', 'stale', 'win_sent')
+
+    def __init__(self, value: bytes, flags: int, exptime: float, cas: int):
+        self.value = value
+        self.flags = flags
+        self.exptime = exptime
+        self.cas = cas
+        self.stale = False
+        self.win_sent = False
+
+    def ttl(self) -> int:
+        return int(self.exptime - time.time()) if self.exptime else -1
+
+
+class MemcachedServer(object):
+    '''
+    Local asyncio server speaking a subset of the Memcached text and meta
+    protocols, for tests without a Memcached instance.
+    '''
+    def __init__(self):
+        self.data: typing.Dict[bytes, Item] = {}
+        self.commands: typing.List[bytes] = []
+        self.server: asyncio.AbstractServer = None
+        self.host = '127.0.0.1'
+        self.port = 0
+        self.delay = 0.0
+        self._cas = itertools.count(1)
+
+    async def start(self) -> 'MemcachedServer':
+        self.server = await asyncio.start_server(self._serve, self.host, 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    def _get(self, key: bytes) -> typing.Optional[Item]:
+        item = self.data.get(key)
+        if item is not None and item.exptime and item.exptime <= time.time():
+            del self.data[key]
+            return None
+        return item
+
+    def _store(self, key: bytes, value: bytes, flags: int, exptime: int) -> Item:
+        self.data[key] = item = Item(
+            value,
+            flags,
+            time.time() + exptime if exptime else 0,
+            next(self._cas)
+        )
+        return item
+
+    async def _serve(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                terms = line.split()
+                if not terms:
+                    continue
+                self.commands.append(terms[0])
+                response = await self._command(terms, reader)
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(response)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _command(
+            self,
+            terms: typing.List[bytes],
+            reader: asyncio.StreamReader
+    ) -> bytes:
+        command, args = terms[0], terms[1:]
+        if command in (b'get', b'gets'):
+            response = []
+            for key in args:
+                item = self._get(key)
+                if item is not None:
+                    response.append(b'VALUE %b %d %d%b\r\n%b\r\n' % (
+                        key,
+                        item.flags,
+                        len(item.value),
+                        b' %d' % item.cas if command == b'gets' else b'',
+                        item.value
+                    ))
+            return b''.join(response) + b'END\r\n'
+        elif command in (b'set', b'add'):
+            key, flags, exptime, size = args[0], int(args[1]), int(args[2]), int(args[3])   # noqa E501
+            value = (await reader.readexactly(size + 2))[:-2]
+            if command == b'add' and self._get(key) is not None:
+                return b'NOT_STORED\r\n'
+            self._store(key, value, flags, exptime)
+            return b'STORED\r\n'
+        elif command == b'delete':
+            if self.data.pop(args[0], None) is None:
+                return b'NOT_FOUND\r\n'
+            return b'DELETED\r\n'
+        elif command in (b'incr', b'decr'):
+            item = self._get(args[0])
+            if item is None:
+                return b'NOT_FOUND\r\n'
+            delta = int(args[1]) if command == b'incr' else -int(args[1])
+            item.value = b'%d' % max(int(item.value) + delta, 0)
+            return item.value + b'\r\n'
+        elif command == b'touch':
+            item = self._get(args[0])
+            if item is None:
+                return b'NOT_FOUND\r\n'
+            item.exptime = time.time() + int(args[1]) if int(args[1]) else 0
+            return b'TOUCHED\r\n'
+        elif command == b'version':
+            return b'VERSION 1.6.18\r\n'
+        elif command == b'flush_all':
+            self.data.clear()
+            return b'OK\r\n'
+        elif command == b'mg':
+            return self._meta_get(args[0], _flags(args[1:]))
+        elif command == b'ms':
+            value = (await reader.readexactly(int(args[1]) + 2))[:-2]
+            return self._meta_set(args[0], value, _flags(args[2:]))
+        elif command == b'md':
+            return self._meta_delete(args[0], _flags(args[1:]))
+        elif command == b'mn':
+            return b'MN\r\n'
+        return b'ERROR\r\n'
+
+    def _meta_get(self, key: bytes, flags: typing.Dict[str, bytes]) -> bytes:
+        item = self._get(key)
+        returned = []
+        if item is None:
+            if 'N' not in flags:
+                return b'' if 'q' in flags else b'EN\r\n'
+            item = self._store(key, b'', 0, int(flags['N']))
+            item.win_sent = True
+            returned.append(b'W')
+        else:
+            if item.stale:
+                returned.append(b'X')
+            if (item.stale or ('R' in flags and item.ttl() < int(flags['R']))) and not item.win_sent:   # noqa E501
+                item.win_sent = True
+                returned.append(b'W')
+            elif item.win_sent:
+                returned.append(b'Z')
+            if 'T' in flags:
+                item.exptime = time.time() + int(flags['T'])
+        returned.extend(_returned(key, item, flags))
+        if 'v' in flags:
+            return b'VA %d%b\r\n%b\r\n' % (len(item.value), _join(returned), item.value)   # noqa E501
+        return b'HD%b\r\n' % _join(returned)
+
+    def _meta_set(
+            self,
+            key: bytes,
+            value: bytes,
+            flags: typing.Dict[str, bytes]
+    ) -> bytes:
+        item = self._get(key)
+        if 'C' in flags:
+            if item is None:
+                return b'NF\r\n'
+            if item.cas != int(flags['C']):
+                return b'EX\r\n'
+        if flags.get('M') == b'E' and item is not None:
+            return b'NS\r\n'
+        item = self._store(key, value, int(flags.get('F', 0)), int(flags.get('T', 0)))   # noqa E501
+        if 'q' in flags:
+            return b''
+        return b'HD%b\r\n' % _join(_returned(key, item, flags))
+
+    def _meta_delete(self, key: bytes, flags: typing.Dict[str, bytes]) -> bytes:
+        item = self._get(key)
+        if item is None:
+            return b'' if 'q' in flags else b'NF\r\n'
+        if 'C' in flags and item.cas != int(flags['C']):
+            return b'EX\r\n'
+        if 'I' in flags:
+            item.stale = True
+            item.win_sent = False
+            item.cas = next(self._cas)
+            if 'T' in flags:
+                item.exptime = time.time() + int(flags['T'])
+        else:
+            del self.data[key]
+        if 'q' in flags:
+            return b''
+        return b'HD%b\r\n' % _join(_returned(key, item, flags))
+
+
+def _flags(terms: typing.List[bytes]) -> typing.Dict[str, bytes]:
+    return {term[:1].decode(): term[1:] for term in terms}
+
+
+def _returned(
+        key: bytes,
+        item: Item,
+        flags: typing.Dict[str, bytes]
+) -> typing.List[bytes]:
+    returned = []
+    if 't' in flags:
+        returned.append(b't%d' % item.ttl())
+    if 'c' in flags:
+        returned.append(b'c%d' % item.cas)
+    if 'f' in flags:
+        returned.append(b'f%d' % item.flags)
+    if 'k' in flags:
+        returned.append(b'k' + key)
+    if 'O' in flags:
+        returned.append(b'O' + flags['O'])
+    return returned
+
+
+def _join(returned: typing.List[bytes]) -> bytes:
+    return b''.join(b' ' + term for term in returned)
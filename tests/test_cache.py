@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# tests.test_cache
+
+from __future__ import absolute_import
+
+import asyncio
+import time
+
+import fastapi
+import pytest
+
+import fastapi_plugins
+from fastapi_plugins.cache import _dumps_entry
+
+pytestmark = [pytest.mark.anyio, pytest.mark.cache]
+
+
+@pytest.fixture
+async def redisapp():
+    app = fastapi.FastAPI()
+    await fastapi_plugins.redis_plugin.init_app(
+        app=app,
+        config=fastapi_plugins.RedisSettings(redis_type='fakeredis')
+    )
+    await fastapi_plugins.redis_plugin.init()
+    yield app
+    await fastapi_plugins.redis_plugin.terminate()
+
+
+@pytest.fixture
+async def backend(redisapp):
+    backend = fastapi_plugins.get_cache_backend(redisapp, 'redis')
+    conn = await fastapi_plugins.redis_plugin()
+    await conn.flushdb()
+    return backend
+
+
+def test_backend_unknown():
+    with pytest.raises(fastapi_plugins.CacheError):
+        fastapi_plugins.get_cache_backend(fastapi.FastAPI(), 'unknown')
+    with pytest.raises(fastapi_plugins.CacheError):
+        fastapi_plugins.get_cache_backend(fastapi.FastAPI(), 'memcached')
+
+
+@pytest.mark.fakeredis
+async def test_backend(backend):
+    assert await backend.get('x') is None
+    await backend.set('x', b'\xff\x00')
+    assert await backend.get('x') == b'\xff\x00'
+    await backend.delete('x')
+    assert await backend.get('x') is None
+    #
+    assert await backend.lock('lock:x', 'a', 10) is True
+    assert await backend.lock('lock:x', 'b', 10) is False
+    await backend.unlock('lock:x', 'b')
+    assert await backend.lock('lock:x', 'b', 10) is False
+    await backend.unlock('lock:x', 'a')
+    assert await backend.lock('lock:x', 'b', 10) is True
+
+
+@pytest.mark.fakeredis
+async def test_single_flight(backend):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return dict(value=len(calls))
+
+    results = await asyncio.gather(*[
+        fastapi_plugins.get_or_compute(backend, 'x', compute)
+        for _ in range(20)
+    ])
+    assert results == [dict(value=1)] * 20
+    assert await fastapi_plugins.get_or_compute(backend, 'x', compute) == dict(value=1)   # noqa E501
+    assert len(calls) == 1
+
+
+@pytest.mark.fakeredis
+async def test_distributed_lock(backend):
+    async def compute():
+        raise AssertionError('must not be computed')
+
+    # another process holds the lock and stores the value
+    assert await backend.lock('lock:x', 'other', 10)
+
+    async def other():
+        await asyncio.sleep(0.2)
+        await backend.set('x', _dumps_entry(backend.codec, 'other', 0.1, 60))
+
+    results = await asyncio.gather(
+        fastapi_plugins.get_or_compute(backend, 'x', compute, lock_poll=0.01),
+        other()
+    )
+    assert results[0] == 'other'
+
+
+@pytest.mark.fakeredis
+async def test_early_refresh(backend):
+    async def compute():
+        return 'new'
+
+    # the value expires in a second, but takes an hour to compute
+    await backend.set('x', _dumps_entry(backend.codec, 'old', 3600, 1))
+    assert await fastapi_plugins.get_or_compute(backend, 'x', compute, beta=0) == 'old'   # noqa E501
+    assert await fastapi_plugins.get_or_compute(backend, 'x', compute) == 'new'
+    #
+    # another process refreshes the value, the current one is served
+    await backend.set('x', _dumps_entry(backend.codec, 'old', 3600, 1))
+    assert await backend.lock('lock:x', 'other', 10)
+    assert await fastapi_plugins.get_or_compute(backend, 'x', compute) == 'old'
+    #
+    await backend.set('x', _dumps_entry(backend.codec, 'fresh', 0.001, 3600))
+    start = time.monotonic()
+    assert await fastapi_plugins.get_or_compute(backend, 'x', compute) == 'fresh'
+    assert time.monotonic() - start < 1
+
+
+@pytest.mark.fakeredis
+async def test_backend_value(backend):
+    assert await backend.get_value('x') is None
+    await backend.set_value('x', dict(x=1))
+    assert await backend.get_value('x') == dict(x=1)
+    #
+    # binary values are read, although `redis_decode_responses` is set
+    backend.plugin.codec = fastapi_plugins.Codec(
+        'pickle',
+        'zlib',
+        compression_threshold=0
+    )
+    await backend.set_value('y', b'\xff' * 100)
+    assert len(await backend.get('y')) < 100
+    assert await backend.get_value('y') == b'\xff' * 100
+    assert await backend.get_value('x') == dict(x=1)
+
+
+@pytest.fixture(
+    params=[
+        'memory',
+        pytest.param('redis', marks=pytest.mark.fakeredis),
+        pytest.param('tiered', marks=pytest.mark.fakeredis),
+        pytest.param('memcached', marks=pytest.mark.memcached),
+    ]
+)
+async def cache(request):
+    from .memcached_server import MemcachedServer
+    server = None
+    if request.param == 'memory':
+        config = fastapi_plugins.CacheSettings(cache_type='memory')
+    elif request.param in ('redis', 'tiered'):
+        class Settings(fastapi_plugins.CacheSettings, fastapi_plugins.RedisSettings):   # noqa E501
+            pass
+        config = Settings(cache_type=request.param, redis_type='fakeredis')
+    else:
+        from fastapi_plugins.memcached import MemcachedSettings
+        server = await MemcachedServer().start()
+
+        class Settings(fastapi_plugins.CacheSettings, MemcachedSettings):
+            pass
+        config = Settings(
+            cache_type='memcached',
+            memcached_host=server.host,
+            memcached_port=server.port
+        )
+    app = fastapi.FastAPI()
+    plugin = fastapi_plugins.CachePlugin()
+    await plugin.init_app(app, config=config)
+    await plugin.init()
+    if request.param in ('redis', 'tiered'):
+        await (await plugin.plugin()).flushdb()
+    yield plugin
+    await plugin.terminate()
+    if server is not None:
+        await server.stop()
+
+
+@pytest.mark.memcached
+async def test_memcached_unlock():
+    from fastapi_plugins.memcached import MemcachedSettings
+
+    from .memcached_server import MemcachedServer
+    server = await MemcachedServer().start()
+
+    class Settings(fastapi_plugins.CacheSettings, MemcachedSettings):
+        pass
+    plugin = fastapi_plugins.CachePlugin()
+    await plugin.init_app(
+        fastapi.FastAPI(),
+        config=Settings(
+            cache_type='memcached',
+            memcached_host=server.host,
+            memcached_port=server.port
+        )
+    )
+    await plugin.init()
+    try:
+        backend = plugin.backend
+        conn = await backend.plugin()
+        meta_get = conn.meta_get
+
+        async def expire(key, *flags):
+            # the lock expires and is taken by another worker
+            result = await meta_get(key, *flags)
+            await conn.delete(key)
+            await conn.add(key, b'b')
+            return result
+
+        assert await backend.lock('lock:x', 'a', 10) is True
+        conn.meta_get = expire
+        await backend.unlock('lock:x', 'a')
+        del conn.meta_get
+        assert await conn.get(b'lock:x') == b'b'
+        await backend.unlock('lock:x', 'a')
+        assert await conn.get(b'lock:x') == b'b'
+        await backend.unlock('lock:x', 'b')
+        assert await conn.get(b'lock:x') is None
+    finally:
+        await plugin.terminate()
+        await server.stop()
+
+
+async def test_cache_plugin_settings():
+    app = fastapi.FastAPI()
+    plugin = fastapi_plugins.CachePlugin()
+    with pytest.raises(fastapi_plugins.CacheError):
+        await plugin()
+    await plugin.init_app(
+        app,
+        config=fastapi_plugins.CacheSettings(cache_type='redis')
+    )
+    assert app.state.CACHE is plugin
+    with pytest.raises(fastapi_plugins.CacheError):
+        await plugin.init()
+    await plugin.terminate()
+
+
+async def test_cache_plugin(cache):
+    assert await cache() is cache
+    assert await cache.get('x') is None
+    assert await cache.get('x', 'default') == 'default'
+    await cache.set('x', {'a': [1, 2]})
+    assert await cache.get('x') == {'a': [1, 2]}
+    await cache.delete('x', 'y')
+    assert await cache.get('x') is None
+    #
+    await cache.set_many({'a': 1, 'b': 'two'}, ttl=60)
+    assert await cache.get_many(['a', 'b', 'c']) == {'a': 1, 'b': 'two'}
+    #
+    assert await cache.incr('n') == 1
+    assert await cache.incr('n', 5) == 6
+    assert await cache.incr('n', -2) == 4
+    assert await cache.get('n') == 4
+    #
+    assert 3500 < await cache.ttl('n') <= 3600
+    assert await cache.expire('n', 10) is True
+    assert 0 < await cache.ttl('n') <= 10
+    assert await cache.expire('missing', 10) is False
+    assert await cache.ttl('missing') is None
+    #
+    health = await cache.health()
+    assert health['cache_type'] == cache.config.cache_type
+    assert health['cache_backend']
+
+
+async def test_cache_plugin_namespace():
+    app = fastapi.FastAPI()
+    plugin = fastapi_plugins.CachePlugin()
+    await plugin.init_app(
+        app,
+        config=fastapi_plugins.CacheSettings(cache_namespace='ns', cache_ttl=5)
+    )
+    await plugin.init()
+    try:
+        await plugin.set('x', 1)
+        assert await plugin.get('x') == 1
+        assert await plugin.backend.get('ns:x') is not None
+        assert await plugin.ttl('x') == 5
+    finally:
+        await plugin.terminate()
+
+
+@pytest.mark.fakeredis
+async def test_cache_plugin_tiered():
+    class Settings(fastapi_plugins.CacheSettings, fastapi_plugins.RedisSettings):   # noqa E501
+        pass
+    config = Settings(cache_type='tiered', redis_type='fakeredis')
+    workers = []
+    for _ in range(2):
+        plugin = fastapi_plugins.CachePlugin()
+        await plugin.init_app(fastapi.FastAPI(), config=config)
+        await plugin.init()
+        workers.append(plugin)
+    a, b = workers
+    try:
+        await (await a.plugin()).flushdb()
+        await a.set('x', 1)
+        # the invalidation of `x` is delivered to `b` meanwhile
+        await asyncio.sleep(0.1)
+        assert await b.get('x') == 1
+        assert b.backend.l1.memory.get('x') is not None
+        # served from L1, Redis is not asked anymore
+        await (await a.plugin()).set('x', b'garbage')
+        assert await b.get('x') == 1
+        #
+        await a.set('x', 2)
+        for _ in range(100):
+            if b.backend.invalidations:
+                break
+            await asyncio.sleep(0.01)
+        assert await b.get('x') == 2
+        await a.delete('x')
+        for _ in range(100):
+            if b.backend.invalidations == 2:
+                break
+            await asyncio.sleep(0.01)
+        assert await b.get('x') is None
+        #
+        await a.set_many({'m': 1, 'n': 2})
+        await asyncio.sleep(0.1)
+        assert await b.get_many(['m', 'n', 'o']) == {'m': 1, 'n': 2}
+        assert await b.incr('c') == 1
+        health = await b.health()
+        assert health['cache_l1']['ready'] is True
+        assert health['cache_l1']['invalidations'] == 2
+        #
+        await a.set('t', 1, tags=['g'])
+        await asyncio.sleep(0.1)
+        assert await b.get('t') == 1
+        assert await a.invalidate_tag('g') == 1
+        for _ in range(100):
+            if b.backend.invalidations == 3:
+                break
+            await asyncio.sleep(0.01)
+        assert await b.get('t') is None
+        assert health['cache_l1']['hits'] >= 1
+        assert 0 < await b.ttl('m') <= 3600
+    finally:
+        for plugin in workers:
+            await plugin.terminate()
+
+
+@pytest.mark.fakeredis
+async def test_backend_tags(backend):
+    for i in range(10):
+        await backend.set_tagged(f'item:{i}', b'x', 60, ['items', f'group:{i % 2}'])   # noqa E501
+    await backend.set_tagged('other', b'x', 300, ['group:0'])
+    conn = await fastapi_plugins.redis_plugin()
+    assert await conn.scard('tag:{items}') == 10
+    assert 250 < await conn.ttl('tag:{group:0}') <= 300
+    assert 0 < await conn.ttl('tag:{items}') <= 60
+    #
+    assert await backend.invalidate_tag('group:0', batch=2) == 6
+    assert await backend.get('other') is None
+    assert await backend.get('item:0') is None
+    assert await backend.get('item:1') == b'x'
+    assert not await conn.exists('tag:{group:0}')
+    assert await backend.invalidate_tag('group:0') == 0
+    # keys deleted meanwhile are skipped
+    assert await backend.invalidate_tag('items', batch=3) == 5
+    # stale tag sets expire with their last key
+    assert await conn.keys('*') == ['tag:{group:1}']
+
+
+async def test_cache_plugin_tags(cache):
+    if cache.config.cache_type not in ('redis', 'tiered'):
+        with pytest.raises(fastapi_plugins.CacheError):
+            await cache.set('x', 1, tags=['t'])
+        return
+    await cache.set('x', 1, tags=['t'])
+    await cache.set('y', 2, tags=['t', 'u'])
+    await cache.set('z', 3)
+    assert await cache.get('x') == 1
+    assert await cache.invalidate_tag('t') == 2
+    assert await cache.get_many(['x', 'y', 'z']) == dict(z=3)
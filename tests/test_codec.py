@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# tests.test_codec
+
+from __future__ import absolute_import
+
+import pytest
+
+import fastapi_plugins
+
+pytestmark = [pytest.mark.codec]
+
+VALUE = dict(name='value' * 100, items=list(range(100)), nested=dict(x=1.5))
+
+# optional packages of the codecs and compressions
+REQUIRES = dict(msgpack='msgpack', zstd='zstandard', lz4='lz4')
+
+
+@pytest.mark.parametrize('codec', ['json', 'msgpack', 'pickle'])
+@pytest.mark.parametrize('compression', ['none', 'zlib', 'zstd', 'lz4'])
+def test_codec(codec, compression):
+    for name in (codec, compression):
+        if name in REQUIRES:
+            pytest.importorskip(REQUIRES[name])
+    c = fastapi_plugins.Codec(codec, compression, compression_threshold=64)
+    data = c.encode(VALUE)
+    assert c.decode(data) == VALUE
+    assert c.decode(None) is None
+    # short values are not compressed
+    assert c.encode('x')[2] == 0
+    if compression == 'none':
+        assert data == fastapi_plugins.Codec(codec).encode(VALUE)
+    else:
+        assert len(data) < len(fastapi_plugins.Codec(codec).encode(VALUE))
+
+
+def test_codec_tagged():
+    data = fastapi_plugins.Codec(
+        'json',
+        'zlib',
+        compression_threshold=0
+    ).encode(VALUE)
+    # the value is decoded by the codec it was written with
+    codec = fastapi_plugins.Codec('msgpack')
+    assert codec.decode(data) == VALUE
+    codec = fastapi_plugins.Codec()
+    #
+    raw = codec.derive(fastapi_plugins.CodecType.raw)
+    assert raw is codec.derive('raw')
+    assert raw.decode(raw.encode(b'\xff\x00')) == b'\xff\x00'
+    with pytest.raises(fastapi_plugins.CodecError):
+        raw.encode(VALUE)
+    with pytest.raises(fastapi_plugins.CodecError):
+        raw.decode(b'not encoded')
+    with pytest.raises(fastapi_plugins.CodecError):
+        raw.decode(data.decode('latin-1'))
+    with pytest.raises(fastapi_plugins.CodecError):
+        raw.decode(bytes((fastapi_plugins.codec.MAGIC, 99, 0)) + b'x')
+
+
+def test_codec_pickle_rejected():
+    data = fastapi_plugins.Codec('pickle', 'zlib', compression_threshold=0).encode(VALUE)   # noqa E501
+    # pickle runs code of the data, it must be configured or allowed
+    codec = fastapi_plugins.Codec()
+    with pytest.raises(fastapi_plugins.CodecError):
+        codec.decode(data)
+    with pytest.raises(fastapi_plugins.CodecError):
+        codec.derive('raw').decode(data)
+    with pytest.raises(fastapi_plugins.CodecError):
+        codec.decode(bytes((fastapi_plugins.codec.MAGIC, 3, 0)) + b'x')
+    assert fastapi_plugins.Codec('pickle').decode(data) == VALUE
+    codec = fastapi_plugins.Codec(decode_codecs=['json', 'pickle'])
+    assert codec.decode(data) == VALUE
+    assert codec.derive('raw').decode(data) == VALUE
+    #
+    config = fastapi_plugins.RedisSettings(redis_decode_codecs='json, pickle')
+    codec = fastapi_plugins.Codec.from_settings(config, 'redis')
+    assert codec.decode_codecs == {fastapi_plugins.CodecType.json, fastapi_plugins.CodecType.pickle}   # noqa E501
+    assert codec.decode(data) == VALUE
+    codec = fastapi_plugins.Codec.from_settings(fastapi_plugins.RedisSettings(), 'redis')   # noqa E501
+    with pytest.raises(fastapi_plugins.CodecError):
+        codec.decode(data)
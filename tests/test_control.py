@@ -359,7 +359,18 @@ async def test_controller_version(kwargs, version):
 async def test_router(client, result, status, endpoint):
     response = client.get(endpoint)
     assert status == response.status_code
-    assert result == response.json()
+    data = response.json()
+    checks = result.get('checks')
+    if checks is None:
+        assert result == data
+        return
+    # the plugins report more details than the baseline checked here
+    assert result['status'] == data['status']
+    assert len(checks) == len(data['checks'])
+    for expected, check in zip(checks, data['checks']):
+        assert expected['name'] == check['name']
+        assert expected['status'] == check['status']
+        assert expected['details'].items() <= check['details'].items()
 
 
 async def test_router_health_with_plugins_broken_init():
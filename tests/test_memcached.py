@@ -4,13 +4,20 @@
 
 from __future__ import absolute_import
 
+import asyncio
 import uuid
 
+import aiomcache.exceptions
 import fastapi
 import pytest
 
 import fastapi_plugins
-from fastapi_plugins.memcached import MemcachedSettings, memcached_plugin
+from fastapi_plugins.memcached import (
+    KetamaRing, MemcachedClient, MemcachedRingClient, MemcachedSettings, memcached_plugin,
+    meta_get_or_compute
+)
+
+from .memcached_server import MemcachedServer
 
 pytestmark = [pytest.mark.anyio, pytest.mark.memcached]
 
@@ -32,6 +39,14 @@ async def memcache_app(memcache_config):
     await memcached_plugin.terminate()
 
 
+@pytest.fixture
+async def local_servers():
+    servers = [await MemcachedServer().start() for _ in range(2)]
+    yield servers
+    for server in servers:
+        await server.stop()
+
+
 async def test_connect(memcache_app):
     pass
 
@@ -57,3 +72,212 @@ async def test_get_set(memcache_app):
     value = str(uuid.uuid4()).encode()
     assert await c.set(b'x', value) is not None
     assert await c.get(b'x') == value
+
+
+async def test_pool_size(memcache_app):
+    c = await memcached_plugin()
+    assert c._pool._maxsize == memcached_plugin.config.memcached_pool_size
+    assert c._pool._minsize == memcached_plugin.config.memcached_pool_minsize
+
+
+def test_servers():
+    assert MemcachedSettings().get_servers() == [('localhost', 11211)]
+    assert MemcachedSettings(
+        memcached_servers='mc1:11211, mc2:11212'
+    ).get_servers() == [('mc1', 11211), ('mc2', 11212)]
+    with pytest.raises(RuntimeError):
+        MemcachedSettings(memcached_servers='mc1').get_servers()
+
+
+def test_ketama_ring():
+    nodes = [f'mc{i}:11211' for i in range(4)]
+    ring = KetamaRing(nodes)
+    keys = [f'key{i}'.encode() for i in range(4000)]
+    before = {key: ring.get_node(key) for key in keys}
+    # keys are spread over all nodes
+    for node in nodes:
+        assert 600 < list(before.values()).count(node) < 1400
+    #
+    # only the keys of a removed node are moved
+    ring.remove('mc3:11211')
+    after = {key: ring.get_node(key) for key in keys}
+    for key in keys:
+        if before[key] != 'mc3:11211':
+            assert after[key] == before[key]
+    #
+    # only about a fifth of the keys move to an added node
+    ring.add('mc3:11211')
+    ring.add('mc4:11211')
+    moved = [key for key in keys if ring.get_node(key) != before[key]]
+    assert {ring.get_node(key) for key in moved} == {'mc4:11211'}
+    assert 400 < len(moved) < 1200
+    #
+    with pytest.raises(fastapi_plugins.memcached.MemcachedError):
+        KetamaRing().get_node(b'x')
+
+
+async def test_ring_client():
+    c = MemcachedRingClient(
+        [('mc1', 11211), ('mc2', 11211)],
+        pool_size=5,
+        pool_minsize=1
+    )
+    assert list(c.clients) == ['mc1:11211', 'mc2:11211']
+    for client in c.clients.values():
+        assert client._pool._maxsize == 5
+    assert c.get_client(b'x') is c.clients[c.ring.get_node(b'x')]
+    await c.close()
+
+
+async def test_get_set_many(local_servers):
+    server = local_servers[0]
+    c = MemcachedClient(server.host, server.port, chunk_size=3)
+    values = {f'key{i}'.encode(): f'value{i}'.encode() for i in range(10)}
+    assert await c.set_many(values, exptime=60) == []
+    assert await c.get_many(list(values) + [b'missing', b'key0']) == values
+    # 4 chunks of at most 3 keys, each one round trip
+    assert server.commands.count(b'set') == 10
+    assert server.commands.count(b'gets') == 4
+    await c.close()
+    #
+    c = MemcachedRingClient(
+        [(server.host, server.port) for server in local_servers],
+        chunk_size=3
+    )
+    assert await c.set_many(values) == []
+    assert await c.get_many(values) == values
+    for server in local_servers:
+        assert server.data
+    await c.close()
+
+
+async def test_coalesce(local_servers):
+    server = local_servers[0]
+    c = MemcachedClient(server.host, server.port, coalesce=True)
+    await c.set(b'x', b'1')
+    await c.set(b'y', b'2')
+    results = await asyncio.gather(*[
+        c.get(key) for key in [b'x', b'y', b'z', b'x'] * 10
+    ])
+    assert results == [b'1', b'2', None, b'1'] * 10
+    assert server.commands.count(b'gets') == 1
+    assert await c.get(b'z', b'default') == b'default'
+    await c.close()
+
+
+async def test_meta(local_servers):
+    server = local_servers[0]
+    c = MemcachedClient(server.host, server.port)
+    result = await c.meta_get(b'x', 'v')
+    assert result.status == 'EN' and not result.hit
+    result = await c.meta_set(b'x', b'value', 'T60', 'c')
+    assert result.status == 'HD' and result.cas
+    #
+    # value and TTL in one round trip
+    result = await c.meta_get(b'x', 'v', 't', 'k')
+    assert result.hit and result.value == b'value'
+    assert 58 <= result.ttl <= 60
+    assert result.flags['k'] == 'x'
+    #
+    # a stale value is served while one client wins the recompute
+    assert (await c.meta_delete(b'x', 'I')).status == 'HD'
+    first = await c.meta_get(b'x', 'v')
+    second = await c.meta_get(b'x', 'v')
+    assert first.won and first.stale and first.value == b'value'
+    assert not second.won and second.stale and second.win_sent
+    #
+    results = await c.meta_get_many([b'x', b'missing', b'x'], 'v')
+    assert list(results) == [b'x']
+    assert results[b'x'].value == b'value'
+    assert (await c.meta_delete(b'x')).status == 'HD'
+    assert (await c.meta_delete(b'x')).status == 'NF'
+    with pytest.raises(aiomcache.exceptions.ValidationException):
+        await c.meta_get(b'x', 'v', 'q')
+    await c.close()
+
+
+async def test_meta_get_or_compute(local_servers):
+    c = MemcachedRingClient(
+        [(server.host, server.port) for server in local_servers]
+    )
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return b'value%d' % len(calls)
+
+    results = await asyncio.gather(*[
+        meta_get_or_compute(c, b'x', compute, ttl=60, poll=0.01)
+        for _ in range(10)
+    ])
+    assert results == [b'value1'] * 10
+    assert len(calls) == 1
+    #
+    # the stale value is served while the winner recomputes
+    await c.meta_delete(b'x', 'I')
+    results = await asyncio.gather(*[
+        meta_get_or_compute(c, b'x', compute, ttl=60, poll=0.01)
+        for _ in range(10)
+    ])
+    assert sorted(results) == [b'value1'] * 9 + [b'value2']
+    assert await meta_get_or_compute(c, b'x', compute, ttl=60) == b'value2'
+    #
+    # a failed compute releases the lease
+
+    async def fail():
+        raise ValueError('compute failed')
+
+    with pytest.raises(ValueError):
+        await meta_get_or_compute(c, b'y', fail, ttl=60)
+    assert await meta_get_or_compute(c, b'y', compute, ttl=60) == b'value3'
+    await c.close()
+
+
+async def test_terminate(local_servers):
+    server = local_servers[0]
+    config = MemcachedSettings(
+        memcached_host=server.host,
+        memcached_port=server.port,
+        memcached_terminate_timeout=5
+    )
+    plugin = fastapi_plugins.memcached.MemcachedPlugin()
+    await plugin.init_app(fastapi.FastAPI(), config=config)
+    await plugin.init()
+    c = await plugin()
+    await c.set(b'x', b'1')
+    #
+    # the call in flight is completed, the cache is not flushed
+    server.delay = 0.2
+    get = asyncio.ensure_future(c.get(b'x'))
+    await asyncio.sleep(0.05)
+    assert c.in_flight() == 1
+    await plugin.terminate()
+    assert await get == b'1'
+    assert c.in_flight() == 0
+    assert b'flush_all' not in server.commands
+    assert server.data
+    with pytest.raises(fastapi_plugins.memcached.MemcachedError):
+        await plugin()
+    #
+    # calls in flight after the timeout are aborted
+    config.memcached_terminate_timeout = 0.1
+    server.delay = 0
+    await plugin.init_app(fastapi.FastAPI(), config=config)
+    await plugin.init()
+    c = await plugin()
+    server.delay = 0.5
+    get = asyncio.ensure_future(c.get(b'x'))
+    await asyncio.sleep(0.05)
+    await plugin.terminate()
+    with pytest.raises(aiomcache.exceptions.ClientException):
+        await get
+    #
+    # opt-in flush
+    config.memcached_flush_on_terminate = True
+    server.delay = 0
+    await plugin.init_app(fastapi.FastAPI(), config=config)
+    await plugin.init()
+    await plugin.terminate()
+    assert b'flush_all' in server.commands
+    assert not server.data
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# tests.test_memoize
+
+from __future__ import absolute_import
+
+import asyncio
+
+import fastapi
+import pydantic
+import pytest
+
+import fastapi_plugins
+from fastapi_plugins.memoize import make_key
+
+pytestmark = [pytest.mark.anyio, pytest.mark.cache]
+
+
+class NotFound(Exception):
+    pass
+
+
+class UserNotFound(NotFound):
+    pass
+
+
+class Query(pydantic.BaseModel):
+    name: str
+    limit: int = 10
+
+
+@pytest.fixture
+async def memoryapp():
+    app = fastapi.FastAPI()
+    await fastapi_plugins.memory_cache_plugin.init_app(app)
+    await fastapi_plugins.memory_cache_plugin.init()
+    yield app
+    await fastapi_plugins.memory_cache_plugin.terminate()
+
+
+@pytest.fixture
+async def cacheapp():
+    app = fastapi.FastAPI()
+    await fastapi_plugins.cache_plugin.init_app(
+        app,
+        config=fastapi_plugins.CacheSettings(cache_namespace='ns')
+    )
+    await fastapi_plugins.cache_plugin.init()
+    yield app
+    await fastapi_plugins.cache_plugin.terminate()
+
+
+def test_make_key():
+    a = make_key('f', dict(a=1, b=[1, 2], c={'y': 1, 'x': 2}))
+    b = make_key('f', dict(c={'x': 2, 'y': 1}, b=[1, 2], a=1))
+    assert a == b and a.startswith('f:')
+    assert make_key('f', dict(a=2)) != make_key('f', dict(a=1))
+    assert make_key('f', dict(q=Query(name='x'))) == make_key('f', dict(q=Query(name='x')))   # noqa E501
+    assert make_key('f', dict(s={3, 1, 2})) == make_key('f', dict(s={1, 2, 3}))   # noqa E501
+    with pytest.raises(fastapi_plugins.CacheError):
+        make_key('f', dict(o=object()))
+
+
+def test_cached_invalid():
+    with pytest.raises(fastapi_plugins.CacheError):
+        fastapi_plugins.cached()(lambda: None)
+    with pytest.raises(fastapi_plugins.CacheError):
+        @fastapi_plugins.cached(backend='unknown')
+        async def func():
+            pass
+
+
+async def test_cached(memoryapp):
+    calls = []
+
+    @fastapi_plugins.cached(ttl=60, backend='memory')
+    async def get_user(name: str, verbose: bool=False):
+        calls.append(name)
+        return dict(name=name, verbose=verbose)
+
+    assert await get_user('a') == dict(name='a', verbose=False)
+    assert await get_user(name='a') == dict(name='a', verbose=False)
+    assert await get_user('a', False) == dict(name='a', verbose=False)
+    assert calls == ['a']
+    assert get_user.__name__ == 'get_user'
+    assert get_user.key('a') == get_user.key(name='a', verbose=False)
+    memory = await fastapi_plugins.memory_cache_plugin()
+    assert 0 < memory.ttl(get_user.key('a')) <= 60
+    #
+    assert await get_user('a', True) == dict(name='a', verbose=True)
+    assert calls == ['a', 'a']
+    assert await get_user.bypass('a') == dict(name='a', verbose=False)
+    assert calls == ['a', 'a', 'a']
+    assert await get_user.refresh('a') == dict(name='a', verbose=False)
+    assert await get_user('a') == dict(name='a', verbose=False)
+    assert calls == ['a', 'a', 'a', 'a']
+    await get_user.invalidate('a')
+    assert await get_user('a') == dict(name='a', verbose=False)
+    assert calls == ['a', 'a', 'a', 'a', 'a']
+    #
+    calls.clear()
+    await asyncio.gather(*[get_user('b') for _ in range(10)])
+    assert calls == ['b']
+
+
+async def test_cached_key(memoryapp):
+    @fastapi_plugins.cached(
+        backend=fastapi_plugins.memory_cache_plugin,
+        key=lambda user, **kwargs: user.lower(),
+        prefix='users'
+    )
+    async def get_user(user: str):
+        return user
+
+    assert get_user.key('Alice') == 'users:alice'
+    assert await get_user('Alice') == 'Alice'
+    assert await get_user('ALICE') == 'Alice'
+
+
+async def test_cached_negative(memoryapp):
+    calls = []
+
+    @fastapi_plugins.cached(
+        backend='memory',
+        negative_ttl=0.1,
+        exceptions=(NotFound,)
+    )
+    async def get_user(name: str):
+        calls.append(name)
+        if name == 'none':
+            return None
+        elif name == 'missing':
+            raise UserNotFound(name)
+        raise ValueError(name)
+
+    assert await get_user('none') is None
+    assert await get_user('none') is None
+    assert calls == ['none']
+    for _ in range(2):
+        with pytest.raises(UserNotFound) as e:
+            await get_user('missing')
+        assert e.value.args == ('missing',)
+    assert calls == ['none', 'missing']
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            await get_user('error')
+    assert calls == ['none', 'missing', 'error', 'error']
+    await asyncio.sleep(0.2)
+    assert await get_user('none') is None
+    assert calls == ['none', 'missing', 'error', 'error', 'none']
+    #
+    calls.clear()
+
+    @fastapi_plugins.cached(backend='memory')
+    async def get_none():
+        calls.append(None)
+
+    await get_none()
+    await get_none()
+    assert calls == [None, None]
+
+
+async def test_cached_method(cacheapp):
+    class Service(object):
+        def __init__(self):
+            self.calls = 0
+
+        @fastapi_plugins.cached(ttl=60)
+        async def get(self, x: int) -> int:
+            self.calls += 1
+            return x * 2
+
+    a, b = Service(), Service()
+    assert await a.get(2) == 4
+    assert await b.get(2) == 4
+    assert a.calls == 1 and b.calls == 0
+    assert a.get.key(2) == Service.get.key(b, 2)
+    assert await fastapi_plugins.cache_plugin.backend.get(f'ns:{a.get.key(2)}')   # noqa E501
+    await a.get.invalidate(2)
+    assert await b.get(2) == 4
+    assert b.calls == 1
+
+
+async def test_cached_method_instance(cacheapp):
+    class Account(object):
+        def __init__(self, account_id: int):
+            self.account_id = account_id
+            self.calls = 0
+
+        def __cache_key__(self) -> int:
+            return self.account_id
+
+        @fastapi_plugins.cached(ttl=60)
+        async def balance(self, currency: str) -> str:
+            self.calls += 1
+            return f'{self.account_id}:{currency}'
+
+    a, b = Account(1), Account(2)
+    assert await a.balance('EUR') == '1:EUR'
+    assert await b.balance('EUR') == '2:EUR'
+    assert await Account(1).balance('EUR') == '1:EUR'
+    assert a.calls == b.calls == 1
+    assert a.balance.key('EUR') != b.balance.key('EUR')
+
+
+async def test_cached_not_serializable(cacheapp):
+    class Point(object):
+        def __init__(self, x: int):
+            self.x = x
+
+    calls = []
+
+    @fastapi_plugins.cached(ttl=60)
+    async def get_point(x: int) -> Point:
+        calls.append(x)
+        return Point(x)
+
+    # the result is returned, but not cached
+    assert (await get_point(1)).x == 1
+    assert (await get_point(1)).x == 1
+    assert calls == [1, 1]
+    assert await fastapi_plugins.cache_plugin.backend.get(f'ns:{get_point.key(1)}') is None   # noqa E501
+
+
+async def test_cached_fail_open():
+    calls = []
+
+    @fastapi_plugins.cached(backend='memory')
+    async def func():
+        calls.append(1)
+        return 1
+
+    @fastapi_plugins.cached()
+    async def func2():
+        calls.append(2)
+        return 2
+
+    # the caches are not initialized
+    assert await func() == 1
+    assert await func() == 1
+    assert await func2() == 2
+    assert calls == [1, 1, 2]
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# tests.test_memory
+
+from __future__ import absolute_import
+
+import asyncio
+
+import fastapi
+import pytest
+
+import fastapi_plugins
+from fastapi_plugins.memory import FrequencySketch, MemoryCache
+
+pytestmark = [pytest.mark.anyio, pytest.mark.memory]
+
+
+@pytest.fixture
+async def memoryapp():
+    app = fastapi.FastAPI()
+    config = fastapi_plugins.MemoryCacheSettings(memory_expire_interval=0.05)
+    await fastapi_plugins.memory_cache_plugin.init_app(app, config=config)
+    await fastapi_plugins.memory_cache_plugin.init()
+    yield app
+    await fastapi_plugins.memory_cache_plugin.terminate()
+
+
+def test_sketch():
+    sketch = FrequencySketch(64)
+    assert sketch.width == 64
+    for _ in range(5):
+        sketch.increment('hot')
+    sketch.increment('cold')
+    assert sketch.frequency('hot') >= 5
+    assert sketch.frequency('cold') >= 1
+    assert sketch.frequency('hot') > sketch.frequency('cold')
+    assert sketch.frequency('unknown') == 0
+    for _ in range(20):
+        sketch.increment('hot')
+    assert sketch.frequency('hot') == 16
+    sketch.reset()
+    # the counters are halved and the doorkeeper is cleared
+    assert sketch.frequency('hot') == 7
+    sketch.increment('hot')
+    assert sketch.frequency('hot') == 8
+
+
+def test_get_set():
+    memory = MemoryCache()
+    assert memory.get('x') is None
+    memory.set('x', b'value')
+    assert memory.get('x') == b'value'
+    assert 'x' in memory and len(memory) == 1
+    assert memory.add('x', b'other') is False
+    assert memory.delete('x') is True
+    assert memory.delete('x') is False
+    assert memory.add('x', b'other') is True
+    assert memory.incr('n', 2) == 2
+    assert memory.incr('n', -1) == 1
+    with pytest.raises(fastapi_plugins.MemoryCacheError):
+        memory.incr('x')
+    stats = memory.stats()
+    assert stats['size'] == 2 and stats['hits'] == 1 and stats['misses'] == 1
+    memory.clear()
+    assert len(memory) == 0 and memory.nbytes == 0
+
+
+def test_maxbytes():
+    memory = MemoryCache(maxbytes=64 * 1024)
+    for i in range(1000):
+        memory.set(f'key{i}', b'x' * 100)
+    assert memory.nbytes <= memory.maxbytes
+    assert 0 < len(memory) < 1000
+    assert memory.evictions == 1000 - len(memory)
+    memory.set('large', b'x' * memory.maxbytes)
+    assert 'large' not in memory
+    # replacing a value accounts the new size
+    memory.set('key999', b'x' * 1000)
+    assert memory.nbytes <= memory.maxbytes
+    with pytest.raises(fastapi_plugins.MemoryCacheError):
+        MemoryCache(maxbytes=0)
+
+
+def test_scan_resistance():
+    memory = MemoryCache(maxbytes=64 * 1024)
+    hot = [f'hot{i}' for i in range(50)]
+    for _ in range(5):
+        for key in hot:
+            if memory.get(key) is None:
+                memory.set(key, b'x' * 100)
+    for i in range(5000):
+        memory.set(f'scan{i}', b'x' * 100)
+    assert all(key in memory for key in hot)
+    #
+    lru = MemoryCache(maxbytes=64 * 1024, window=1)
+    for key in hot:
+        lru.set(key, b'x' * 100)
+    for i in range(5000):
+        lru.set(f'scan{i}', b'x' * 100)
+    assert not any(key in lru for key in hot)
+
+
+async def test_ttl():
+    memory = MemoryCache(resolution=0.01)
+    memory.set('x', b'value', ttl=0.05)
+    memory.set('y', b'value', ttl=0.05)
+    memory.set('z', b'value')
+    assert 0 < memory.ttl('x') <= 0.05
+    assert memory.ttl('z') is None
+    assert memory.expire('y', 10) is True
+    assert memory.expire('missing', 10) is False
+    await asyncio.sleep(0.1)
+    assert memory.get('x') is None
+    assert memory.expirations == 1
+    memory.set('x', b'value', ttl=0.01)
+    memory.set('w', b'value', ttl=0.01)
+    await asyncio.sleep(0.05)
+    assert memory.expire_purge() == 2
+    assert len(memory) == 2 and 'y' in memory and 'z' in memory
+    assert memory.expire_purge() == 0
+
+
+async def test_plugin(memoryapp):
+    memory = await fastapi_plugins.memory_cache_plugin()
+    assert memoryapp.state.MEMORY is fastapi_plugins.memory_cache_plugin
+    memory.set('x', b'value', ttl=0.01)
+    await asyncio.sleep(0.2)
+    # removed by the periodic expiry, not by an access
+    assert len(memory) == 0
+    health = await fastapi_plugins.memory_cache_plugin.health()
+    assert health['expirations'] == 1
+    assert health['maxbytes'] == 64 * 1024 * 1024
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# tests.test_middleware
+
+from __future__ import absolute_import
+
+import asyncio
+
+import fastapi
+import httpx
+import pytest
+
+import fastapi_plugins
+
+pytestmark = [pytest.mark.anyio, pytest.mark.middleware]
+
+
+def make_app(**options):
+    app = fastapi.FastAPI()
+    app.state.CALLS = 0
+
+    @app.get('/items')
+    async def items_get(page: int=0):
+        app.state.CALLS += 1
+        await asyncio.sleep(0.1)
+        return dict(page=page, calls=app.state.CALLS)
+
+    @app.post('/items')
+    async def items_post():
+        app.state.CALLS += 1
+        await asyncio.sleep(0.1)
+        return dict(calls=app.state.CALLS)
+
+    @app.get('/session')
+    async def session_get(response: fastapi.Response):
+        app.state.CALLS += 1
+        session = str(app.state.CALLS)
+        await asyncio.sleep(0.1)
+        response.set_cookie('session', session)
+        return dict(session=session)
+
+    @app.get('/error')
+    async def error_get():
+        app.state.CALLS += 1
+        await asyncio.sleep(0.1)
+        raise RuntimeError('error')
+
+    @app.get('/unavailable')
+    async def unavailable_get():
+        app.state.CALLS += 1
+        await asyncio.sleep(0.1)
+        return fastapi.responses.JSONResponse(dict(calls=app.state.CALLS), status_code=503)   # noqa E501
+
+    return fastapi_plugins.register_middleware(
+        app,
+        [(fastapi_plugins.CoalescingMiddleware, options)]
+    )
+
+
+def make_client(app):
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app, raise_app_exceptions=False),
+        base_url='http://test'
+    )
+
+
+async def test_coalescing():
+    app = make_app()
+    async with make_client(app) as client:
+        responses = await asyncio.gather(*[
+            client.get('/items', params=dict(page=1)) for _ in range(10)
+        ])
+        assert [r.json() for r in responses] == [dict(page=1, calls=1)] * 10
+        assert app.state.CALLS == 1
+        # different query, different authorization
+        responses = await asyncio.gather(
+            client.get('/items', params=dict(page=1)),
+            client.get('/items', params=dict(page=2)),
+            client.get('/items', params=dict(page=1), headers=dict(authorization='Bearer x')),   # noqa E501
+        )
+        assert app.state.CALLS == 4
+        # completed requests are not cached
+        await client.get('/items', params=dict(page=1))
+        assert app.state.CALLS == 5
+        # only the configured methods
+        await asyncio.gather(*[client.post('/items') for _ in range(3)])
+        assert app.state.CALLS == 8
+
+
+async def test_coalescing_not_shared():
+    app = make_app(max_size=10)
+    async with make_client(app) as client:
+        responses = await asyncio.gather(*[client.get('/session') for _ in range(3)])   # noqa E501
+        assert sorted(r.cookies['session'] for r in responses) == ['1', '2', '3']   # noqa E501
+        assert app.state.CALLS == 3
+        await asyncio.gather(*[client.get('/items') for _ in range(3)])
+        assert app.state.CALLS == 6
+        responses = await asyncio.gather(*[client.get('/error') for _ in range(3)])   # noqa E501
+        assert [r.status_code for r in responses] == [500] * 3
+        assert app.state.CALLS == 9
+    # a returned server error is not shared either
+    app = make_app()
+    async with make_client(app) as client:
+        responses = await asyncio.gather(*[client.get('/unavailable') for _ in range(3)])   # noqa E501
+        assert [r.status_code for r in responses] == [503] * 3
+        assert app.state.CALLS == 3
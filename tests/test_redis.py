@@ -4,6 +4,7 @@
 
 from __future__ import absolute_import
 
+import asyncio
 import uuid
 
 import fastapi
@@ -22,7 +23,11 @@ async def redisapp(request):
         app=app,
         config=request.param or fastapi_plugins.RedisSettings(),
     )
-    await fastapi_plugins.redis_plugin.init()
+    try:
+        await fastapi_plugins.redis_plugin.init()
+    except BaseException:
+        await fastapi_plugins.redis_plugin.terminate()
+        raise
     yield app
     await fastapi_plugins.redis_plugin.terminate()
 
@@ -62,6 +67,13 @@ async def test_connect_redis_url(redisapp):
             ),
             marks=pytest.mark.sentinel
         ),
+        pytest.param(
+            fastapi_plugins.RedisSettings(
+                redis_type='cluster',
+                redis_cluster_nodes='localhost:7000'
+            ),
+            marks=pytest.mark.cluster
+        ),
     ],
     indirect=['redisapp']
 )
@@ -84,6 +96,13 @@ async def test_connect(redisapp):
             ),
             marks=pytest.mark.sentinel
         ),
+        pytest.param(
+            fastapi_plugins.RedisSettings(
+                redis_type='cluster',
+                redis_cluster_nodes='localhost:7000'
+            ),
+            marks=pytest.mark.cluster
+        ),
     ],
     indirect=['redisapp']
 )
@@ -110,11 +129,15 @@ async def test_ping(redisapp):
     indirect=['redisapp']
 )
 async def test_health(redisapp):
-    assert await fastapi_plugins.redis_plugin.health() == dict(
+    health = await fastapi_plugins.redis_plugin.health()
+    pool = health.pop('redis_pool')
+    assert health == dict(
         redis_type=fastapi_plugins.redis_plugin.config.redis_type,
         redis_address=fastapi_plugins.redis_plugin.config.get_sentinels() if fastapi_plugins.redis_plugin.config.redis_type == RedisType.sentinel else fastapi_plugins.redis_plugin.config.get_redis_address(), # noqa E501
         redis_pong=True
     )
+    assert pool['in_use'] == 0
+    assert pool['idle'] == pool['created'] == 1
 
 
 @pytest.mark.parametrize(
@@ -132,6 +155,13 @@ async def test_health(redisapp):
             ),
             marks=pytest.mark.sentinel
         ),
+        pytest.param(
+            fastapi_plugins.RedisSettings(
+                redis_type='cluster',
+                redis_cluster_nodes='localhost:7000'
+            ),
+            marks=pytest.mark.cluster
+        ),
     ],
     indirect=['redisapp']
 )
@@ -169,6 +199,599 @@ async def test_get_set_ttl(redisapp):
     assert (ttl - 5) <= await c.ttl('x') <= ttl
 
 
+@pytest.mark.cluster
+@pytest.mark.parametrize(
+    'redisapp',
+    [
+        pytest.param(
+            fastapi_plugins.RedisSettings(
+                redis_type='cluster',
+                redis_cluster_nodes='localhost:7000',
+                redis_cluster_refresh_interval=1
+            )
+        ),
+    ],
+    indirect=['redisapp']
+)
+async def test_health_cluster(redisapp):
+    health = await fastapi_plugins.redis_plugin.health()
+    assert health['redis_type'] == RedisType.cluster
+    assert health['redis_address'] == [('localhost', 7000)]
+    assert health['redis_pong'] is True
+    assert health['redis_nodes']
+    for node in health['redis_nodes'].values():
+        assert node['pong'] is True
+        assert node['server_type'] in ('primary', 'replica')
+
+
+def test_cluster_nodes():
+    config = fastapi_plugins.RedisSettings(
+        redis_type='cluster',
+        redis_cluster_nodes='node1:7000, node2:7001,,node3:7002'
+    )
+    assert config.get_cluster_nodes() == [
+        ('node1', 7000), ('node2', 7001), ('node3', 7002)
+    ]
+    assert fastapi_plugins.RedisSettings().get_cluster_nodes() == [
+        ('localhost', 6379)
+    ]
+    with pytest.raises(RuntimeError):
+        fastapi_plugins.RedisSettings(redis_cluster_nodes='node1').get_cluster_nodes()    # noqa E501
+    #
+    plugin = fastapi_plugins.RedisPlugin()
+    plugin.config = config
+    client = plugin._create_cluster(
+        config.get_cluster_nodes(),
+        db=None,
+        max_connections=None,
+        decode_responses=True
+    )
+    assert sorted(
+        node.name for node in client.nodes_manager.startup_nodes.values()
+    ) == ['node1:7000', 'node2:7001', 'node3:7002']
+
+
+@pytest.mark.parametrize(
+    'redisapp',
+    [
+        pytest.param(fastapi_plugins.RedisSettings(redis_ttl=61)),
+        pytest.param(
+            fastapi_plugins.RedisSettings(redis_type='fakeredis', redis_ttl=61),
+            marks=pytest.mark.fakeredis
+        ),
+    ],
+    indirect=['redisapp']
+)
+async def test_connection_cached(redisapp):
+    c = await fastapi_plugins.redis_plugin()
+    assert c is await fastapi_plugins.redis_plugin()
+    assert c.TTL == 61
+    request = type('', (), {'app': redisapp})()
+    assert c is await fastapi_plugins.depends_redis(request)
+
+
+@pytest.mark.parametrize(
+    'redisapp',
+    [
+        pytest.param(fastapi_plugins.RedisSettings(redis_pool_minsize=5)),
+        pytest.param(
+            fastapi_plugins.RedisSettings(
+                redis_type='fakeredis',
+                redis_pool_minsize=5
+            ),
+            marks=pytest.mark.fakeredis
+        ),
+    ],
+    indirect=['redisapp']
+)
+async def test_pool_warm_up(redisapp):
+    stats = (await fastapi_plugins.redis_plugin.health())['redis_pool']
+    assert stats['idle'] == stats['created'] == 5
+    assert stats['in_use'] == 0
+    assert stats['creation_rate'] == 5 / 60
+    assert await fastapi_plugins.redis_plugin.warm_up() == 0
+    #
+    c = await fastapi_plugins.redis_plugin()
+    acquired = stats['acquired']
+    await asyncio.gather(*[c.get('x') for _ in range(5)])
+    stats = (await fastapi_plugins.redis_plugin.health())['redis_pool']
+    assert stats['created'] == 5
+    assert stats['acquired'] == acquired + 6
+    assert stats['acquire_time_max'] >= stats['acquire_time_avg'] > 0
+
+
+@pytest.mark.sentinel
+async def test_sentinel_failover():
+    import redis.asyncio.sentinel as aioredis_sentinel
+    plugin = fastapi_plugins.RedisPlugin()
+    plugin.config = fastapi_plugins.RedisSettings(
+        redis_type='sentinel',
+        redis_sentinels='localhost:26379'
+    )
+    plugin.redis = aioredis_sentinel.Sentinel(plugin.config.get_sentinels())
+    plugin._connection = conn = await plugin._create_connection()
+    #
+    await plugin._on_sentinel_message(b'othermaster 10.0.0.1 6379 10.0.0.2 6379')
+    assert plugin._connection is conn
+    await plugin._on_sentinel_message('mymaster 10.0.0.1 6379 10.0.0.2 6379')
+    assert plugin._connection is not conn
+    assert plugin._connection.TTL == plugin.config.redis_ttl
+    assert await plugin() is plugin._connection
+
+
+async def test_nearcache_lru():
+    nearcache = fastapi_plugins.RedisNearCache(maxsize=2)
+    nearcache._ready = True
+    for key in (b'a', b'b', b'c'):
+        nearcache.set(key, key.decode(), nearcache.reserve(key))
+    assert len(nearcache) == 2
+    assert nearcache.get(b'b') == 'b'
+    assert nearcache.get(b'c') == 'c'
+    nearcache.set(b'd', 'd', nearcache.reserve(b'd'))
+    assert len(nearcache) == 2
+    assert nearcache.get(b'c') == 'c'
+    assert nearcache.get(b'd') == 'd'
+    #
+    # only an invalidation of the key read makes the value stale
+    token = nearcache.reserve(b'e')
+    other = nearcache.reserve(b'f')
+    nearcache.invalidate([b'c'])
+    nearcache.invalidate([b'f'])
+    nearcache.set(b'e', 'e', token)
+    nearcache.set(b'f', 'f', other)
+    assert nearcache.get(b'e') == 'e'
+    assert nearcache.get(b'f') is fastapi_plugins._redis_nearcache._MISSING
+    assert len(nearcache) == 2
+    assert nearcache._reads == {} and nearcache._versions == {}
+    token = nearcache.reserve(b'f')
+    nearcache.invalidate()
+    nearcache.set(b'f', 'f', token)
+    assert len(nearcache) == 0
+    assert nearcache.stats() == dict(
+        ready=True,
+        mode='default',
+        size=0,
+        maxsize=2,
+        hits=5,
+        misses=1,
+        evictions=2,
+        invalidations=3
+    )
+
+
+@pytest.mark.fakeredis
+async def test_nearcache_redis():
+    import fakeredis.aioredis
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    nearcache = fastapi_plugins.RedisNearCache(maxsize=10)
+    nearcache._ready = True
+    c = fastapi_plugins.NearCacheRedis(
+        nearcache,
+        connection_pool=client.connection_pool
+    )
+    await c.set('x', 'value1')
+    assert await c.get('x') == 'value1'
+    assert await c.get('x') == 'value1'
+    assert nearcache.hits == 1 and nearcache.misses == 1
+    #
+    # local writes evict at once, reads do not
+    await c.set('x', 'value2')
+    assert await c.get('x') == 'value2'
+    assert await c.ttl('x') == -1
+    assert await c.get('x') == 'value2'
+    await c.mset({'y': 1, 'x': 'value3'})
+    assert await c.get('x') == 'value3'
+    #
+    await c.delete('x')
+    assert await c.get('x') is None
+    assert await c.get('x') is None
+    assert nearcache.stats()['hits'] == 3
+    assert nearcache._reads == {}
+
+
+@pytest.mark.fakeredis
+async def test_nearcache_reset():
+    import fakeredis.aioredis
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    nearcache = fastapi_plugins.RedisNearCache(maxsize=10)
+    nearcache._pool = client.connection_pool
+    nearcache._client_id = 1
+    nearcache._set_connect_func(nearcache._on_connect)
+    nearcache._ready = True
+    nearcache.set(b'x', 'x', nearcache.reserve(b'x'))
+    # a lost listener stops the tracking of new connections
+    await nearcache._reset()
+    assert not nearcache.ready
+    assert nearcache._client_id is None
+    assert client.connection_pool.connection_kwargs['redis_connect_func'] is None   # noqa E501
+    assert len(nearcache) == 0
+    c = fastapi_plugins.NearCacheRedis(nearcache, connection_pool=client.connection_pool)   # noqa E501
+    await c.set('x', 'value')
+    assert await c.get('x') == 'value'
+    assert len(nearcache) == 0
+
+
+def test_nearcache_written_keys():
+    from fastapi_plugins._redis_nearcache import _written_keys
+    assert list(_written_keys(('SET', 'x', 'v'))) == ['x']
+    assert list(_written_keys(('MSET', 'x', 1, 'y', 2))) == ['x', 'y']
+    assert list(_written_keys(('EVAL', 'return 1', 2, 'x', 'y', 'v'))) == ['x', 'y']  # noqa E501
+    assert list(_written_keys(('EVALSHA', 'abc', 0, 'v'))) == []
+    assert list(_written_keys(('FCALL', 'f', '1', 'x', 'v'))) == ['x']
+    assert list(_written_keys(('EVAL_RO', 'return 1', 1, 'x'))) == []
+    assert list(_written_keys(('GETRANGE', 'x', 0, 1))) == []
+
+
+@pytest.mark.fakeredis
+async def test_nearcache_pipeline():
+    import fakeredis.aioredis
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    nearcache = fastapi_plugins.RedisNearCache(maxsize=10)
+    nearcache._ready = True
+    c = fastapi_plugins.NearCacheRedis(
+        nearcache,
+        connection_pool=client.connection_pool
+    )
+    await c.mset({'x': 'value1', 'y': 'value1'})
+    assert await c.get('x') == 'value1'
+    assert await c.get('y') == 'value1'
+    # every buffered command evicts its key
+    async with c.pipeline(transaction=True) as pipe:
+        pipe.set('x', 'value2')
+        pipe.get('z')
+        pipe.set('y', 'value2')
+        await pipe.execute()
+    assert len(nearcache) == 0
+    assert await c.get('x') == 'value2'
+    assert await c.get('y') == 'value2'
+    # the commands of a watching pipeline are sent at once
+    async with c.pipeline(transaction=True) as pipe:
+        await pipe.watch('x')
+        await pipe.set('x', 'value3')
+        assert b'x' not in nearcache._data
+    assert await c.get('x') == 'value3'
+
+
+@pytest.mark.fakeredis
+async def test_nearcache_lazy_redirect():
+    import fakeredis.aioredis
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    pool = client.connection_pool
+    await client.ping()
+    busy = await pool.get_connection('BLPOP')
+    nearcache = fastapi_plugins.RedisNearCache(maxsize=10)
+    nearcache._pool = pool
+    pool.release = nearcache._release
+    nearcache._client_id = 1
+    token = nearcache.reserve(b'x')
+    # a connection in use does not delay the tracking
+    await asyncio.wait_for(nearcache._activate(), timeout=1)
+    assert nearcache.ready
+    assert busy.redis_connect_func == nearcache._on_connect
+    nearcache.set(b'x', 'x', token)
+    assert len(nearcache) == 0
+    # but reconnects with it, once it is released
+    assert busy.is_connected
+    await pool.release(busy)
+    assert not busy.is_connected
+    assert busy in pool._available_connections
+    assert len(nearcache._stale) == 0
+    await nearcache.close()
+    assert 'release' not in pool.__dict__
+
+
+async def _wait_for(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.parametrize(
+    'redisapp',
+    [
+        pytest.param(fastapi_plugins.RedisSettings(redis_nearcache=True)),
+        pytest.param(
+            fastapi_plugins.RedisSettings(
+                redis_nearcache=True,
+                redis_nearcache_mode='bcast',
+                redis_nearcache_prefixes='nearcache:'
+            )
+        ),
+    ],
+    indirect=['redisapp']
+)
+async def test_nearcache_invalidation(redisapp):
+    import redis.asyncio as aioredis
+    c = await fastapi_plugins.redis_plugin()
+    nearcache = fastapi_plugins.redis_plugin.nearcache
+    other = aioredis.from_url(fastapi_plugins.redis_plugin.config.get_redis_address())   # noqa E501
+    try:
+        await c.set('nearcache:x', 'value1')
+        assert await c.get('nearcache:x') == 'value1'
+        assert await c.get('nearcache:x') == 'value1'
+        assert nearcache.hits >= 1
+        # a write by another client is pushed by the server
+        await other.set('nearcache:x', 'value2')
+        await _wait_for(lambda: b'nearcache:x' not in nearcache._data)
+        assert await c.get('nearcache:x') == 'value2'
+    finally:
+        await other.close()
+
+
+@pytest.mark.parametrize(
+    'redisapp',
+    [pytest.param(fastapi_plugins.RedisSettings(redis_nearcache=True))],
+    indirect=['redisapp']
+)
+async def test_nearcache_recovery(redisapp):
+    import redis.asyncio as aioredis
+    c = await fastapi_plugins.redis_plugin()
+    nearcache = fastapi_plugins.redis_plugin.nearcache
+    other = aioredis.from_url(fastapi_plugins.redis_plugin.config.get_redis_address())   # noqa E501
+    try:
+        await c.set('nearcache:y', 'value1')
+        assert await c.get('nearcache:y') == 'value1'
+        # the listener fails
+        await other.execute_command('CLIENT', 'KILL', 'ID', nearcache._client_id)   # noqa E501
+        await _wait_for(lambda: not nearcache.ready)
+        # new connections do not redirect to the lost listener
+        await c.connection_pool.disconnect(inuse_connections=False)
+        assert await c.get('nearcache:y') == 'value1'
+        await other.set('nearcache:y', 'value2')
+        assert await c.get('nearcache:y') == 'value2'
+        # the near cache is subscribed again and invalidated by the server
+        await _wait_for(lambda: nearcache.ready)
+        assert await c.get('nearcache:y') == 'value2'
+        assert await c.get('nearcache:y') == 'value2'
+        assert b'nearcache:y' in nearcache._data
+        await other.set('nearcache:y', 'value3')
+        await _wait_for(lambda: b'nearcache:y' not in nearcache._data)
+        assert await c.get('nearcache:y') == 'value3'
+    finally:
+        await other.close()
+
+
+@pytest.mark.parametrize(
+    'redisapp',
+    [
+        pytest.param(fastapi_plugins.RedisSettings(redis_autopipeline=True)),
+        pytest.param(
+            fastapi_plugins.RedisSettings(
+                redis_type='fakeredis',
+                redis_autopipeline=True
+            ),
+            marks=pytest.mark.fakeredis
+        ),
+        pytest.param(
+            fastapi_plugins.RedisSettings(
+                redis_type='fakeredis',
+                redis_autopipeline=True,
+                redis_autopipeline_window=0.01,
+                redis_autopipeline_max_size=8
+            ),
+            marks=pytest.mark.fakeredis
+        ),
+    ],
+    indirect=['redisapp']
+)
+async def test_autopipeline(redisapp):
+    import redis.exceptions
+    c = await fastapi_plugins.redis_plugin()
+    assert isinstance(c, fastapi_plugins.AutoPipelineRedis)
+    stats = c.autopipeline_stats()
+    keys = [f'autopipeline:{i}' for i in range(20)]
+    assert all(await asyncio.gather(*[c.set(key, key) for key in keys]))
+    assert await asyncio.gather(*[c.get(key) for key in keys]) == keys
+    assert c.autopipeline_stats()['commands'] - stats['commands'] == 40
+    assert c.autopipeline_stats()['batches'] - stats['batches'] < 40
+    #
+    # errors are delivered to the caller of the failed command only
+    results = await asyncio.gather(
+        c.incr(keys[0]),
+        c.get(keys[1]),
+        return_exceptions=True
+    )
+    assert isinstance(results[0], redis.exceptions.ResponseError)
+    assert results[1] == keys[1]
+    #
+    health = await fastapi_plugins.redis_plugin.health()
+    assert health['redis_autopipeline']['pending'] == 0
+
+
+@pytest.mark.parametrize(
+    'redisapp',
+    [
+        pytest.param(
+            fastapi_plugins.RedisSettings(
+                redis_read_policy='replica',
+                redis_replica_urls='redis://localhost:6379/2'
+            )
+        ),
+        pytest.param(
+            fastapi_plugins.RedisSettings(
+                redis_type='fakeredis',
+                redis_read_policy='replica',
+                redis_replica_urls='redis://localhost:6379/2'
+            ),
+            marks=pytest.mark.fakeredis
+        ),
+        pytest.param(
+            fastapi_plugins.RedisSettings(
+                redis_type='fakeredis',
+                redis_read_policy='replica',
+                redis_replica_urls='redis://localhost:6379/2',
+                redis_replica_read_after_write=60,
+                redis_autopipeline=True
+            ),
+            marks=pytest.mark.fakeredis
+        ),
+    ],
+    indirect=['redisapp']
+)
+async def test_read_policy(redisapp):
+    # the "replica" is another database, hence its values differ
+    c = await fastapi_plugins.redis_plugin()
+    assert isinstance(c, fastapi_plugins.ReplicaRoutingRedis)
+    replica = c.replicas[0]
+    await replica.set('x', 'replica')
+    await c.set('x', 'master')
+    stats = c.replica_stats()
+    if c.read_after_write:
+        assert await c.get('x') == 'master'
+        assert c.replica_stats()['master_reads'] == stats['master_reads'] + 1
+    else:
+        assert await c.get('x') == 'replica'
+        assert await c.exists('x') == 1
+        assert c.replica_stats()['replica_reads'] == stats['replica_reads'] + 2
+    health = await fastapi_plugins.redis_plugin.health()
+    assert health['redis_replicas']['replicas'] == 1
+    assert health['redis_replicas']['read_policy'] == 'replica'
+
+
+@pytest.mark.fakeredis
+async def test_read_policy_fallback():
+    import fakeredis.aioredis
+    import redis.exceptions
+
+    class BrokenRedis(fakeredis.aioredis.FakeRedis):
+        async def execute_command(self, *args, **options):
+            raise redis.exceptions.ConnectionError('replica is down')
+
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    await client.set('x', 'master')
+    c = fastapi_plugins.ReplicaRoutingRedis(
+        replicas=[BrokenRedis()],
+        read_policy='replica_preferred',
+        connection_pool=client.connection_pool
+    )
+    assert await c.get('x') == 'master'
+    assert c.replica_stats()['fallbacks'] == 1
+    c.read_policy = fastapi_plugins.RedisReadPolicy.replica
+    with pytest.raises(redis.exceptions.ConnectionError):
+        await c.get('x')
+
+
+@pytest.mark.parametrize(
+    'redisapp',
+    [
+        pytest.param(
+            fastapi_plugins.RedisSettings(redis_type='fakeredis'),
+            marks=pytest.mark.fakeredis
+        ),
+    ],
+    indirect=['redisapp']
+)
+async def test_scan(redisapp):
+    c = await fastapi_plugins.redis_plugin()
+    await c.flushdb()
+    await c.mset({f'scan:{i}': i for i in range(100)})
+    await c.mset({f'other:{i}': i for i in range(10)})
+    await c.hset('hash', mapping={f'f{i}': i for i in range(50)})
+    await c.sadd('set', *range(50))
+    #
+    progress = fastapi_plugins.ScanProgress()
+    keys = set()
+    async for batch in fastapi_plugins.scan_keys(c, 'scan:*', count=10, progress=progress):   # noqa E501
+        keys.update(batch)
+    assert keys == {f'scan:{i}' for i in range(100)}
+    assert progress.scanned >= 100 and progress.batches > 1
+    assert progress.nodes_done == progress.nodes == 1
+    keys = [key async for batch in fastapi_plugins.scan_keys(c, _type='hash') for key in batch]   # noqa E501
+    assert keys == ['hash']
+    #
+    items = {}
+    async for batch in fastapi_plugins.hscan_items(c, 'hash', count=10):
+        items.update(batch)
+    assert len(items) == 50 and items['f1'] == '1'
+    members = set()
+    async for batch in fastapi_plugins.sscan_members(c, 'set', match='1*', count=10):   # noqa E501
+        members.update(batch)
+    assert members == {str(i) for i in range(50) if str(i).startswith('1')}   # noqa E501
+    #
+    progresses = [
+        progress.to_dict()
+        async for progress in fastapi_plugins.unlink_keys(c, 'scan:*', count=10, pause=0.001)   # noqa E501
+    ]
+    assert len(progresses) > 1
+    assert progresses[-1]['unlinked'] == 100
+    assert progresses[-1]['nodes_done'] == 1
+    assert await c.dbsize() == 12
+    assert [p async for p in fastapi_plugins.unlink_keys(c, 'scan:*')] == []
+
+
+@pytest.mark.parametrize(
+    'redisapp',
+    [
+        pytest.param(
+            fastapi_plugins.RedisSettings(redis_type='fakeredis'),
+            marks=pytest.mark.fakeredis
+        ),
+    ],
+    indirect=['redisapp']
+)
+async def test_lease(redisapp):
+    c = await fastapi_plugins.redis_plugin()
+    await c.flushdb()
+    leader = fastapi_plugins.RedisLease('job', ttl=0.3)
+    follower = fastapi_plugins.RedisLease('job', ttl=0.3)
+    assert await leader.acquire() == 1
+    assert await follower.acquire() is None
+    assert await leader.acquire() == 1
+    assert leader.is_leader and not follower.is_leader
+    assert await leader.renew()
+    assert not await follower.renew()
+    assert await leader.is_current(1)
+    #
+    await leader.release()
+    assert not leader.is_leader
+    assert await follower.acquire() == 2
+    assert not await leader.is_current(1)
+    assert not await leader.renew()
+    #
+    # the follower takes over, when the leader dies
+    await follower.release()
+    leader.start()
+    follower.start()
+    await asyncio.sleep(0.05)
+    assert leader.is_leader and not follower.is_leader
+    leader._task.cancel()
+    await asyncio.sleep(0.5)
+    assert not leader.is_leader and follower.is_leader
+    assert follower.token == 4
+    assert follower.stats()['acquired'] == 2
+    # the leader steps down, when it learns about the new leader
+    assert await leader.acquire() is None
+    assert leader.stats()['lost'] == 1
+    await follower.stop()
+    assert await c.get(follower.key) is None
+    await leader.stop()
+
+
+@pytest.mark.fakeredis
+async def test_lease_is_current():
+    import fakeredis.aioredis
+    client = fakeredis.aioredis.FakeRedis()
+    nearcache = fastapi_plugins.RedisNearCache(maxsize=10)
+    nearcache._ready = True
+    c = fastapi_plugins.NearCacheRedis(
+        nearcache,
+        connection_pool=client.connection_pool
+    )
+
+    async def plugin():
+        return c
+
+    lease = fastapi_plugins.RedisLease('job', plugin=plugin)
+    assert await lease.acquire() == 1
+    assert int(await c.get(lease.token_key)) == 1
+    # the token is not served from the near cache
+    await client.incr(lease.token_key)
+    assert int(await c.get(lease.token_key)) == 1
+    assert not await lease.is_current(1)
+    assert await lease.is_current(2)
+
+
 # def redis_must_be_running(cls):
 #     # TODO: This SHOULD be improved
 #     try:
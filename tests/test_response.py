@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# tests.test_response
+
+from __future__ import absolute_import
+
+import contextlib
+import typing
+
+import fastapi
+import pytest
+import starlette.requests
+import starlette.testclient
+
+import fastapi_plugins
+
+pytestmark = [pytest.mark.anyio, pytest.mark.response]
+
+
+def make_app(config=None):
+    if config is None:
+        config = fastapi_plugins.RedisSettings(redis_type='fakeredis')
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: fastapi.FastAPI):
+        await fastapi_plugins.redis_plugin.init_app(app, config=config)
+        await fastapi_plugins.redis_plugin.init()
+        yield
+        await fastapi_plugins.redis_plugin.terminate()
+
+    app = fastapi.FastAPI(lifespan=lifespan)
+    app.state.CALLS = 0
+    router = fastapi.APIRouter(route_class=fastapi_plugins.CachedRoute)
+
+    @router.get('/items')
+    @fastapi_plugins.cache_response(ttl=60, query_params=['page'])
+    async def items_get(
+            request: fastapi.Request,
+            page: int=0,
+            debug: bool=False
+    ) -> typing.Dict:
+        request.app.state.CALLS += 1
+        return dict(page=page, calls=request.app.state.CALLS)
+
+    @router.get('/users')
+    @fastapi_plugins.cache_response(headers=['Accept-Language'])
+    async def users_get(request: fastapi.Request) -> fastapi.Response:
+        request.app.state.CALLS += 1
+        return fastapi.responses.PlainTextResponse(
+            request.headers.get('accept-language', 'none'),
+            headers={'x-custom': 'custom'}
+        )
+
+    @router.get('/plain')
+    async def plain_get(request: fastapi.Request) -> typing.Dict:
+        request.app.state.CALLS += 1
+        return dict(calls=request.app.state.CALLS)
+
+    app.include_router(router)
+    return app
+
+
+@pytest.fixture
+def client():
+    with starlette.testclient.TestClient(make_app()) as c:
+        yield c
+
+
+@pytest.mark.fakeredis
+def test_response_cache(client):
+    response = client.get('/items?page=1')
+    assert response.status_code == 200
+    assert response.json() == dict(page=1, calls=1)
+    etag = response.headers['etag']
+    #
+    response = client.get('/items?page=1&debug=true')
+    assert response.status_code == 200
+    assert response.json() == dict(page=1, calls=1)
+    assert response.headers['etag'] == etag
+    assert response.headers['content-type'] == 'application/json'
+    assert response.headers['content-length'] == str(len(response.content))
+    #
+    response = client.get('/items?page=2')
+    assert response.json() == dict(page=2, calls=2)
+    #
+    response = client.get('/items?page=1', headers={'if-none-match': etag})
+    assert response.status_code == 304
+    assert response.headers['etag'] == etag
+    assert response.content == b''
+    assert client.app.state.CALLS == 2
+    #
+    for value in ('*', f'"other", W/{etag}'):
+        response = client.get('/items?page=1', headers={'if-none-match': value})
+        assert response.status_code == 304
+        assert response.headers['etag'] == etag
+    response = client.get('/items?page=1', headers={'if-none-match': '"other"'})
+    assert response.status_code == 200
+
+
+@pytest.mark.fakeredis
+def test_response_cache_headers(client):
+    for _ in range(2):
+        response = client.get('/users', headers={'accept-language': 'de'})
+        assert response.text == 'de'
+        assert response.headers['x-custom'] == 'custom'
+        response = client.get('/users', headers={'accept-language': 'fr'})
+        assert response.text == 'fr'
+    assert client.app.state.CALLS == 2
+    #
+    for _ in range(2):
+        assert client.get('/plain').status_code == 200
+    assert client.app.state.CALLS == 4
+
+
+@pytest.mark.fakeredis
+def test_response_cache_credentials(client):
+    for _ in range(2):
+        for token in ('a', 'b'):
+            response = client.get('/items', headers={'authorization': f'Bearer {token}'})   # noqa E501
+            assert response.status_code == 200
+        response = client.get('/items', cookies={'session': 'a'})
+        assert response.status_code == 200
+    assert client.app.state.CALLS == 3
+    assert response.json() == dict(page=0, calls=3)
+
+
+def test_response_cache_key():
+    cache = fastapi_plugins.ResponseCache(query_params=['b', 'a'])
+    request = starlette.requests.Request(dict(
+        type='http',
+        method='GET',
+        path='/x',
+        query_string=b'a=1&b=2&c=3',
+        headers=[]
+    ))
+    other = starlette.requests.Request(dict(
+        type='http',
+        method='GET',
+        path='/x',
+        query_string=b'b=2&a=1&c=4',
+        headers=[]
+    ))
+    assert cache.get_key(request) == cache.get_key(other)
+    assert cache.get_key(request).startswith('response:')
+    assert fastapi_plugins.ResponseCache().get_key(request) != fastapi_plugins.ResponseCache().get_key(other)   # noqa E501
+    #
+    data = cache.dumps(200, [('content-type', 'text/plain')], '"etag"', b'\nbody\n')
+    assert cache.loads(data) == (200, [('content-type', 'text/plain')], '"etag"', b'\nbody\n')   # noqa E501
@@ -6,6 +6,12 @@ from __future__ import absolute_import
 
 import asyncio
 import contextlib
+import contextvars
+import datetime
+import os
+import threading
+import time
+import types
 import typing
 import uuid
 
@@ -143,7 +149,22 @@ async def test_health(schedulerapp):
         active=0,
         pending=0,
         limit=100,
-        closed=False
+        closed=False,
+        periodic={},
+        queue=None,
+        fair=dict(running=0, queued=dict(high=0, normal=0, low=0)),
+        executors=dict(
+            thread=dict(
+                workers=min(32, os.cpu_count() + 4),
+                max_tasks_per_child=None,
+                submitted=0,
+                active=0,
+                queued=0,
+                completed=0,
+                failed=0
+            ),
+            process=None
+        )
     )
 
 
@@ -178,3 +199,544 @@ async def test_endpoints(client):
         attempt += 1
     else:
         pytest.fail(f'job {job_id} with timeout {job_timeout} not finished')
+
+
+@pytest.mark.parametrize(
+    'expression, after, expected',
+    [
+        ('*/5 * * * *', '2025-01-01 10:02:30', '2025-01-01 10:05:00'),
+        ('0 3 * * *', '2025-01-01 03:00:00', '2025-01-02 03:00:00'),
+        ('30 8 * * mon-fri', '2025-01-03 09:00:00', '2025-01-06 08:30:00'),
+        ('0 0 29 2 *', '2025-03-01 00:00:00', '2028-02-29 00:00:00'),
+        ('0 0 1,15 * 0', '2025-01-02 00:00:00', '2025-01-05 00:00:00'),
+        ('@monthly', '2025-12-31 23:59:00', '2026-01-01 00:00:00'),
+    ]
+)
+async def test_cron(expression, after, expected):
+    def ts(value):
+        return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc).timestamp()   # noqa E501
+    cron = fastapi_plugins._scheduler_cron.CronExpression(expression)
+    assert cron.next(ts(after)) == ts(expected)
+
+
+async def test_cron_dst():
+    zoneinfo = pytest.importorskip('zoneinfo')
+    tz = zoneinfo.ZoneInfo('Europe/Zurich')
+
+    def ts(*args, fold=0):
+        return datetime.datetime(*args, tzinfo=tz, fold=fold).timestamp()
+    cron = fastapi_plugins._scheduler_cron.CronExpression('* * * * *', tz=tz)
+    assert cron.next(ts(2025, 10, 26, 2, 30, fold=1)) == ts(2025, 10, 26, 2, 31, fold=1)   # noqa E501
+    after = ts(2025, 10, 26, 1, 59)
+    for _ in range(180):
+        assert cron.next(after) == after + 60
+        after += 60
+    # the repeated hour matches twice, the skipped hour never
+    cron = fastapi_plugins._scheduler_cron.CronExpression('30 2 * * *', tz=tz)
+    assert cron.next(ts(2025, 10, 26, 0, 0)) == ts(2025, 10, 26, 2, 30)
+    assert cron.next(ts(2025, 10, 26, 2, 30)) == ts(2025, 10, 26, 2, 30, fold=1)
+    assert cron.next(ts(2025, 10, 26, 2, 30, fold=1)) == ts(2025, 10, 27, 2, 30)
+    assert cron.next(ts(2025, 3, 30, 0, 0)) == ts(2025, 3, 31, 2, 30)
+    cron = fastapi_plugins._scheduler_cron.CronExpression('0 * * * *', tz=tz)
+    assert cron.next(ts(2025, 3, 30, 1, 30)) == ts(2025, 3, 30, 3, 0)
+
+
+@pytest.mark.parametrize(
+    'expression',
+    ['* * * *', '60 * * * *', '* * * 13 *', '5-1 * * * *', '*/0 * * * *', '* * * foo *']   # noqa E501
+)
+async def test_cron_invalid(expression):
+    with pytest.raises(ValueError):
+        fastapi_plugins._scheduler_cron.CronExpression(expression)
+
+
+@pytest.fixture
+async def scheduler():
+    plugin = fastapi_plugins.SchedulerPlugin()
+    await plugin.init_app(fastapi.FastAPI(), fastapi_plugins.SchedulerSettings())   # noqa E501
+    await plugin.init()
+    yield plugin
+    await plugin.terminate()
+
+
+async def test_periodic(scheduler):
+    res = []
+
+    @scheduler.periodic_job(interval=0.1, name='tick')
+    async def tick(value):
+        res.append(value)
+
+    with pytest.raises(fastapi_plugins.SchedulerError):
+        scheduler.add_job(tick, interval=0.1, name='tick')
+    await scheduler.remove_job('tick')
+    scheduler.add_job(tick, interval=0.1, name='tick', args=(1,))
+    await asyncio.sleep(0.35)
+    assert 2 <= len(res) <= 4
+    stats = (await scheduler.health())['periodic']['tick']
+    assert stats['runs'] == len(res)
+    assert stats['failures'] == 0
+    assert stats['next_run'] > time.time()
+    await scheduler.remove_job('tick')
+    count = len(res)
+    await asyncio.sleep(0.2)
+    assert len(res) == count
+
+
+async def test_periodic_invalid(scheduler):
+    async def tick():
+        pass
+
+    with pytest.raises(fastapi_plugins.SchedulerError):
+        scheduler.add_job(tick)
+    with pytest.raises(fastapi_plugins.SchedulerError):
+        scheduler.add_job(tick, interval=1, cron='* * * * *')
+    with pytest.raises(fastapi_plugins.SchedulerError):
+        scheduler.add_job(tick, cron='* * *')
+    with pytest.raises(fastapi_plugins.SchedulerError):
+        scheduler.add_job(lambda: None, interval=1)
+    with pytest.raises(fastapi_plugins.SchedulerError):
+        await scheduler.remove_job('tick')
+
+
+async def test_periodic_start():
+    res = []
+
+    async def tick():
+        res.append(1)
+
+    plugin = fastapi_plugins.SchedulerPlugin()
+    job = plugin.add_job(tick, interval=0.05)
+    await asyncio.sleep(0.1)
+    assert not job.started and res == []
+    await plugin.init_app(fastapi.FastAPI(), fastapi_plugins.SchedulerSettings())   # noqa E501
+    await plugin.init()
+    await asyncio.sleep(0.12)
+    assert job.started and res
+    await plugin.terminate()
+    assert not job.started
+
+
+@pytest.mark.parametrize(
+    'overlap, runs',
+    [
+        (fastapi_plugins.OverlapPolicy.skip, 2),
+        (fastapi_plugins.OverlapPolicy.queue, 4),
+        (fastapi_plugins.OverlapPolicy.concurrent, 6),
+    ]
+)
+async def test_periodic_overlap(scheduler, overlap, runs):
+    res = []
+
+    async def slow():
+        res.append(1)
+        await asyncio.sleep(0.25)
+
+    job = scheduler.add_job(slow, interval=0.1, overlap=overlap)
+    await asyncio.sleep(0.65)
+    assert job.runs == len(res)
+    assert runs - 1 <= job.runs <= runs
+    if overlap == fastapi_plugins.OverlapPolicy.skip:
+        assert job.skipped >= 3
+    elif overlap == fastapi_plugins.OverlapPolicy.queue:
+        assert job.running == 1 and job.queued >= 1
+    else:
+        assert job.running >= 2
+
+
+async def test_periodic_failure(scheduler):
+    async def fail():
+        raise ValueError('ugly error')
+
+    job = scheduler.add_job(fail, interval=0.05)
+    await asyncio.sleep(0.12)
+    assert job.runs == job.failures >= 1
+    assert job.last_error == "ValueError('ugly error')"
+
+
+async def test_periodic_spawn_failure():
+    res = []
+    tasks = []
+
+    async def tick():
+        res.append(1)
+
+    class Scheduler(object):
+        async def spawn(self, coro, name=None):
+            if not tasks:
+                tasks.append(None)
+                raise RuntimeError('Scheduling a new job after closing')
+            tasks.append(asyncio.ensure_future(coro))
+
+    job = fastapi_plugins.PeriodicJob(tick, interval=0.05)
+    job.start(Scheduler())
+    await asyncio.sleep(0.13)
+    assert job.started and len(res) >= 1
+    assert job.running == 0 and job.skipped == 0
+    assert job.last_error == "RuntimeError('Scheduling a new job after closing')"   # noqa E501
+    await job.stop()
+
+
+@pytest.mark.parametrize(
+    'misfire, runs, missed',
+    [
+        (fastapi_plugins.MisfirePolicy.skip, 0, 4),
+        (fastapi_plugins.MisfirePolicy.once, 1, 3),
+        (fastapi_plugins.MisfirePolicy.all, 4, 0),
+    ]
+)
+async def test_periodic_misfire(scheduler, misfire, runs, missed):
+    async def tick():
+        pass
+
+    job = scheduler.add_job(
+        tick,
+        interval=0.1,
+        misfire=misfire,
+        misfire_grace=0.05,
+        overlap=fastapi_plugins.OverlapPolicy.concurrent
+    )
+    await asyncio.sleep(0)
+    # the event loop is blocked for 4 runs
+    time.sleep(job.next_run + 0.35 - time.time())
+    await asyncio.sleep(0.01)
+    assert job.runs == runs
+    assert job.missed == missed
+
+
+async def test_periodic_jitter(scheduler):
+    starts = []
+
+    async def tick():
+        starts.append(time.monotonic())
+
+    job = scheduler.add_job(tick, interval=0.1, jitter=0.05)
+    await asyncio.sleep(0.55)
+    assert len(starts) >= 4
+    for started in starts:
+        offset = (started - job.trigger.start) % 0.1
+        assert offset < 0.07
+
+
+@pytest.mark.fakeredis
+async def test_periodic_singleton():
+    redis = fastapi_plugins.RedisPlugin()
+    await redis.init_app(fastapi.FastAPI(), fastapi_plugins.RedisSettings(redis_type='fakeredis'))   # noqa E501
+    await redis.init()
+    await (await redis()).flushdb()
+    res = []
+
+    async def tick(worker):
+        res.append((worker, fastapi_plugins.current_fencing_token()))
+
+    workers = []
+    for worker in range(3):
+        plugin = fastapi_plugins.SchedulerPlugin()
+        await plugin.init_app(fastapi.FastAPI(), fastapi_plugins.SchedulerSettings(), redis=redis)   # noqa E501
+        await plugin.init()
+        plugin.add_job(tick, interval=0.05, name='tick', singleton=True, lease_ttl=0.3, args=(worker,))   # noqa E501
+        workers.append(plugin)
+    await asyncio.sleep(0.3)
+    assert len(res) >= 4
+    assert len(set(res)) == 1
+    leader, token = res[0]
+    stats = [(await plugin.health())['periodic']['tick']['lease'] for plugin in workers]   # noqa E501
+    assert [s['leader'] for s in stats].count(True) == 1
+    assert stats[leader]['token'] == token
+    # another worker takes over after the release
+    await workers[leader].terminate()
+    res.clear()
+    await asyncio.sleep(0.3)
+    assert res
+    assert len(set(res)) == 1
+    assert res[0][0] != leader and res[0][1] == token + 1
+    for worker, plugin in enumerate(workers):
+        if worker != leader:
+            await plugin.terminate()
+    await redis.terminate()
+
+
+@pytest.fixture
+async def queueredis():
+    redis = fastapi_plugins.RedisPlugin()
+    await redis.init_app(fastapi.FastAPI(), fastapi_plugins.RedisSettings(redis_type='fakeredis'))   # noqa E501
+    await redis.init()
+    await (await redis()).flushdb()
+    yield redis
+    await redis.terminate()
+
+
+async def make_worker(redis, tasks=None, **kwargs):
+    plugin = fastapi_plugins.SchedulerPlugin()
+    for name, func in (tasks or {}).items():
+        plugin.task(name)(func)
+    config = fastapi_plugins.SchedulerSettings(
+        aiojobs_queue_stream='jobs',
+        aiojobs_queue_visibility_timeout=0.3,
+        **kwargs
+    )
+    await plugin.init_app(fastapi.FastAPI(), config, redis=redis)
+    await plugin.init()
+    return plugin
+
+
+@pytest.mark.fakeredis
+async def test_queue(queueredis):
+    res = []
+
+    async def add(a, b=0):
+        res.append(a + b)
+
+    with pytest.raises(fastapi_plugins.SchedulerError):
+        await fastapi_plugins.SchedulerPlugin().enqueue(add, 1)
+    # the jobs are kept until a worker starts
+    producer = await make_worker(queueredis, aiojobs_queue_consume=False)
+    ids = [await producer.enqueue('add', i, b=1) for i in range(5)]
+    assert len(set(ids)) == 5
+    await asyncio.sleep(0.1)
+    assert res == []
+    worker = await make_worker(queueredis, {'add': add})
+    await asyncio.sleep(0.2)
+    assert sorted(res) == [1, 2, 3, 4, 5]
+    await producer.enqueue('unknown')
+    await asyncio.sleep(0.1)
+    queue = (await worker.health())['queue']
+    assert queue['processed'] == 5
+    assert queue['dead'] == 1
+    assert queue['pending'] == 0
+    assert queue['in_flight'] == 0
+    dead = await (await queueredis()).xrange('jobs:dead')
+    assert dead[0][1]['task'] == 'unknown'
+    await producer.terminate()
+    await worker.terminate()
+
+
+@pytest.mark.fakeredis
+async def test_queue_retry(queueredis):
+    res = []
+
+    async def flaky(key):
+        res.append(key)
+        if len(res) < 3:
+            raise ValueError('ugly error')
+
+    async def fail():
+        raise ValueError('ugly error')
+
+    worker = await make_worker(
+        queueredis,
+        {'flaky': flaky, 'fail': fail},
+        aiojobs_queue_max_deliveries=3
+    )
+    await worker.enqueue('flaky', 'a')
+    await worker.enqueue('fail')
+    await asyncio.sleep(2.0)
+    assert res == ['a', 'a', 'a']
+    queue = (await worker.health())['queue']
+    assert queue['processed'] == 1
+    assert queue['failed'] == 5
+    assert queue['reclaimed'] == 5
+    assert queue['dead'] == 1
+    assert queue['pending'] == 0
+    await worker.terminate()
+
+
+@pytest.mark.fakeredis
+async def test_queue_stalled(queueredis):
+    res = []
+
+    async def slow(key):
+        res.append(key)
+        await asyncio.sleep(0.5)
+        res.append(key * 2)
+
+    worker = await make_worker(queueredis, {'slow': slow})
+    other = await make_worker(queueredis, {'slow': slow})
+    await worker.enqueue('slow', 'a')
+    await asyncio.sleep(0.1)
+    # the job in flight is not taken over, while the worker is alive
+    assert res == ['a']
+    await asyncio.sleep(0.6)
+    assert res == ['a', 'aa']
+    assert (await other.health())['queue']['reclaimed'] == 0
+    # the job of a dead worker is taken over
+    await worker.enqueue('slow', 'b')
+    await asyncio.sleep(0.1)
+    dead, alive = (worker, other) if worker.queue.failed or worker.queue._in_flight else (other, worker)   # noqa E501
+    await dead.terminate()
+    await asyncio.sleep(1.0)
+    assert res == ['a', 'aa', 'b', 'b', 'bb']
+    assert (await alive.health())['queue']['reclaimed'] == 1
+    await alive.terminate()
+
+
+def _cpu(n):
+    return sum(i * i for i in range(n)), os.getpid()
+
+
+def _fail():
+    raise ValueError('ugly error')
+
+
+async def test_run_blocking(scheduler):
+    var = contextvars.ContextVar('var')
+    var.set('request')
+
+    def blocking(timeout):
+        time.sleep(timeout)
+        return var.get(), threading.current_thread().name
+
+    started = time.monotonic()
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.create_task(tick())
+    results = await asyncio.gather(*(scheduler.run_blocking(blocking, 0.2) for _ in range(4)))   # noqa E501
+    ticker.cancel()
+    assert time.monotonic() - started < 0.4
+    assert ticks >= 10
+    assert all(value == 'request' for value, _ in results)
+    assert all(name.startswith('fastapi-plugins-scheduler') for _, name in results)   # noqa E501
+    with pytest.raises(ValueError):
+        await scheduler.run_blocking(_fail)
+    stats = (await scheduler.health())['executors']['thread']
+    assert stats['failed'] == 1
+    assert stats['active'] == 0
+    with pytest.raises(fastapi_plugins.SchedulerError):
+        await scheduler.run_cpu(_cpu, 10)
+
+
+async def test_run_cpu():
+    plugin = fastapi_plugins.SchedulerPlugin()
+    config = fastapi_plugins.SchedulerSettings(
+        aiojobs_thread_workers=2,
+        aiojobs_process_workers=2,
+        aiojobs_max_tasks_per_child=1
+    )
+    await plugin.init_app(fastapi.FastAPI(), config)
+    await plugin.init()
+    stats = (await plugin.health())['executors']
+    assert stats['thread']['workers'] == 2
+    assert stats['process']['workers'] == 2
+    assert stats['process']['submitted'] == 0
+    results = await asyncio.gather(*(plugin.run_cpu(_cpu, 1000) for _ in range(4)))   # noqa E501
+    assert [total for total, _ in results] == [332833500] * 4
+    # every process runs one task
+    assert len({pid for _, pid in results}) == 4
+    assert os.getpid() not in {pid for _, pid in results}
+    with pytest.raises(ValueError):
+        await plugin.run_cpu(_fail)
+    stats = (await plugin.health())['executors']['process']
+    assert stats['completed'] == 4
+    assert stats['failed'] == 1
+    await plugin.terminate()
+    with pytest.raises(fastapi_plugins.SchedulerError):
+        await plugin.run_cpu(_cpu, 10)
+
+
+@pytest.mark.parametrize('version_info', [(3, 8), (3, 9)])
+async def test_executor_shutdown(monkeypatch, version_info):
+    # the calls are cancelled by hand before Python 3.9
+    monkeypatch.setattr(fastapi_plugins._scheduler_executor, 'sys', types.SimpleNamespace(version_info=version_info))   # noqa E501
+    pool = fastapi_plugins._scheduler_executor.ExecutorPool('thread', workers=1)   # noqa E501
+    calls = [asyncio.ensure_future(pool.run(time.sleep, 0.1)) for _ in range(3)]   # noqa E501
+    await asyncio.sleep(0.01)
+    pool.shutdown()
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    # the running call finishes, the queued calls are cancelled
+    assert results[0] is None
+    assert all(isinstance(r, asyncio.CancelledError) for r in results[1:])
+    assert pool.stats()['completed'] == 1
+    assert not pool._futures
+
+
+async def test_fair_queue():
+    queue = fastapi_plugins._scheduler_fair.FairQueue(
+        ['high', 'low'],
+        weights=dict(big=2)
+    )
+    for i in range(4):
+        queue.put(f'bulk{i}', 'low', 'bulk')
+        queue.put(f'big{i}', 'low', 'big')
+    queue.put('urgent', 'high')
+    assert len(queue) == 9
+    assert queue.depth('high') == 1 and queue.depth('low') == 8
+    assert list(queue.drain()) == [
+        'urgent',
+        'big0', 'bulk0', 'big1', 'big2', 'bulk1', 'big3', 'bulk2', 'bulk3'
+    ]
+    with pytest.raises(IndexError):
+        queue.get()
+    # an idle tenant does not save up turns
+    queue.put('bulk4', 'low', 'bulk')
+    queue.get()
+    for i in range(2):
+        queue.put(f'bulk{5 + i}', 'low', 'bulk')
+    queue.put('other0', 'low', 'other')
+    assert list(queue.drain()) == ['bulk5', 'other0', 'bulk6']
+    with pytest.raises(ValueError):
+        fastapi_plugins._scheduler_fair.FairQueue(['low'], weights=dict(x=0)).put(1, 'low', 'x')   # noqa E501
+
+
+async def test_spawn_priority():
+    plugin = fastapi_plugins.SchedulerPlugin()
+    config = fastapi_plugins.SchedulerSettings(
+        aiojobs_limit=1,
+        aiojobs_pending_limit=6,
+        aiojobs_tenant_weights=dict(a=2)
+    )
+    await plugin.init_app(fastapi.FastAPI(), config)
+    await plugin.init()
+    res = []
+    gate = asyncio.Event()
+
+    async def job(name):
+        await gate.wait()
+        res.append(name)
+        return name
+
+    first = await plugin.spawn(job('first'))
+    futures = [
+        await plugin.spawn(job(f'{tenant}{i}'), priority='low', tenant=tenant)
+        for i in range(2) for tenant in ('a', 'b')
+    ]
+    futures.append(await plugin.spawn(job('urgent'), priority=fastapi_plugins.Priority.high))   # noqa E501
+    futures.append(await plugin.spawn(job('normal')))
+    with pytest.raises(fastapi_plugins.SchedulerError):
+        await plugin.spawn(job('full'))
+    assert (await plugin.health())['fair'] == dict(
+        running=1,
+        queued=dict(high=1, normal=1, low=4)
+    )
+    gate.set()
+    assert await first == 'first'
+    await asyncio.gather(*futures)
+    assert res == ['first', 'urgent', 'normal', 'a0', 'b0', 'a1', 'b1']
+    assert (await plugin.health())['fair']['running'] == 0
+    # the errors are passed on
+    with pytest.raises(ValueError):
+        await (await plugin.spawn(_async_fail()))
+    await plugin.terminate()
+
+
+async def _async_fail():
+    raise ValueError('ugly error')
+
+
+async def test_spawn_terminate():
+    plugin = fastapi_plugins.SchedulerPlugin()
+    await plugin.init_app(fastapi.FastAPI(), fastapi_plugins.SchedulerSettings(aiojobs_limit=1))   # noqa E501
+    await plugin.init()
+    running = await plugin.spawn(asyncio.sleep(10))
+    waiting = await plugin.spawn(asyncio.sleep(10), priority='low', tenant='a')
+    with pytest.raises(fastapi_plugins.SchedulerError):
+        await plugin.spawn(asyncio.sleep(0), priority='unknown')
+    await plugin.terminate()
+    assert waiting.cancelled()
+    assert running.cancelled()
+    with pytest.raises(fastapi_plugins.SchedulerError):
+        await plugin.spawn(asyncio.sleep(0))